@@ -6,6 +6,7 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     UNIVERSAL_SECRET: str
     ALGORITHM: str
+    TOKEN_CACHE_SIZE: int = 10000   # Verified JWTs kept until they expire (0 verifies every request)
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,181 @@
+import bisect
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from starlette.responses import Response
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and histograms rendered in the Prometheus text
+    exposition format. Samples are kept in plain dicts keyed by label values so
+    that recording one costs a dict lookup and a few additions; the lock only
+    matters for the sync routes and SQS calls running in worker threads.
+    """
+    def __init__(self):
+        self.families: Dict[str, Tuple[str, str, Tuple[str, ...]]] = {}  # name -> (type, help, label names)
+        self.samples: Dict[str, Dict[tuple, object]] = {}
+        self._lock = threading.Lock()
+
+    def declare(self, name: str, kind: str, help: str, labels: Tuple[str, ...] = ()):
+        self.families[name] = (kind, help, labels)
+        self.samples[name] = {}
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1):
+        """Add to a counter or gauge."""
+        samples = self.samples[name]
+        with self._lock:
+            samples[labels] = samples.get(labels, 0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float):
+        """Record a value in a histogram: per-bucket counts, then sum and count."""
+        samples = self.samples[name]
+        with self._lock:
+            histogram = samples.get(labels)
+            if histogram is None:
+                histogram = samples[labels] = [0] * (len(LATENCY_BUCKETS) + 3)
+            histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @staticmethod
+    def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            snapshot = {name: list(samples.items()) for name, samples in self.samples.items()}
+        for name, (kind, help, label_names) in self.families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for values, sample in snapshot[name]:
+                if kind != "histogram":
+                    lines.append(f"{name}{self._labels(label_names, values)} {sample}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), sample):
+                    cumulative += count
+                    le = 'le="' + str(bound) + '"'
+                    lines.append(f"{name}_bucket{self._labels(label_names, values, le)} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(label_names, values)} {sample[-2]}")
+                lines.append(f"{name}_count{self._labels(label_names, values)} {sample[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.declare("http_requests_total", "counter", "HTTP requests handled, by route template and status.", ("method", "route", "status"))
+metrics.declare("http_request_duration_seconds", "histogram", "Time to fully serve an HTTP request.", ("method", "route"))
+metrics.declare("http_requests_in_flight", "gauge", "HTTP requests being served.")
+metrics.declare("websocket_connections", "gauge", "Open WebSocket connections.", ("route",))
+metrics.declare("websocket_connections_total", "counter", "Accepted WebSocket connections.", ("route",))
+metrics.declare("outbound_call_duration_seconds", "histogram", "Latency of calls to other services, Redis and SQS.", ("target", "operation"))
+metrics.declare("outbound_call_errors_total", "counter", "Calls to other services, Redis and SQS that raised.", ("target", "operation"))
+
+
+class timed_call:
+    """
+    Context manager recording the latency of an outbound call made inside the
+    block, in sync or async code. A class rather than a generator, since it
+    wraps every Redis command.
+    """
+    __slots__ = ("labels", "started")
+
+    def __init__(self, target: str, operation: str):
+        self.labels = (target, operation)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        metrics.observe("outbound_call_duration_seconds", self.labels, time.perf_counter() - self.started)
+        if exc_type is not None:
+            metrics.inc("outbound_call_errors_total", self.labels)
+        return False
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and WebSocket connections per route
+    template (`/trip/{trip_id}/breadcrumbs`, not the concrete path), so the
+    number of series stays bounded. Requests that match no route are grouped
+    under `unmatched`.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.routes: Dict[object, str] = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self.routes.get(endpoint)
+        if route is None:
+            self.routes = {
+                getattr(candidate, "endpoint", None): candidate.path
+                for candidate in scope["app"].routes if hasattr(candidate, "path")
+            }
+            route = self.routes.get(endpoint, "unmatched")
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _http(self, scope, receive, send):
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        metrics.inc("http_requests_in_flight")
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.inc("http_requests_in_flight", amount=-1)
+            route = self._route(scope)
+            metrics.inc("http_requests_total", (scope["method"], route, str(status)))
+            metrics.observe("http_request_duration_seconds", (scope["method"], route), time.perf_counter() - started)
+
+    async def _websocket(self, scope, receive, send):
+        accepted = None
+
+        async def send_with_accept(message):
+            nonlocal accepted
+            if message["type"] == "websocket.accept" and accepted is None:
+                accepted = (self._route(scope),)
+                metrics.inc("websocket_connections", accepted)
+                metrics.inc("websocket_connections_total", accepted)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_accept)
+        finally:
+            if accepted is not None:
+                metrics.inc("websocket_connections", accepted, -1)
+
+
+async def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import jwt
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of JWTs whose signature has already been verified with one secret.
+
+    Entries are keyed by the SHA-256 digest of the token and hold its decoded
+    claims until the `exp` claim, after which the token fails with
+    `jwt.ExpiredSignatureError` exactly as `jwt.decode` would. Tokens that fail
+    verification are never cached. The cache is shared by the sync dependencies
+    FastAPI runs in its thread pool, hence the lock.
+    """
+    def __init__(self, secret: str, algorithms: List[str], max_entries: int):
+        self.secret = secret
+        self.algorithms = algorithms
+        self.max_entries = max_entries
+        self.cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def _cached(self, digest: bytes) -> Optional[dict]:
+        with self._lock:
+            entry = self.cache.get(digest)
+            if entry is None:
+                return None
+            expires_at, claims = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self.cache[digest]
+                self.expired += 1
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            self.cache.move_to_end(digest)
+            self.hits += 1
+            return claims
+
+    def _store(self, digest: bytes, claims: dict):
+        expires_at = claims.get("exp")
+        with self._lock:
+            self.cache[digest] = (float(expires_at) if expires_at is not None else None, claims)
+            self.cache.move_to_end(digest)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def decode(self, token: str) -> dict:
+        """Claims of a token, verifying its signature only the first time it is seen."""
+        if self.max_entries <= 0:
+            return jwt.decode(token, self.secret, algorithms=self.algorithms)
+
+        digest = hashlib.sha256(token.encode()).digest()
+        claims = self._cached(digest)
+        if claims is None:
+            self.misses += 1
+            claims = jwt.decode(token, self.secret, algorithms=self.algorithms)
+            self._store(digest, claims)
+        return dict(claims)  # Callers may modify their copy
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cache_size": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
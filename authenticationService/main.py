@@ -3,6 +3,7 @@ import warnings
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.utils.metrics import MetricsMiddleware, metrics_endpoint
 from app.routes.auth import router as auth_router
 from app.routes.customer import router as customer_router
 from app.routes.driver import router as driver_router
@@ -21,8 +22,10 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
 )
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(customer_router, prefix="/customer", tags=["customer"])
 app.include_router(driver_router, prefix="/driver", tags=["driver"])
-app.include_router(vehicle_router, prefix="/vehicle", tags=["vehicle"])
\ No newline at end of file
+app.include_router(vehicle_router, prefix="/vehicle", tags=["vehicle"])
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
@@ -0,0 +1,193 @@
+import asyncio
+import math
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from config import settings
+
+
+METRES_PER_DEGREE = 111_320.0
+
+
+class BatchAssignment(NamedTuple):
+    """Outcome of a batch for one booking."""
+    driver_id: Optional[str]    # Driver assigned to the booking, if any
+    taken: Set[str]             # Candidates assigned to other bookings of the batch
+
+
+def min_cost_assignment(cost: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Minimum-cost matching of the rows of a (possibly rectangular) cost matrix to
+    its columns, with the Hungarian method in its shortest augmenting path form
+    (O(n^2 m) for n <= m, the inner scan vectorized). Infinite costs mark pairs
+    that must not be matched. Returns the matched row and column indices, by row.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+
+    # Forbidden pairs get a cost higher than any complete matching of allowed ones,
+    # so they are only used when a row has nothing else, and dropped afterwards
+    allowed = np.isfinite(cost)
+    forbidden = (np.abs(cost[allowed]).max() + 1.0) * (cost.shape[0] + 1) if allowed.any() else 1.0
+    matrix = np.where(allowed, cost, forbidden)
+
+    rows, columns = matrix.shape
+    row_potential = np.zeros(rows + 1)
+    column_potential = np.zeros(columns + 1)
+    matched_row = np.zeros(columns + 1, dtype=np.intp)    # 1-based row matched to each column, 0 if none
+    previous = np.zeros(columns + 1, dtype=np.intp)
+    for row in range(1, rows + 1):
+        matched_row[0] = row
+        column = 0
+        slack = np.full(columns + 1, np.inf)
+        used = np.zeros(columns + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current = matrix[matched_row[column] - 1] - row_potential[matched_row[column]] - column_potential[1:]
+            free = ~used[1:]
+            improved = free & (current < slack[1:])
+            slack[1:][improved] = current[improved]
+            previous[1:][improved] = column
+            candidates = np.where(free, slack[1:], np.inf)
+            next_column = int(np.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+            row_potential[matched_row[used]] += delta
+            column_potential[used] -= delta
+            slack[1:][free] -= delta
+            column = next_column
+            if matched_row[column] == 0:
+                break
+        # Flip the augmenting path
+        while column:
+            matched_row[column] = matched_row[previous[column]]
+            column = previous[column]
+
+    matched_columns = np.flatnonzero(matched_row[1:])
+    matched_rows = matched_row[1:][matched_columns] - 1
+    keep = allowed[matched_rows, matched_columns]
+    matched_rows, matched_columns = matched_rows[keep], matched_columns[keep]
+    if transposed:
+        matched_rows, matched_columns = matched_columns, matched_rows
+    order = np.argsort(matched_rows)
+    return matched_rows[order], matched_columns[order]
+
+
+def plan_batch(candidate_lists: List[List[Dict]]) -> List[BatchAssignment]:
+    """
+    Assign drivers to a batch of bookings so that the total pickup distance is
+    minimal. Each booking can only get one of its own candidates (as returned by
+    the Location Service, so vehicle type and search radius are respected).
+    """
+    driver_slots: Dict[str, int] = {}
+    for candidates in candidate_lists:
+        for driver in candidates:
+            driver_slots.setdefault(driver["driver_id"], len(driver_slots))
+
+    cost = np.full((len(candidate_lists), len(driver_slots)), np.inf)
+    for booking, candidates in enumerate(candidate_lists):
+        for driver in candidates:
+            cost[booking, driver_slots[driver["driver_id"]]] = float(driver["distance"])
+
+    driver_ids = list(driver_slots)
+    assigned: List[Optional[str]] = [None] * len(candidate_lists)
+    for booking, slot in zip(*min_cost_assignment(cost)):
+        assigned[booking] = driver_ids[slot]
+
+    all_assigned = {driver_id for driver_id in assigned if driver_id is not None}
+    return [
+        BatchAssignment(driver_id, {driver["driver_id"] for driver in candidates if driver["driver_id"] in all_assigned} - {driver_id})
+        for driver_id, candidates in zip(assigned, candidate_lists)
+    ]
+
+
+def prioritise(candidates: List[Dict], assignment: BatchAssignment) -> List[Dict]:
+    """
+    Reorder ranked candidates after a batch: the assigned driver first, then the
+    drivers nobody else in the batch was given, then those assigned elsewhere.
+    """
+    first = [driver for driver in candidates if driver["driver_id"] == assignment.driver_id]
+    free = [driver for driver in candidates if driver["driver_id"] != assignment.driver_id and driver["driver_id"] not in assignment.taken]
+    taken = [driver for driver in candidates if driver["driver_id"] in assignment.taken]
+    return first + free + taken
+
+
+def area_key(latitude: float, longitude: float, area_m: float) -> Tuple[int, int]:
+    """Square cell of roughly `area_m` a side containing a position."""
+    size = area_m / METRES_PER_DEGREE
+    return math.floor(latitude / size), math.floor(longitude / size)
+
+
+class BookingBatcher:
+    """
+    Collects the bookings of an area for a short window and assigns their drivers
+    together, instead of letting each booking grab its nearest drivers as it
+    arrives and leave its neighbours with the ones further away.
+
+    The first booking of an area opens a window of `window` seconds; every booking
+    of the area submitted meanwhile joins it. A window closes early once it holds
+    `max_size` bookings, which bounds the cost of the assignment. Batches are per
+    worker process.
+    """
+    def __init__(self, window: float, area_m: float, max_size: int):
+        self.window = window
+        self.area_m = area_m
+        self.max_size = max_size
+        self.pending: Dict[Tuple[int, int], List[Tuple[List[Dict], asyncio.Future]]] = {}
+
+        # Metrics
+        self.batches = 0
+        self.bookings = 0
+        self.assigned = 0
+
+    async def submit(self, latitude: float, longitude: float, candidates: List[Dict]) -> BatchAssignment:
+        """Wait for the batch of the booking's area to close and return the booking's assignment."""
+        key = area_key(latitude, longitude, self.area_m)
+        future = asyncio.get_running_loop().create_future()
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = []
+            asyncio.get_running_loop().call_later(self.window, self._close, key, batch)
+        batch.append((candidates, future))
+        if len(batch) >= self.max_size:
+            self._close(key, batch)
+        return await future
+
+    def _close(self, key: Tuple[int, int], batch: List[Tuple[List[Dict], asyncio.Future]]):
+        if self.pending.get(key) is not batch:
+            return  # Already closed early
+        del self.pending[key]
+        waiting = [(candidates, future) for candidates, future in batch if not future.done()]
+        if not waiting:
+            return
+        try:
+            assignments = plan_batch([candidates for candidates, _ in waiting])
+        except Exception as e:
+            print("Error assigning a batch of bookings: ", str(e))
+            assignments = [BatchAssignment(None, set())] * len(waiting)
+
+        self.batches += 1
+        self.bookings += len(waiting)
+        for (_, future), assignment in zip(waiting, assignments):
+            self.assigned += assignment.driver_id is not None
+            future.set_result(assignment)
+
+    def stats(self) -> dict:
+        return {
+            "window_s": self.window,
+            "batches": self.batches,
+            "bookings": self.bookings,
+            "assigned": self.assigned,
+            "mean_batch_size": round(self.bookings / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+booking_batcher = BookingBatcher(
+    settings.BATCH_MATCHING_WINDOW_S,
+    area_m=settings.BATCH_MATCHING_AREA_M,
+    max_size=settings.BATCH_MATCHING_MAX_SIZE,
+)
@@ -0,0 +1,189 @@
+"""
+Simulated surge comparing greedy matching, where every booking is dispatched
+as soon as it arrives, with batch matching over windows of a few seconds.
+
+Bookings arrive at random over the surge, most of them around a few venues,
+in a square city with a fixed fleet. A booking's candidates are its closest
+free drivers within the search radius, as the Location Service would return
+them. Greedy matching offers them closest first. Batch matching fetches more
+candidates per booking, plans the bookings of each area and window together
+with `batching.plan_batch` and offers them in `batching.prioritise` order. An offered driver accepts with a fixed
+probability, the same for a given booking and driver in both modes. Matched
+drivers are busy for a trip and then become free where it ended.
+
+Run from the driverMatchingService directory (no Redis needed):
+
+    python -m benchmarks.batch_matching --bookings 1500 --drivers 400 --windows 1,2,5
+"""
+import argparse
+import heapq
+import random
+import statistics
+
+import numpy as np
+
+from batching import METRES_PER_DEGREE, area_key, plan_batch, prioritise
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=1500)
+    parser.add_argument("--drivers", type=int, default=400)
+    parser.add_argument("--surge", type=float, default=600, help="Seconds over which the bookings arrive")
+    parser.add_argument("--city", type=float, default=8000, help="Side of the city in metres")
+    parser.add_argument("--venues", type=int, default=4, help="Hot spots most bookings come from")
+    parser.add_argument("--venue-share", type=float, default=0.6)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--batch-candidates", type=int, default=30, help="Candidates fetched per booking in batch mode")
+    parser.add_argument("--max-radius", type=float, default=5000)
+    parser.add_argument("--accept-rate", type=float, default=0.7)
+    parser.add_argument("--trip", type=float, default=900, help="Mean seconds a matched driver stays busy")
+    parser.add_argument("--area", type=float, default=5000)
+    parser.add_argument("--windows", default="1,2,5", help="Batch windows to compare, in seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+options = parse_options()
+
+
+def scenario(rng: random.Random):
+    venues = [(rng.uniform(0, options.city), rng.uniform(0, options.city)) for _ in range(options.venues)]
+    bookings = []
+    for booking in range(options.bookings):
+        if rng.random() < options.venue_share:
+            x, y = rng.choice(venues)
+            x, y = x + rng.gauss(0, 300), y + rng.gauss(0, 300)
+        else:
+            x, y = rng.uniform(0, options.city), rng.uniform(0, options.city)
+        bookings.append((rng.uniform(0, options.surge), booking, x, y))
+    bookings.sort()
+    drivers = np.array([(rng.uniform(0, options.city), rng.uniform(0, options.city)) for _ in range(options.drivers)])
+    return bookings, drivers
+
+
+def accepts(booking: int, driver: int) -> bool:
+    return random.Random(booking * 1_000_003 + driver).random() < options.accept_rate
+
+
+class Fleet:
+    def __init__(self, positions: np.ndarray, seed: int):
+        self.positions = positions.copy()
+        self.free = np.ones(len(positions), dtype=bool)
+        self.returns = []  # (time, driver) of busy drivers
+        self.rng = random.Random(seed)
+
+    def advance(self, now: float):
+        while self.returns and self.returns[0][0] <= now:
+            _, driver = heapq.heappop(self.returns)
+            self.free[driver] = True
+
+    def candidates(self, x: float, y: float, count: int):
+        """Closest free drivers within the search radius, as /nearest returns them."""
+        distances = np.hypot(self.positions[:, 0] - x, self.positions[:, 1] - y)
+        eligible = np.flatnonzero(self.free & (distances <= options.max_radius))
+        closest = eligible[np.argsort(distances[eligible], kind="stable")][:count]
+        return [{"driver_id": int(driver), "distance": float(distances[driver])} for driver in closest]
+
+    def dispatch(self, now: float, booking: int, candidates):
+        """Offer the booking down the list; returns the pickup distance, or None if nobody accepted."""
+        for driver in candidates:
+            driver_id = driver["driver_id"]
+            if self.free[driver_id] and accepts(booking, driver_id):
+                self.free[driver_id] = False
+                self.positions[driver_id] = (self.rng.uniform(0, options.city), self.rng.uniform(0, options.city))
+                heapq.heappush(self.returns, (now + self.rng.expovariate(1 / options.trip), driver_id))
+                return driver["distance"]
+        return None
+
+
+def greedy(bookings, drivers):
+    fleet = Fleet(drivers, options.seed)
+    pickups, waits = [], []
+    for arrival, booking, x, y in bookings:
+        fleet.advance(arrival)
+        pickups.append(fleet.dispatch(arrival, booking, fleet.candidates(x, y, options.candidates)))
+        waits.append(0.0)
+    return pickups, waits
+
+
+def arrival_order(candidate_lists):
+    """(matched, total distance) of giving each booking of a batch its closest remaining candidate."""
+    taken, matched, total = set(), 0, 0.0
+    for candidates in candidate_lists:
+        for driver in candidates:
+            if driver["driver_id"] not in taken:
+                taken.add(driver["driver_id"])
+                matched += 1
+                total += driver["distance"]
+                break
+    return matched, total
+
+
+def batched(bookings, drivers, window: float):
+    fleet = Fleet(drivers, options.seed)
+    pickups, waits = [], []
+    within = [0, 0.0, 0, 0.0]  # Over batches of 2+: planned matched, distance; arrival order matched, distance
+    open_batches = {}   # area -> (closes at, [(arrival, booking, candidates)])
+    closing = []        # (closes at, area)
+
+    def close_until(now: float):
+        while closing and closing[0][0] <= now:
+            closes_at, area = heapq.heappop(closing)
+            fleet.advance(closes_at)
+            _, batch = open_batches.pop(area)
+            candidate_lists = [candidates for _, _, candidates in batch]
+            planned = list(zip(batch, plan_batch(candidate_lists)))
+            if len(batch) > 1:
+                assigned = [(assignment.driver_id, candidates) for (_, _, candidates), assignment in planned if assignment.driver_id is not None]
+                within[0] += len(assigned)
+                within[1] += sum(driver["distance"] for driver_id, candidates in assigned for driver in candidates if driver["driver_id"] == driver_id)
+                greedy_matched, greedy_total = arrival_order(candidate_lists)
+                within[2] += greedy_matched
+                within[3] += greedy_total
+            # Bookings left without a driver only have drivers assigned to others; let those go first
+            planned.sort(key=lambda entry: entry[1].driver_id is None)
+            for (arrival, booking, candidates), assignment in planned:
+                ordered = prioritise(candidates, assignment)[:options.candidates]
+                pickups.append(fleet.dispatch(closes_at, booking, ordered))
+                waits.append(closes_at - arrival)
+
+    for arrival, booking, x, y in bookings:
+        close_until(arrival)
+        fleet.advance(arrival)
+        area = area_key(y / METRES_PER_DEGREE, x / METRES_PER_DEGREE, options.area)
+        if area not in open_batches:
+            open_batches[area] = (arrival + window, [])
+            heapq.heappush(closing, (arrival + window, area))
+        open_batches[area][1].append((arrival, booking, fleet.candidates(x, y, options.batch_candidates)))
+    close_until(float("inf"))
+    return pickups, waits, within
+
+
+def report(label: str, pickups, waits, within=None):
+    matched = [distance for distance in pickups if distance is not None]
+    percentiles = statistics.quantiles(matched, n=10)
+    print(
+        f"{label:>14}: matched {len(matched) / len(pickups):6.1%}, pickup distance mean {statistics.fmean(matched):6.0f} m, "
+        f"p50 {percentiles[4]:6.0f} m, p90 {percentiles[8]:6.0f} m, batching wait mean {statistics.fmean(waits):4.2f} s"
+    )
+    if within and within[0] and within[2]:
+        print(
+            f"{'':>16}within batches of 2+, before acceptance: planned {within[0]} matches, {within[1] / within[0]:6.0f} m mean; "
+            f"arrival order {within[2]} matches, {within[3] / within[2]:6.0f} m mean"
+        )
+
+
+def main():
+    bookings, drivers = scenario(random.Random(options.seed))
+    print(
+        f"{options.bookings} bookings over {options.surge:.0f} s, {options.drivers} drivers, "
+        f"{options.city / 1000:.0f} km city, accept rate {options.accept_rate:.0%}"
+    )
+    report("greedy", *greedy(bookings, drivers))
+    for window in (float(window) for window in options.windows.split(",")):
+        report(f"batch {window:g} s", *batched(bookings, drivers, window))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Latency of the HTTP calls on the booking path (driver search, then trip
+creation) with a new `httpx.AsyncClient` per call, as before, against the
+pooled clients of `http_clients`.
+
+Both upstreams are served by a local uvicorn app, optionally with an added
+response delay, so the difference is connection setup and client creation on
+loopback. Against remote services, and TLS upstreams in particular, each new
+connection also costs network round trips.
+
+Run from the driverMatchingService directory:
+
+    python -m benchmarks.booking_http_latency --bookings 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from http_clients import http_clients
+from metrics import metrics
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds each upstream takes to answer")
+    return parser.parse_args()
+
+
+options = parse_options()
+DRIVERS = [{"driver_id": f"driver-{slot}", "distance": 100.0 * slot, "rating": "4.5"} for slot in range(10)]
+
+
+async def nearest(request):
+    await request.json()
+    if options.delay:
+        await asyncio.sleep(options.delay)
+    return JSONResponse({"drivers": DRIVERS, "radius": 1000})
+
+
+async def trips(request):
+    await request.json()
+    if options.delay:
+        await asyncio.sleep(options.delay)
+    return JSONResponse({"trip_id": "bench"}, status_code=201)
+
+
+upstream = Starlette(routes=[Route("/nearest", nearest, methods=["POST"]), Route("/trips", trips, methods=["POST"])])
+
+
+async def booking_per_call(base_url: str):
+    async with httpx.AsyncClient() as client:
+        response = await client.post(base_url + "/nearest", json={"latitude": 12.97, "longitude": 77.59, "k": 10})
+        response.raise_for_status()
+        drivers = response.json()["drivers"]
+    async with httpx.AsyncClient() as client:
+        response = await client.post(base_url + "/trips", json={"driver_id": drivers[0]["driver_id"]})
+        response.raise_for_status()
+
+
+async def booking_pooled(base_url: str):
+    response = await http_clients.get("location_service").post(
+        base_url + "/nearest", json={"latitude": 12.97, "longitude": 77.59, "k": 10}
+    )
+    response.raise_for_status()
+    drivers = response.json()["drivers"]
+    response = await http_clients.get("trip_service").post(base_url + "/trips", json={"driver_id": drivers[0]["driver_id"]})
+    response.raise_for_status()
+
+
+async def run(label: str, booking, base_url: str):
+    semaphore = asyncio.Semaphore(options.concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await booking(base_url)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(options.bookings)))
+    elapsed = time.perf_counter() - started
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{label:>9}: booking HTTP calls p50 {percentiles[49]:6.2f} ms, p90 {percentiles[89]:6.2f} ms, "
+        f"p99 {percentiles[98]:6.2f} ms, {options.bookings / elapsed:7.0f} bookings/s"
+    )
+
+
+async def main():
+    server = uvicorn.Server(uvicorn.Config(upstream, host="127.0.0.1", port=options.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    base_url = f"http://127.0.0.1:{options.port}"
+    try:
+        print(f"{options.bookings} bookings, {options.concurrency} at a time, upstream delay {options.delay * 1000:.0f} ms")
+        await run("per-call", booking_per_call, base_url)
+        await http_clients.start()
+        await run("pooled", booking_pooled, base_url)
+        reuse = metrics.samples["http_client_requests_total"]
+        for name in ("location_service", "trip_service"):
+            print(f"{name:>17}: {reuse.get((name, 'new'), 0)} new connections, {reuse.get((name, 'reused'), 0)} reused")
+    finally:
+        await http_clients.close()
+        server.should_exit = True
+        await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""
+Cost of ranking the candidates of a booking: scoring the feature arrays in
+NumPy, building the arrays from the Location Service's driver dicts, and
+`CandidateRanker.rank` end to end for the top 10 and for the full order,
+against scoring each driver dict in a Python loop.
+
+Candidates and their stats are random. Run from the driverMatchingService
+directory (no Redis needed):
+
+    python -m benchmarks.candidate_ranking --candidates 10000
+"""
+import argparse
+import random
+import time
+import timeit
+
+import numpy as np
+
+from ranking import (
+    CandidateRanker, RankingWeights, DEFAULT_RATING, ACCEPTANCE_PRIOR, ACCEPTANCE_PRIOR_OFFERS,
+    IDLE_CAP_S, MAX_ETA_S, DETOUR_FACTOR, CITY_SPEED_MPS,
+)
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=10000)
+    parser.add_argument("--max-distance", type=float, default=10000)
+    parser.add_argument("--repeat", type=int, default=200)
+    return parser.parse_args()
+
+
+def random_candidates(count: int, max_distance: float):
+    now = time.time()
+    drivers, stats = [], []
+    for slot in range(count):
+        drivers.append({
+            "driver_id": f"driver-{slot}",
+            "distance": random.uniform(0, max_distance),
+            "rating": str(round(random.uniform(3.0, 5.0), 1)) if random.random() < 0.9 else None,
+        })
+        offers = random.randint(0, 50)
+        stats.append((
+            str(offers) if offers else None,
+            str(random.randint(0, offers)) if offers else None,
+            str(int(now - random.uniform(0, 3600))) if random.random() < 0.8 else None,
+        ))
+    return drivers, stats
+
+
+def python_scores(drivers, stats, weights: RankingWeights, max_distance: float, now: float):
+    """The same model, one driver dict at a time."""
+    total = sum(weights)
+    scores = []
+    for driver, (offers, accepts, assigned_at) in zip(drivers, stats):
+        distance = float(driver["distance"])
+        rating = float(driver["rating"]) if driver["rating"] else DEFAULT_RATING
+        acceptance = (float(accepts or 0) + ACCEPTANCE_PRIOR * ACCEPTANCE_PRIOR_OFFERS) / (float(offers or 0) + ACCEPTANCE_PRIOR_OFFERS)
+        idle = now - float(assigned_at) if assigned_at else IDLE_CAP_S
+        eta = distance * DETOUR_FACTOR / CITY_SPEED_MPS
+        scores.append((
+            weights.distance * (1.0 - min(distance / max_distance, 1.0))
+            + weights.rating * (min(max(rating, 1.0), 5.0) - 1.0) / 4.0
+            + weights.acceptance * min(max(acceptance, 0.0), 1.0)
+            + weights.idle * min(idle / IDLE_CAP_S, 1.0)
+            + weights.eta * (1.0 - min(eta / MAX_ETA_S, 1.0))
+        ) / total)
+    return scores
+
+
+def best_of(function, repeat: int) -> float:
+    """Best time of one call, in microseconds."""
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1e6
+
+
+def main():
+    options = parse_options()
+    weights = RankingWeights(distance=0.3, rating=0.2, acceptance=0.2, idle=0.1, eta=0.2)
+    ranker = CandidateRanker(weights, max_distance_m=options.max_distance)
+    drivers, stats = random_candidates(options.candidates, options.max_distance)
+    now = time.time()
+    features = ranker.features(drivers, stats, now)
+
+    reference = python_scores(drivers, stats, weights, options.max_distance, now)
+    assert np.allclose(ranker.score(features), reference, atol=1e-9), "NumPy and Python scores differ"
+    assert ranker.rank(drivers, stats, limit=10) == ranker.rank(drivers, stats)[:10], "Top 10 differs from the full order"
+
+    print(f"{options.candidates} candidates, best of {options.repeat}")
+    print(f"  score (NumPy)            {best_of(lambda: ranker.score(features), options.repeat):10.1f} us")
+    print(f"  features from dicts      {best_of(lambda: ranker.features(drivers, stats), options.repeat):10.1f} us")
+    print(f"  rank, top 10             {best_of(lambda: ranker.rank(drivers, stats, limit=10), options.repeat):10.1f} us")
+    print(f"  rank, full order         {best_of(lambda: ranker.rank(drivers, stats), options.repeat):10.1f} us")
+    print(f"  score (Python loop)      {best_of(lambda: python_scores(drivers, stats, weights, options.max_distance, now), options.repeat):10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
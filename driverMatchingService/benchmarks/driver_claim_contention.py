@@ -0,0 +1,164 @@
+"""
+Many matchers competing for a small pool of drivers, comparing three ways of
+claiming a wave of candidates:
+
+    check-then-set  the original pattern: GET the driver state, then SET it to
+                    'locked' if it was free (two round trips per driver, racy)
+    set-nx          one SET NX per candidate, issued concurrently
+    claim           the owner-token lease script, one round trip per wave
+
+Each matcher repeatedly picks a wave of random drivers from the pool, claims
+what it can, holds the drivers for a moment and releases them. Every claim is
+checked against an in-process record of who holds each driver, so a driver
+handed to two matchers at once shows up as a double claim. --rtt adds a
+network delay to every round trip, as against a Redis on another host.
+
+Run from the driverMatchingService directory against a scratch Redis:
+
+    python -m benchmarks.driver_claim_contention --redis-url redis://127.0.0.1:6379/15 --matchers 200 --drivers 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/15")
+    parser.add_argument("--matchers", type=int, default=200, help="Concurrent matchers")
+    parser.add_argument("--drivers", type=int, default=20, help="Size of the driver pool")
+    parser.add_argument("--rounds", type=int, default=20, help="Waves claimed by each matcher")
+    parser.add_argument("--wave-size", type=int, default=3)
+    parser.add_argument("--hold", type=float, default=0.005, help="Seconds a wave is held before release")
+    parser.add_argument("--lease", type=int, default=30)
+    parser.add_argument("--rtt", type=float, default=0.0005, help="Seconds of network delay added to each round trip")
+    return parser.parse_args()
+
+
+options = parse_options()
+os.environ["REDIS_URL"] = options.redis_url
+
+from redis_client import redis_client, driver_state_key, claim_drivers, release_drivers  # noqa: E402 (the Redis client reads REDIS_URL at import)
+
+
+async def round_trip(command):
+    """Run a Redis command with --rtt of delay, half on the way there and half on the way back."""
+    await asyncio.sleep(options.rtt / 2)
+    result = await command
+    await asyncio.sleep(options.rtt / 2)
+    return result
+
+
+class Tally:
+    def __init__(self):
+        self.holders = {}
+        self.attempts = 0
+        self.claims = 0
+        self.double_claims = 0
+        self.round_trips = 0
+
+    def claimed(self, matcher: str, driver_ids):
+        for driver_id in driver_ids:
+            if driver_id in self.holders:
+                self.double_claims += 1
+            self.holders[driver_id] = matcher
+        self.claims += len(driver_ids)
+
+    def released(self, matcher: str, driver_ids):
+        for driver_id in driver_ids:
+            if self.holders.get(driver_id) == matcher:
+                del self.holders[driver_id]
+
+
+async def check_then_set(wave, owner: str, tally: Tally):
+    async def lock(driver_id: str) -> bool:
+        state = await round_trip(redis_client.get(driver_state_key(driver_id)))
+        if state and state != "free":
+            return False
+        await round_trip(redis_client.set(driver_state_key(driver_id), "locked", ex=options.lease))
+        return True
+
+    locked = await asyncio.gather(*(lock(driver_id) for driver_id in wave))
+    tally.round_trips += len(wave) + sum(locked)
+    return [driver_id for driver_id, is_locked in zip(wave, locked) if is_locked]
+
+
+async def release_unchecked(driver_ids, owner: str, tally: Tally):
+    await asyncio.gather(*(round_trip(redis_client.set(driver_state_key(driver_id), "free", ex=60)) for driver_id in driver_ids))
+    tally.round_trips += len(driver_ids)
+
+
+async def set_nx(wave, owner: str, tally: Tally):
+    locked = await asyncio.gather(*(
+        round_trip(redis_client.set(driver_state_key(driver_id), f"locked:{owner}", nx=True, ex=options.lease)) for driver_id in wave
+    ))
+    tally.round_trips += len(wave)
+    return [driver_id for driver_id, is_locked in zip(wave, locked) if is_locked]
+
+
+async def release_owned(driver_ids, owner: str, tally: Tally):
+    if driver_ids:
+        await round_trip(release_drivers(driver_ids, owner))
+        tally.round_trips += 1
+
+
+async def claim(wave, owner: str, tally: Tally):
+    tally.round_trips += 1
+    return await round_trip(claim_drivers(wave, owner, options.lease))
+
+
+STRATEGIES = {
+    "check-then-set": (check_then_set, release_unchecked),
+    "set-nx": (set_nx, release_owned),
+    "claim": (claim, release_owned),
+}
+
+
+async def run(strategy: str):
+    acquire, release = STRATEGIES[strategy]
+    pool = [f"bench-{driver}" for driver in range(options.drivers)]
+    tally = Tally()
+
+    async def matcher():
+        owner = uuid.uuid4().hex
+        for _ in range(options.rounds):
+            wave = random.sample(pool, min(options.wave_size, len(pool)))
+            tally.attempts += len(wave)
+            claimed = await acquire(wave, owner, tally)
+            tally.claimed(owner, claimed)
+            await asyncio.sleep(options.hold)
+            tally.released(owner, claimed)
+            await release(claimed, owner, tally)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(matcher() for _ in range(options.matchers)))
+    elapsed = time.perf_counter() - started
+    print(
+        f"{strategy:>15}: {tally.claims:6d} claims of {tally.attempts} attempts, "
+        f"{tally.double_claims:5d} double claims, {tally.round_trips / tally.attempts:4.2f} round trips per candidate, "
+        f"{tally.claims / elapsed:8.0f} claims/s"
+    )
+
+
+async def cleanup():
+    keys = [key async for key in redis_client.scan_iter(match="driver:bench-*", count=1000)]
+    if keys:
+        await redis_client.delete(*keys)
+
+
+async def main():
+    print(f"{options.matchers} matchers, {options.drivers} drivers, {options.rounds} waves of {options.wave_size} each")
+    try:
+        for strategy in STRATEGIES:
+            await cleanup()
+            await run(strategy)
+    finally:
+        await cleanup()
+        await redis_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,171 @@
+"""
+Time-to-match of wave dispatch against the original strategy of offering the
+trip to one driver at a time and waiting out the full timeout for each.
+
+Drivers are simulated: each one accepts, declines or ignores the offer after a
+random response time, and answers through the same Redis helpers the
+/driver/response endpoint uses. Both strategies see the same drivers. Offers go
+through `notifications.notify_driver`, with an SQS client whose calls block for
+--sqs-latency like boto3's do. Timeouts, response times and SQS latency are
+scaled down by --time-scale to keep the run short, and reported times are
+scaled back up.
+
+Run from the driverMatchingService directory against a scratch Redis:
+
+    python -m benchmarks.time_to_match --redis-url redis://127.0.0.1:6379/15 --bookings 200
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import time
+import uuid
+from unittest import mock
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/15")
+    parser.add_argument("--bookings", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--wave-size", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=15.0, help="Seconds a driver (or wave) has to answer")
+    parser.add_argument("--accept-rate", type=float, default=0.25)
+    parser.add_argument("--ignore-rate", type=float, default=0.3, help="Drivers who never answer")
+    parser.add_argument("--sqs-latency", type=float, default=0.05, help="Seconds each SQS request blocks for")
+    parser.add_argument("--time-scale", type=float, default=0.02)
+    return parser.parse_args()
+
+
+options = parse_options()
+os.environ["REDIS_URL"] = options.redis_url
+
+from dispatch import dispatch_in_waves, booking_responses  # noqa: E402 (the Redis client reads REDIS_URL at import)
+from redis_client import redis_client, claim_drivers, release_drivers, reset_booking, open_wave, close_wave, claim_booking, decline_offer  # noqa: E402
+
+
+class SimulatedSqs:
+    """Stands in for the boto3 SQS client: requests block the calling thread."""
+    def get_queue_url(self, QueueName: str) -> dict:
+        return {"QueueUrl": f"https://sqs.local/{QueueName}"}
+
+    def send_message(self, QueueUrl: str, MessageBody: str) -> dict:
+        time.sleep(options.sqs_latency * options.time_scale)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+with mock.patch("boto3.client", lambda *args, **kwargs: SimulatedSqs()):
+    from notifications import notify_driver  # noqa: E402
+
+
+def simulated_drivers(booking: int):
+    """(driver id, answer, response time in s) of a booking's candidates, best first."""
+    drivers = []
+    for rank in range(options.candidates):
+        roll = random.random()
+        answer = "accepted" if roll < options.accept_rate else "ignored" if roll < options.accept_rate + options.ignore_rate else "denied"
+        drivers.append((f"bench-{booking}-{rank}", answer, random.uniform(2.0, 12.0)))
+    return drivers
+
+
+def make_offer(customer_id: str, drivers):
+    """Offer callback whose drivers answer like the /driver/response endpoint."""
+    behaviour = {driver_id: (answer, delay) for driver_id, answer, delay in drivers}
+
+    async def respond(driver_id: str, answer: str, delay: float):
+        await asyncio.sleep(delay * options.time_scale)
+        if answer == "accepted":
+            await claim_booking(customer_id, driver_id)
+        elif answer == "denied":
+            await decline_offer(customer_id, driver_id)
+
+    async def offer(driver_id: str):
+        await notify_driver(driver_id=driver_id, customer_details={"customer_id": customer_id})
+        answer, delay = behaviour[driver_id]
+        if answer != "ignored":
+            asyncio.create_task(respond(driver_id, answer, delay))
+
+    return offer
+
+
+async def sequential(customer_id: str, driver_ids, offer, timeout: float):
+    """The original strategy: one driver at a time, always waiting out the timeout."""
+    owner = uuid.uuid4().hex
+    await reset_booking(customer_id)
+    for driver_id in driver_ids:
+        if not await claim_drivers([driver_id], owner, int(timeout) + 5):
+            continue
+        await open_wave(customer_id, [driver_id], int(timeout) + 5)
+        await offer(driver_id)
+        await asyncio.sleep(timeout)
+        winner = await close_wave(customer_id)
+        if winner:
+            return winner
+        await release_drivers([driver_id], owner)
+    return None
+
+
+async def run(strategy: str, bookings):
+    timeout = options.timeout * options.time_scale
+
+    async def book(booking: int, drivers):
+        customer_id = f"bench-customer-{strategy}-{booking}"
+        driver_ids = [driver_id for driver_id, _, _ in drivers]
+        offer = make_offer(customer_id, drivers)
+        started = time.perf_counter()
+        if strategy == "sequential":
+            winner = await sequential(customer_id, driver_ids, offer, timeout)
+        else:
+            winner = await dispatch_in_waves(
+                customer_id, driver_ids, offer, options.wave_size, timeout, poll_interval=timeout, owner=uuid.uuid4().hex
+            )
+        return winner is not None, (time.perf_counter() - started) / options.time_scale
+
+    results = await asyncio.gather(*(book(booking, drivers) for booking, drivers in enumerate(bookings)))
+    matched = [elapsed for is_matched, elapsed in results if is_matched]
+    unmatched = [elapsed for is_matched, elapsed in results if not is_matched]
+    line = f"{strategy:>10}: matched {len(matched)}/{len(results)}"
+    if len(matched) > 1:
+        percentiles = statistics.quantiles(matched, n=10)
+        line += f", time to match mean {statistics.fmean(matched):6.1f} s, p50 {percentiles[4]:6.1f} s, p90 {percentiles[8]:6.1f} s"
+    if unmatched:
+        line += f", time to 'no driver' mean {statistics.fmean(unmatched):6.1f} s"
+    return line
+
+
+async def report(strategy: str, bookings):
+    with contextlib.redirect_stdout(io.StringIO()):  # notify_driver prints a line per offer
+        line = await run(strategy, bookings)
+    print(line)
+
+
+async def cleanup():
+    for pattern in ("driver:bench-*", "booking:bench-*"):
+        keys = [key async for key in redis_client.scan_iter(match=pattern, count=1000)]
+        if keys:
+            await redis_client.delete(*keys)
+
+
+async def main():
+    bookings = [simulated_drivers(booking) for booking in range(options.bookings)]
+    listener = asyncio.create_task(booking_responses.run())
+    await asyncio.sleep(0.1)  # Let the listener subscribe
+    try:
+        print(f"{options.bookings} bookings, {options.candidates} candidates, timeout {options.timeout:.0f} s, "
+              f"accept {options.accept_rate:.0%}, ignore {options.ignore_rate:.0%}, wave size {options.wave_size}, "
+              f"SQS latency {options.sqs_latency * 1000:.0f} ms")
+        await report("sequential", bookings)
+        await asyncio.sleep(options.timeout * options.time_scale)  # Let late answers land before cleaning up
+        await cleanup()
+        await report("waves", bookings)
+    finally:
+        listener.cancel()
+        await cleanup()
+        await redis_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -10,6 +10,31 @@ class Settings(BaseSettings):
     TRIP_MANAGEMENT_SERVICE_URL: str
     AWS_ACCESS_KEY: str
     AWS_SECRET_ACCESS_KEY: str
+    HTTP_KEEPALIVE_EXPIRY_S: float = 30.0       # Idle pooled connections to other services are closed after this
+    LOCATION_SERVICE_TIMEOUT_S: float = 2.0
+    LOCATION_SERVICE_MAX_CONNECTIONS: int = 50
+    TRIP_SERVICE_TIMEOUT_S: float = 5.0
+    TRIP_SERVICE_MAX_CONNECTIONS: int = 20
+    OLA_MAPS_TIMEOUT_S: float = 5.0
+    OLA_MAPS_MAX_CONNECTIONS: int = 20
+    OLA_MAPS_HTTP2: bool = False                # Multiplex Ola Maps calls over HTTP/2 (needs the h2 package)
+    MATCHING_CANDIDATES: int = 10               # Closest drivers fetched per booking
+    MATCHING_INITIAL_RADIUS_M: float = 500      # First search radius, grown until enough drivers are found
+    MATCHING_MAX_RADIUS_M: float = 10000        # Never look for drivers further than this
+    RANKING_WEIGHT_DISTANCE: float = 0.3        # Weights of the candidate ranking; only their ratios matter
+    RANKING_WEIGHT_RATING: float = 0.2
+    RANKING_WEIGHT_ACCEPTANCE: float = 0.2
+    RANKING_WEIGHT_IDLE: float = 0.1
+    RANKING_WEIGHT_ETA: float = 0.2
+    BATCH_MATCHING_WINDOW_S: float = 0.0        # Collect an area's bookings this long and assign them together (0 matches each on arrival)
+    BATCH_MATCHING_AREA_M: float = 5000         # Side of the square areas bookings are batched by
+    BATCH_MATCHING_MAX_SIZE: int = 200          # Close a batch early once it holds this many bookings
+    BATCH_MATCHING_CANDIDATES: int = 30         # Drivers fetched per booking in batch mode, so a crowd does not share too few
+    DISPATCH_WAVE_SIZE: int = 3                 # Drivers offered a booking at the same time (1 = one by one)
+    DISPATCH_WAVE_TIMEOUT_S: float = 15.0       # How long a wave waits for an accept before moving on
+    DISPATCH_POLL_INTERVAL_S: float = 2.0       # Re-check a wave this often in case a response signal was lost
+    DISPATCH_TRIP_LEASE_S: int = 60             # How long the accepting driver stays leased while the trip is created
+    TOKEN_CACHE_SIZE: int = 10000               # Verified JWTs kept until they expire (0 verifies every request)
     
     class Config:
         env_file = ".env"
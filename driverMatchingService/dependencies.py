@@ -2,14 +2,17 @@ import jwt
 from fastapi import HTTPException, status, Header, WebSocket
 
 from config import settings
+from token_cache import VerifiedTokenCache
+
+
+# Signatures are verified once per token, then reused until the token expires
+auth_tokens = VerifiedTokenCache(settings.AUTH_UNIVERSAL_SECRET, [settings.ALGORITHM], settings.TOKEN_CACHE_SIZE)
 
 
 def validate_token(token: str = Header(...)):
     try:
         # Step 1: Decode the token
-        user_details = jwt.decode(
-            token, settings.AUTH_UNIVERSAL_SECRET, algorithms=[settings.ALGORITHM]
-        )
+        user_details = auth_tokens.decode(token)
 
         # Step 2: Extract user ID from the decoded token, if None forbid it
         user_id = user_details.get("user_id")
@@ -43,9 +46,7 @@ async def validate_token_ws(websocket: WebSocket):
 
     try:
         # Validate and decode the token
-        user_details = jwt.decode(
-            token, settings.AUTH_UNIVERSAL_SECRET, algorithms=[settings.ALGORITHM]  # Replace with your settings
-        )
+        user_details = auth_tokens.decode(token)
 
         user_id = user_details.get("user_id")
         if not user_id:
@@ -0,0 +1,129 @@
+import asyncio
+import math
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from redis_client import (
+    BOOKING_RESPONSES_CHANNEL, redis_client, claim_drivers, release_drivers, reset_booking, open_wave, get_wave_state, close_wave
+)
+
+
+class BookingResponseHub:
+    """
+    Wakes the dispatcher waiting on a booking as soon as one of its drivers
+    accepts or declines, whichever worker handled the response. Every worker
+    holds one subscription to the responses channel, on which the claim and
+    decline scripts publish the customer id.
+    """
+    def __init__(self):
+        self.waiters: Dict[str, asyncio.Event] = {}
+
+        # Metrics
+        self.signals = 0
+
+    def watch(self, customer_id: str) -> asyncio.Event:
+        event = self.waiters[customer_id] = asyncio.Event()
+        return event
+
+    def unwatch(self, customer_id: str, event: asyncio.Event):
+        if self.waiters.get(customer_id) is event:
+            del self.waiters[customer_id]
+
+    async def run(self):
+        """Listener loop, started from the application lifespan."""
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(BOOKING_RESPONSES_CHANNEL)
+            while True:
+                try:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print("Error reading booking responses: ", str(e))
+                    await asyncio.sleep(1)
+                    continue
+                if message and message["type"] == "message":
+                    event = self.waiters.get(message["data"])
+                    if event is not None:
+                        self.signals += 1
+                        event.set()
+        finally:
+            await pubsub.aclose()
+
+
+booking_responses = BookingResponseHub()
+
+
+async def dispatch_in_waves(
+    customer_id: str,
+    driver_ids: List[str],
+    offer: Callable[[str], Awaitable[None]],
+    wave_size: int,
+    wave_timeout: float,
+    poll_interval: float,
+    owner: str,
+) -> Optional[str]:
+    """
+    Offer a booking to the candidate drivers, best first, `wave_size` at a time.
+
+    The free drivers of a wave are leased to `owner` in one round trip (see
+    `claim_drivers`) and notified concurrently through `offer`. The first driver
+    to accept claims the booking atomically (see `claim_booking`); the wave then
+    ends and the other drivers of the wave are released right away. Drivers who
+    decline are released as soon as their answer is seen. A wave also ends early
+    once all of its drivers have declined, otherwise `wave_timeout` after its
+    drivers were claimed, so it never outlives their leases. Answers are
+    signalled through `booking_responses`; the wave state is also re-read every
+    `poll_interval` in case a signal was lost. Returns the driver who accepted,
+    or None if nobody did.
+    """
+    await reset_booking(customer_id)
+    lease = math.ceil(wave_timeout) + 5  # Outlives the wave in case this task dies
+    responded = booking_responses.watch(customer_id)
+    try:
+        for start in range(0, len(driver_ids), wave_size):
+            wave = driver_ids[start:start + wave_size]
+            offered = await claim_drivers(wave, owner, lease)
+            if not offered:
+                continue
+            # Counted from the claim, as the leases are: sending the offers can take a while
+            deadline = time.monotonic() + wave_timeout
+
+            await open_wave(customer_id, offered, lease)
+            try:
+                results = await asyncio.gather(*(offer(driver_id) for driver_id in offered), return_exceptions=True)
+                for driver_id, result in zip(offered, results):
+                    if isinstance(result, BaseException):
+                        print(f"Failed to offer the trip to driver {driver_id}: {result}")
+
+                released = set()
+                while True:
+                    # Cleared before reading the state, so an answer landing in between still wakes us
+                    responded.clear()
+                    winner, open_offers = await get_wave_state(customer_id)
+                    declined = [
+                        driver_id for driver_id in offered
+                        if driver_id not in open_offers and driver_id != winner and driver_id not in released
+                    ]
+                    if declined:
+                        await release_drivers(declined, owner)
+                        released.update(declined)
+                    remaining = deadline - time.monotonic()
+                    if winner or not open_offers or remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(responded.wait(), min(poll_interval, remaining))
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                # Closing the wave is atomic with reading the winner, so no late accept slips
+                # through. Releasing is owner-checked, so repeating it for declined drivers is harmless.
+                winner = await asyncio.shield(close_wave(customer_id))
+                await asyncio.shield(release_drivers([driver_id for driver_id in offered if driver_id != winner], owner))
+            if winner:
+                return winner
+
+        return None
+    finally:
+        booking_responses.unwatch(customer_id, responded)
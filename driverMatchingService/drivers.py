@@ -1,16 +1,22 @@
-import asyncio
+import uuid
 import httpx
 from notifications import notify_driver
-from redis_client import set_driver_state, get_driver_state, unlock_driver, check_trip_status
+from redis_client import set_driver_state, renew_driver_lease, get_driver_stats
+from ranking import ranker
+from batching import booking_batcher, prioritise
+from dispatch import dispatch_in_waves
 from schemas import RequestBooking
 from config import settings
+from metrics import timed_call
+from http_clients import http_clients
 from main import notify_via_ws
 
 
 async def create_trip(driver_id: str, booking_details: RequestBooking):
     """Create a new trip using the Trip Management Service."""
-    async with httpx.AsyncClient() as client:
-        try:
+    client = http_clients.get("trip_service")
+    try:
+        with timed_call("trip_service", "create_trip"):
             response = await client.post(
                 settings.TRIP_MANAGEMENT_SERVICE_URL,
                 json={
@@ -23,48 +29,62 @@ async def create_trip(driver_id: str, booking_details: RequestBooking):
                 },
             )
             response.raise_for_status()
-        except httpx.HTTPStatusError as exc:
-            print(f"Failed to create trip: {exc.response.status_code}")
-            raise
-        except httpx.RequestError as exc:
-            print(f"Error in trip request: {str(exc)}")
-            raise
+    except httpx.HTTPStatusError as exc:
+        print(f"Failed to create trip: {exc.response.status_code}")
+        raise
+    except httpx.RequestError as exc:
+        print(f"Error in trip request: {str(exc)}")
+        raise
 
 
 async def match_and_notify(nearby_drivers, booking_details: RequestBooking):
-    """Match available drivers and notify them one-by-one until one accepts."""
+    """
+    Offer the trip to the nearby drivers in concurrent waves until one accepts,
+    best ranked first. The first driver to accept wins the trip; the rest of the
+    wave is released. In batch mode, the booking first waits for the other
+    bookings of its area and is offered to the driver assigned to it first. If
+    the winner's lease has run out by then, another booking may hold the driver,
+    so the booking fails rather than double-book them.
+    """
+    if settings.BATCH_MATCHING_WINDOW_S > 0:
+        assignment = await booking_batcher.submit(
+            booking_details.source_location.latitude, booking_details.source_location.longitude, nearby_drivers
+        )
+    stats = await get_driver_stats([driver["driver_id"] for driver in nearby_drivers])
+    if settings.BATCH_MATCHING_WINDOW_S > 0:
+        # The assigned driver may rank anywhere, so the whole list is ranked before cutting it
+        candidates = prioritise(ranker.rank(nearby_drivers, stats), assignment)[:settings.MATCHING_CANDIDATES]
+    else:
+        candidates = ranker.rank(nearby_drivers, stats, limit=settings.MATCHING_CANDIDATES)
+    owner = uuid.uuid4().hex  # Lease token of this booking attempt
+    driver_id = await dispatch_in_waves(
+        booking_details.user_id,
+        [driver["driver_id"] for driver in candidates],
+        lambda driver_id: notify_driver(driver_id=driver_id, customer_details=booking_details.model_dump()),
+        wave_size=settings.DISPATCH_WAVE_SIZE,
+        wave_timeout=settings.DISPATCH_WAVE_TIMEOUT_S,
+        poll_interval=settings.DISPATCH_POLL_INTERVAL_S,
+        owner=owner,
+    )
 
-    for driver in nearby_drivers:
-        driver_id = driver["driver_id"]
+    # Keep the driver while the trip is being created
+    if driver_id is not None and not await renew_driver_lease(driver_id, owner, settings.DISPATCH_TRIP_LEASE_S):
+        print(f"Lease on driver {driver_id} expired before the trip of customer {booking_details.user_id} was created; not assigning it.")
+        await notify_via_ws(
+            booking_details.user_id,
+            {"status": "failed", "message": "The driver is no longer available. Please try again."},
+        )
+        return
 
-        # Check if the driver is free
-        if await get_driver_state(driver_id) == "free":
-            # Lock the driver
-            await set_driver_state(driver_id, "locked", 20)  # Set to locked before notifying
-
-            # Notify the driver
-            await notify_driver(
-                driver_id=driver_id,
-                customer_details=booking_details.model_dump(),
-            )
-
-            # Wait for the driver's response
-            await asyncio.sleep(15)
-
-            # Check if the driver accepted the trip
-            temp_trip_id = f"{booking_details.user_id}+{driver_id}"
-            if await check_trip_status(temp_trip_id):
-                # Driver accepted; create the trip via HTTP request to Trip Management Service
-                await notify_via_ws(
-                    booking_details.user_id,
-                    {"status": "success", "message": "Driver accepted the trip request."},
-                )
-                await create_trip(driver_id, booking_details)
-                await set_driver_state(driver_id, "busy", 120)
-                return  # Exit after successful trip creation
-
-            # Unlock the driver if they did not accept
-            await unlock_driver(driver_id)
+    if driver_id is not None:
+        # Driver accepted; create the trip via HTTP request to Trip Management Service
+        await notify_via_ws(
+            booking_details.user_id,
+            {"status": "success", "message": "Driver accepted the trip request."},
+        )
+        await create_trip(driver_id, booking_details)
+        await set_driver_state(driver_id, "busy", 120)
+        return
 
     # Notify the customer if no driver accepted the trip
     await notify_via_ws(
@@ -0,0 +1,100 @@
+import importlib.util
+from typing import Dict, NamedTuple
+
+import httpx
+
+from config import settings
+from metrics import metrics
+
+
+metrics.declare(
+    "http_client_requests_total", "counter",
+    "Requests to other services, by whether they opened a new connection or reused a pooled one.",
+    ("upstream", "connection"),
+)
+
+
+class Upstream(NamedTuple):
+    timeout: float
+    max_connections: int
+    http2: bool
+
+
+class ReuseCountingTransport(httpx.AsyncBaseTransport):
+    """Transport wrapper recording whether each request had to open a connection."""
+    def __init__(self, upstream: str, transport: httpx.AsyncHTTPTransport):
+        self.upstream = upstream
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        connected = False
+
+        async def trace(event: str, info: dict):
+            nonlocal connected
+            if event == "connection.connect_tcp.complete":
+                connected = True
+
+        request.extensions["trace"] = trace
+        try:
+            return await self.transport.handle_async_request(request)
+        finally:
+            metrics.inc("http_client_requests_total", (self.upstream, "new" if connected else "reused"))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class HttpClients:
+    """
+    One long-lived, pooled `httpx.AsyncClient` per upstream service, so that
+    bookings reuse keep-alive connections instead of paying connection setup (and
+    TLS, for external APIs) on every call. Clients are opened and closed by the
+    application lifespan, or on first use outside of it.
+    """
+    def __init__(self, keepalive_expiry: float):
+        self.keepalive_expiry = keepalive_expiry
+        self.upstreams: Dict[str, Upstream] = {}
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+
+    def register(self, name: str, timeout: float, max_connections: int, http2: bool = False):
+        if http2 and importlib.util.find_spec("h2") is None:
+            print(f"HTTP/2 requested for {name} but the h2 package is not installed; using HTTP/1.1.")
+            http2 = False
+        self.upstreams[name] = Upstream(timeout, max_connections, http2)
+
+    def _open(self, name: str) -> httpx.AsyncClient:
+        upstream = self.upstreams[name]
+        limits = httpx.Limits(
+            max_connections=upstream.max_connections,
+            max_keepalive_connections=upstream.max_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        transport = httpx.AsyncHTTPTransport(limits=limits, http2=upstream.http2)
+        return httpx.AsyncClient(transport=ReuseCountingTransport(name, transport), timeout=upstream.timeout)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self.clients.get(name)
+        if client is None:
+            client = self.clients[name] = self._open(name)
+        return client
+
+    async def start(self):
+        for name in self.upstreams:
+            self.get(name)
+
+    async def close(self):
+        clients, self.clients = self.clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+http_clients = HttpClients(keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_S)
+http_clients.register(
+    "location_service", settings.LOCATION_SERVICE_TIMEOUT_S, settings.LOCATION_SERVICE_MAX_CONNECTIONS
+)
+http_clients.register(
+    "trip_service", settings.TRIP_SERVICE_TIMEOUT_S, settings.TRIP_SERVICE_MAX_CONNECTIONS
+)
+http_clients.register(
+    "ola_maps", settings.OLA_MAPS_TIMEOUT_S, settings.OLA_MAPS_MAX_CONNECTIONS, http2=settings.OLA_MAPS_HTTP2
+)
@@ -2,19 +2,41 @@ import httpx
 import re
 import warnings
 import asyncio
-from fastapi import FastAPI, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, Depends
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Dict
+from contextlib import asynccontextmanager
 
 from config import settings
 from schemas import RequestBooking, DriverResponse
-from redis_client import set_trip_status, unlock_driver
+from redis_client import claim_booking, decline_offer
 from dependencies import validate_token, validate_token_ws
+from metrics import MetricsMiddleware, metrics_endpoint, timed_call
+from dispatch import booking_responses
+from http_clients import http_clients
 
 # Ignore Deprecation Warnings (Optional)
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lifespan context manager for startup and shutdown."""
+    await http_clients.start()
+    responses_task = asyncio.create_task(booking_responses.run())
+
+    try:
+        yield  # Keep the app running within this context
+    finally:
+        responses_task.cancel()
+        try:
+            await responses_task
+        except asyncio.CancelledError:
+            print("Booking response listener cancelled.")
+        await http_clients.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +45,9 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
 )
+app.add_middleware(MetricsMiddleware)
+
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 
 # Track active connections and tasks
@@ -44,31 +69,38 @@ async def notify_via_ws(user_id: str, message: dict):
         await websocket.send_json(message)
 
 
-async def get_nearby_drivers_from_service(latitude, longitude, radius, vehicle_type="Car"):
-    """Call the Proximity Service to get nearby drivers."""
+async def get_nearby_drivers_from_service(latitude, longitude, vehicle_type="Car"):
+    """
+    Call the Location Service to get the closest available drivers. The service grows
+    the search radius until enough candidates are found, so sparse areas still get
+    drivers and dense areas are not flooded with them.
+    """
     params = {
         "latitude": latitude,
         "longitude": longitude,
-        "radius": radius,
         "vehicle_type": vehicle_type,
+        "k": settings.BATCH_MATCHING_CANDIDATES if settings.BATCH_MATCHING_WINDOW_S > 0 else settings.MATCHING_CANDIDATES,
+        "initial_radius": settings.MATCHING_INITIAL_RADIUS_M,
+        "max_radius": settings.MATCHING_MAX_RADIUS_M,
     }
     headers = {
         'accept': 'application/json',
         'Content-Type': 'application/json',
     }
 
-    async with httpx.AsyncClient() as client:
-        for attempt in range(3):
-            try:
-                response = await client.post(settings.LOCATION_SERVICE_URL + "/proximity", headers=headers, json=params)
+    client = http_clients.get("location_service")
+    for attempt in range(3):
+        try:
+            with timed_call("location_service", "nearest"):
+                response = await client.post(settings.LOCATION_SERVICE_URL + "/nearest", headers=headers, json=params)
                 response.raise_for_status()
-                return response.json().get("drivers", [])
-            except httpx.HTTPStatusError as err:
-                print(f"Proximity service error: {err}")
-            except httpx.RequestError as err:
-                print(f"Request error: {err}")
+            return response.json().get("drivers", [])
+        except httpx.HTTPStatusError as err:
+            print(f"Proximity service error: {err}")
+        except httpx.RequestError as err:
+            print(f"Request error: {err}")
 
-            await asyncio.sleep(2 ** attempt + (0.1 * attempt))
+        await asyncio.sleep(2 ** attempt + (0.1 * attempt))
 
     return []
 
@@ -93,7 +125,6 @@ async def websocket_request_booking(websocket: WebSocket, user_details: dict = D
         nearby_drivers = await get_nearby_drivers_from_service(
             booking.source_location.latitude,
             booking.source_location.longitude,
-            radius=2000,
             vehicle_type=booking.vehicle_type,
         )
 
@@ -124,27 +155,27 @@ async def websocket_request_booking(websocket: WebSocket, user_details: dict = D
 
 
 @app.post("/driver/response")
-async def driver_response(response: DriverResponse, background_tasks: BackgroundTasks, user_details: dict = Depends(validate_token)):
+async def driver_response(response: DriverResponse, user_details: dict = Depends(validate_token)):
     """Handle driver responses (accept/deny) and update Redis status."""
     if response.driver_id != user_details.get("user_id"):
         raise HTTPException(status_code=403, detail="Unauthorized driver response.")
-    trip_id = f"{response.customer_id}+{response.driver_id}"
 
     # Check if the customer is connected via WebSocket
     if response.customer_id in active_connections:
         websocket = active_connections[response.customer_id]
 
         if response.status == "accepted":
-            # Save trip status as 'accepted' in Redis with a TTL of 5 minutes
-            await set_trip_status(trip_id, "accepted", 300)
+            # Only the first driver of the current wave to accept gets the trip
+            if not await claim_booking(response.customer_id, response.driver_id):
+                raise HTTPException(status_code=409, detail="Trip already taken or offer expired.")
 
             # Notify the customer via WebSocket
             await websocket.send_text(f"Accepted: Driver accepted your trip.")
             return {"message": "Trip accepted and status updated in Redis."}
 
         elif response.status == "denied":
-            # Unlock the driver asynchronously
-            background_tasks.add_task(unlock_driver, response.driver_id)
+            # Withdraw the offer so the wave ends early; the matcher holding the driver's lease releases them
+            await decline_offer(response.customer_id, response.driver_id)
             return {"message": "Trip denied and status updated in Redis."}
 
     # If the customer is not connected via WebSocket
@@ -161,12 +192,13 @@ async def fetch_ola_distance_data(origin, destination):
         # "api_key": settings.OLA_API_KEY,
     }
 
-    async with httpx.AsyncClient() as client:
+    client = http_clients.get("ola_maps")
+    with timed_call("ola_maps", "distance_matrix"):
         response = await client.get("https://api.olamaps.io/routing/v1/distanceMatrix", params=params)
-        # response = await client.get(settings.OLA_DISTANCE_API_URL, params=params)
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail="Failed to fetch route data")
-        return response.json()
+    # response = await client.get(settings.OLA_DISTANCE_API_URL, params=params)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="Failed to fetch route data")
+    return response.json()
     
 
 BASE_FARE = 50  # Base fare in currency units
@@ -1,7 +1,9 @@
+import asyncio
 import boto3
 import json
 
 from config import settings
+from metrics import timed_call
 
 
 sqs_client = boto3.client('sqs', region_name='ap-south-1', aws_access_key_id=settings.AWS_ACCESS_KEY, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
@@ -9,7 +11,10 @@ queue_url_response = sqs_client.get_queue_url(QueueName = settings.SQS_NOTIFICAT
 SQS_QUEUE_URL = queue_url_response["QueueUrl"]
 
 async def notify_driver(driver_id, customer_details):
-    """Send notification to SQS."""
+    """
+    Send notification to SQS. boto3 calls block, so the request runs in a worker
+    thread and the offers of a wave are sent concurrently.
+    """
     try:
         message = {
             "user_id": driver_id,
@@ -19,10 +24,12 @@ async def notify_driver(driver_id, customer_details):
             "params": customer_details
         }
 
-        response = sqs_client.send_message(
-            QueueUrl=SQS_QUEUE_URL,
-            MessageBody=json.dumps(message),
-        )
+        with timed_call("sqs", "send_message"):
+            response = await asyncio.to_thread(
+                sqs_client.send_message,
+                QueueUrl=SQS_QUEUE_URL,
+                MessageBody=json.dumps(message),
+            )
 
         if response['ResponseMetadata']['HTTPStatusCode'] == 200:
             print(f"Notified Driver {driver_id} for Trip.")
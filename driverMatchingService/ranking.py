@@ -0,0 +1,134 @@
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import settings
+
+
+DEFAULT_RATING = 4.0            # Rating assumed for drivers who have none yet
+ACCEPTANCE_PRIOR = 0.5          # Acceptance rate assumed for drivers with no history...
+ACCEPTANCE_PRIOR_OFFERS = 5.0   # ...weighted as this many offers, so a single answer does not swing it
+IDLE_CAP_S = 1800.0             # Idle time beyond this earns no further priority
+MAX_ETA_S = 1200.0              # ETA scored as 0 from this many seconds on
+DETOUR_FACTOR = 1.3             # Road distance per metre of straight-line distance
+CITY_SPEED_MPS = 25 / 3.6       # Average pickup speed, used when a candidate has no ETA
+
+# Driver stats as returned by `redis_client.get_driver_stats`: (offers, accepts, last assigned at)
+DriverStats = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class RankingWeights(NamedTuple):
+    """Relative importance of each feature; only the ratios between them matter."""
+    distance: float
+    rating: float
+    acceptance: float
+    idle: float
+    eta: float
+
+
+class CandidateFeatures(NamedTuple):
+    """One array per feature, with one slot per candidate."""
+    distance_m: np.ndarray
+    rating: np.ndarray
+    acceptance_rate: np.ndarray
+    idle_s: np.ndarray
+    eta_s: np.ndarray
+
+
+def _column(values) -> np.ndarray:
+    """Floats of numbers or numeric strings, as returned by the services and Redis; missing values become NaN."""
+    return np.array([value or np.nan for value in values], dtype=np.float64)
+
+
+class CandidateRanker:
+    """
+    Weighted scoring of the candidate drivers of a booking.
+
+    Every feature is first mapped to [0, 1], higher being better: closer, better
+    rated, more likely to accept, idle for longer, quicker to arrive. The score
+    is the weighted mean of the mapped features, computed for all candidates at
+    once as a single matrix-vector product. Weights can be swapped at any time
+    by assigning `weights`.
+    """
+    def __init__(self, weights: RankingWeights, max_distance_m: float):
+        self.max_distance_m = max_distance_m
+        self.weights = weights
+
+    @property
+    def weights(self) -> RankingWeights:
+        return self._weights
+
+    @weights.setter
+    def weights(self, weights: RankingWeights):
+        coefficients = np.array(weights, dtype=np.float64)
+        if (coefficients < 0).any() or coefficients.sum() <= 0:
+            raise ValueError("Ranking weights must be non-negative and not all zero.")
+        self._weights = weights
+        self._coefficients = coefficients / coefficients.sum()
+
+    def score(self, features: CandidateFeatures) -> np.ndarray:
+        """Score in [0, 1] of every candidate."""
+        normalized = np.vstack((
+            1.0 - np.minimum(features.distance_m / self.max_distance_m, 1.0),
+            (np.clip(features.rating, 1.0, 5.0) - 1.0) / 4.0,
+            np.clip(features.acceptance_rate, 0.0, 1.0),
+            np.minimum(features.idle_s / IDLE_CAP_S, 1.0),
+            1.0 - np.minimum(features.eta_s / MAX_ETA_S, 1.0),
+        ))
+        return self._coefficients @ normalized
+
+    @staticmethod
+    def best(scores: np.ndarray, limit: Optional[int] = None) -> np.ndarray:
+        """
+        Slots of the `limit` best scores (all by default), best first; ties keep
+        their original order. Only the top `limit` scores are sorted.
+        """
+        costs = -scores
+        if limit is not None and limit < len(costs):
+            top = np.sort(np.argpartition(costs, limit - 1)[:limit]) if limit > 0 else np.empty(0, dtype=np.intp)
+            return top[np.argsort(costs[top], kind="stable")]
+        return np.argsort(costs, kind="stable")
+
+    @staticmethod
+    def features(drivers: Sequence[Dict], stats: Sequence[DriverStats], now: Optional[float] = None) -> CandidateFeatures:
+        """
+        Feature arrays of the candidates returned by the Location Service, given
+        their dispatch stats. Candidates that carry an `eta` (seconds) keep it;
+        the others get one estimated from their distance.
+        """
+        now = time.time() if now is None else now
+        distance_m = np.nan_to_num(_column([driver.get("distance") for driver in drivers]), nan=0.0)
+        rating = _column([driver.get("rating") for driver in drivers])
+        eta_s = _column([driver.get("eta") for driver in drivers])
+        offers, accepts, assigned_at = [_column(column) for column in zip(*stats)] if stats else [np.empty(0)] * 3
+        offers = np.nan_to_num(offers, nan=0.0)
+        accepts = np.nan_to_num(accepts, nan=0.0)
+
+        estimated_eta = distance_m * (DETOUR_FACTOR / CITY_SPEED_MPS)
+        return CandidateFeatures(
+            distance_m=distance_m,
+            rating=np.where(np.isnan(rating), DEFAULT_RATING, rating),
+            acceptance_rate=(accepts + ACCEPTANCE_PRIOR * ACCEPTANCE_PRIOR_OFFERS) / (offers + ACCEPTANCE_PRIOR_OFFERS),
+            idle_s=np.where(np.isnan(assigned_at), IDLE_CAP_S, now - assigned_at),
+            eta_s=np.where(np.isnan(eta_s), estimated_eta, eta_s),
+        )
+
+    def rank(self, drivers: Sequence[Dict], stats: Sequence[DriverStats], limit: Optional[int] = None) -> List[Dict]:
+        """The `limit` best candidates (all by default), best first, each with its `score`."""
+        if not drivers:
+            return []
+        scores = self.score(self.features(drivers, stats))
+        return [dict(drivers[slot], score=round(float(scores[slot]), 4)) for slot in self.best(scores, limit)]
+
+
+ranker = CandidateRanker(
+    RankingWeights(
+        distance=settings.RANKING_WEIGHT_DISTANCE,
+        rating=settings.RANKING_WEIGHT_RATING,
+        acceptance=settings.RANKING_WEIGHT_ACCEPTANCE,
+        idle=settings.RANKING_WEIGHT_IDLE,
+        eta=settings.RANKING_WEIGHT_ETA,
+    ),
+    max_distance_m=settings.MATCHING_MAX_RADIUS_M,
+)
@@ -1,32 +1,207 @@
+import time
 import redis.asyncio as redis
+from typing import List, Optional
+
 from config import settings
+from metrics import timed_call
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client recording the latency of every command and pipeline in /metrics."""
+    async def execute_command(self, *args, **options):
+        with timed_call("redis", str(args[0])):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> "InstrumentedPipeline":
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        with timed_call("redis", "pipeline"):
+            return await super().execute(raise_on_error)
+
 
 # Initialize Redis client
-redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+redis_client = InstrumentedRedis.from_url(settings.REDIS_URL, decode_responses=True)
 # redis_client = None
 
 async def set_driver_state(driver_id: str, state: str, expiry: int = 60):
-    """Set the driver state in Redis."""
+    """Set the driver state in Redis, replacing any lease on the driver (see below)."""
     driver_state_key = f"driver:{driver_id}:state"
     await redis_client.set(driver_state_key, state, ex=expiry)
 
-async def get_driver_state(driver_id: str) -> str:
-    """Get the driver state from Redis, defaulting to 'free' if not found."""
-    driver_state_key = f"driver:{driver_id}:state"
-    state = await redis_client.get(driver_state_key)
-    return state if state else "free"
-
-async def unlock_driver(driver_id: str):
-    """Unlock the driver after denial or cancellation."""
-    await set_driver_state(driver_id, "free")  # Change state to free
-
-async def set_trip_status(trip_id, status, expiry=600):
-    """Set the trip status in Redis."""
-    status_key = f"trip:{trip_id}:status"
-    await redis_client.set(status_key, status, ex=expiry)
-
-async def check_trip_status(trip_id):
-    """Poll Redis to see if the trip is accepted."""
-    status_key = f"trip:{trip_id}:status"
-    status = await redis_client.get(status_key)
-    return status == "accepted"
\ No newline at end of file
+# Wave dispatch: the drivers currently offered a customer's booking are kept in
+# `booking:<customer_id>:offers` and the first to accept is written once to
+# `booking:<customer_id>:driver`. The scripts below make each step atomic, and
+# publish the customer id on BOOKING_RESPONSES_CHANNEL whenever a driver's answer
+# changes the wave, so that the worker waiting on it wakes up.
+BOOKING_RESPONSES_CHANNEL = "booking:responses"
+
+# Dispatch stats of each driver, read by the candidate ranking: `driver:<id>:stats`
+# holds offers, accepts and last_assigned_at, kept for a week after the last update.
+DRIVER_STATS_TTL = 7 * 24 * 3600
+
+# Driver leases: a matcher claims a driver by setting the driver state to
+# `locked:<owner token>` for a lease TTL. Only free drivers (no state, or 'free')
+# can be claimed, and only the owner can renew or release its lease, so two
+# matchers can never hold the same driver and a stale matcher cannot free a driver
+# that has since been claimed by someone else. Once its trip is created, the
+# matcher replaces its lease with `busy` (see `set_driver_state`), which keeps the
+# driver from being claimed until that state expires.
+
+# KEYS = driver state keys; ARGV[1] = owner token, ARGV[2] = lease TTL (s)
+# Claims every free driver in one call. Returns 1/0 per key.
+CLAIM_DRIVERS = """
+local claimed = {}
+for i, key in ipairs(KEYS) do
+    local state = redis.call('GET', key)
+    if not state or state == 'free' then
+        redis.call('SET', key, 'locked:' .. ARGV[1], 'EX', ARGV[2])
+        claimed[i] = 1
+    else
+        claimed[i] = 0
+    end
+end
+return claimed
+"""
+
+# KEYS[1] = driver state key; ARGV[1] = owner token, ARGV[2] = lease TTL (s)
+RENEW_DRIVER_LEASE = """
+if redis.call('GET', KEYS[1]) ~= 'locked:' .. ARGV[1] then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# KEYS = driver state keys; ARGV[1] = owner token
+# Frees the drivers still leased by the owner. Returns how many were released.
+RELEASE_DRIVERS = """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == 'locked:' .. ARGV[1] then
+        redis.call('DEL', key)
+        released = released + 1
+    end
+end
+return released
+"""
+
+# KEYS[1] = offers set, KEYS[2] = booking driver key, KEYS[3] = driver stats key
+# ARGV[1] = driver id, ARGV[2] = TTL (s), ARGV[3] = channel, ARGV[4] = customer id,
+# ARGV[5] = current time (s), ARGV[6] = stats TTL (s)
+# First accept wins: only a driver with an open offer can claim, and only once per booking.
+CLAIM_BOOKING = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if not redis.call('SET', KEYS[2], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 0
+end
+redis.call('HINCRBY', KEYS[3], 'accepts', 1)
+redis.call('HSET', KEYS[3], 'last_assigned_at', ARGV[5])
+redis.call('EXPIRE', KEYS[3], ARGV[6])
+redis.call('PUBLISH', ARGV[3], ARGV[4])
+return 1
+"""
+
+# KEYS[1] = offers set; ARGV[1] = driver id, ARGV[2] = channel, ARGV[3] = customer id
+# Withdraws a declined offer. Returns 0 if it was no longer open.
+DECLINE_OFFER = """
+if redis.call('SREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('PUBLISH', ARGV[2], ARGV[3])
+return 1
+"""
+
+# KEYS[1] = offers set, KEYS[2] = booking driver key
+# Withdraws every open offer and returns the winner, if any. After this no driver
+# of the wave can claim the booking any more.
+CLOSE_WAVE = """
+redis.call('DEL', KEYS[1])
+return redis.call('GET', KEYS[2])
+"""
+
+claim_drivers_script = redis_client.register_script(CLAIM_DRIVERS)
+renew_driver_lease_script = redis_client.register_script(RENEW_DRIVER_LEASE)
+release_drivers_script = redis_client.register_script(RELEASE_DRIVERS)
+claim_booking_script = redis_client.register_script(CLAIM_BOOKING)
+decline_offer_script = redis_client.register_script(DECLINE_OFFER)
+close_wave_script = redis_client.register_script(CLOSE_WAVE)
+
+def booking_offers_key(customer_id: str) -> str:
+    return f"booking:{customer_id}:offers"
+
+def booking_driver_key(customer_id: str) -> str:
+    return f"booking:{customer_id}:driver"
+
+def driver_state_key(driver_id: str) -> str:
+    return f"driver:{driver_id}:state"
+
+def driver_stats_key(driver_id: str) -> str:
+    return f"driver:{driver_id}:stats"
+
+async def get_driver_stats(driver_ids: List[str]):
+    """(offers, accepts, last assigned at) of each driver, in one round trip. Unknown values are None."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for driver_id in driver_ids:
+            pipe.hmget(driver_stats_key(driver_id), "offers", "accepts", "last_assigned_at")
+        return [tuple(stats) for stats in await pipe.execute()]
+
+async def claim_drivers(driver_ids: List[str], owner: str, lease: int) -> List[str]:
+    """Lease every free driver among the candidates in one round trip. Returns the drivers claimed."""
+    if not driver_ids:
+        return []
+    claimed = await claim_drivers_script(keys=[driver_state_key(driver_id) for driver_id in driver_ids], args=[owner, lease])
+    return [driver_id for driver_id, is_claimed in zip(driver_ids, claimed) if is_claimed]
+
+async def renew_driver_lease(driver_id: str, owner: str, lease: int) -> bool:
+    """Extend a lease. Returns False if the owner no longer holds the driver."""
+    return bool(await renew_driver_lease_script(keys=[driver_state_key(driver_id)], args=[owner, lease]))
+
+async def release_drivers(driver_ids: List[str], owner: str) -> int:
+    """Free the drivers the owner still holds; others are left untouched."""
+    if not driver_ids:
+        return 0
+    return await release_drivers_script(keys=[driver_state_key(driver_id) for driver_id in driver_ids], args=[owner])
+
+async def reset_booking(customer_id: str):
+    """Forget the offers and winner of the customer's previous booking."""
+    await redis_client.delete(booking_offers_key(customer_id), booking_driver_key(customer_id))
+
+async def open_wave(customer_id: str, driver_ids, expiry: int):
+    """Record the drivers a booking is offered to in this wave, and count the offer in their stats."""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.sadd(booking_offers_key(customer_id), *driver_ids)
+        pipe.expire(booking_offers_key(customer_id), expiry)
+        for driver_id in driver_ids:
+            pipe.hincrby(driver_stats_key(driver_id), "offers", 1)
+            pipe.expire(driver_stats_key(driver_id), DRIVER_STATS_TTL)
+        await pipe.execute()
+
+async def claim_booking(customer_id: str, driver_id: str, expiry: int = 600) -> bool:
+    """Accept a booking on behalf of a driver. Returns False if another driver was first or the offer expired."""
+    return bool(await claim_booking_script(
+        keys=[booking_offers_key(customer_id), booking_driver_key(customer_id), driver_stats_key(driver_id)],
+        args=[driver_id, expiry, BOOKING_RESPONSES_CHANNEL, customer_id, int(time.time()), DRIVER_STATS_TTL],
+    ))
+
+async def decline_offer(customer_id: str, driver_id: str) -> bool:
+    """Withdraw a driver's open offer after they deny the booking. Returns False if it was already closed."""
+    return bool(await decline_offer_script(
+        keys=[booking_offers_key(customer_id)], args=[driver_id, BOOKING_RESPONSES_CHANNEL, customer_id]
+    ))
+
+async def get_wave_state(customer_id: str):
+    """(winner or None, drivers whose offer is still open) of the current wave."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(booking_driver_key(customer_id))
+        pipe.smembers(booking_offers_key(customer_id))
+        winner, open_offers = await pipe.execute()
+    return winner, open_offers
+
+async def close_wave(customer_id: str):
+    """Withdraw the open offers of the current wave. Returns the winner, or None."""
+    return await close_wave_script(keys=[booking_offers_key(customer_id), booking_driver_key(customer_id)])
@@ -54,9 +54,9 @@ worker.port.onmessage = (event) => {
 function startGeolocationUpdates() {
     if (navigator.geolocation) {
         navigator.geolocation.getCurrentPosition((position) => {
-            const { latitude, longitude } = position.coords;
+            const { latitude, longitude, speed, heading } = position.coords;
             // Send location data to the worker
-            worker.port.postMessage({ action: 'updateLocation', driver_id: token_payload.user_id, latitude: latitude, longitude: longitude });
+            worker.port.postMessage({ action: 'updateLocation', driver_id: token_payload.user_id, latitude: latitude, longitude: longitude, speed: speed, heading: heading, timestamp: position.timestamp });
             console.log('Location sent to worker:', latitude, longitude);
         }, (error) => {
             console.error('Geolocation error:', error);
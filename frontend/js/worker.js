@@ -35,6 +35,20 @@ function connectToSSE() {
   };
 }
 
+// Binary location frame: latitude f64 | longitude f64 | timestamp f64 (s) | speed f32 (m/s) | heading f32 (deg),
+// little-endian, 32 bytes. The driver is identified by the socket's token.
+const BINARY_LOCATION_SUBPROTOCOL = 'timely.location.v1';
+
+function encodeLocationFrame(latitude, longitude, timestamp, speed, heading) {
+  const view = new DataView(new ArrayBuffer(32));
+  view.setFloat64(0, latitude, true);
+  view.setFloat64(8, longitude, true);
+  view.setFloat64(16, timestamp / 1000, true);
+  view.setFloat32(24, speed ?? NaN, true);
+  view.setFloat32(28, heading ?? NaN, true);
+  return view.buffer;
+}
+
 // Connect to WebSocket for sending location updates
 function connectToWebSocket() {
   if (!token) return;
@@ -45,7 +59,9 @@ function connectToWebSocket() {
     console.log('Existing WebSocket connection closed.');
   }
 
-  ws = new WebSocket(`ws://localhost:8004/ws/location?token=${token}`);
+  // Prefer compact binary frames, the server falls back to JSON if it does not pick the subprotocol
+  ws = new WebSocket(`ws://localhost:8004/ws/location?token=${token}`, [BINARY_LOCATION_SUBPROTOCOL]);
+  ws.binaryType = 'arraybuffer';
 
   ws.onopen = () => {
     console.log('WebSocket connected');
@@ -87,13 +103,17 @@ self.onconnect = (event) => {
         break;
 
       case 'updateLocation':
-        const { driver_id, latitude, longitude } = data;
+        const { driver_id, latitude, longitude, speed, heading, timestamp } = data;
         console.log('Location received in worker:', driver_id, latitude, longitude);
 
         // Send location update via WebSocket if connected
         if (ws && ws.readyState === WebSocket.OPEN) {
           console.log('Sending location to WebSocket');
-          ws.send(JSON.stringify({ driver_id, latitude, longitude }));
+          if (ws.protocol === BINARY_LOCATION_SUBPROTOCOL) {
+            ws.send(encodeLocationFrame(latitude, longitude, timestamp ?? Date.now(), speed, heading));
+          } else {
+            ws.send(JSON.stringify({ driver_id, latitude, longitude }));
+          }
         }
         break;
 
@@ -0,0 +1,109 @@
+"""
+Measure how long the event loop is blocked while driver details are looked up,
+comparing the old `requests.get` call with the pooled async DriverDetailsClient.
+
+A stub auth service in a separate process answers every request after a fixed
+delay. A heartbeat task records how late the loop wakes it up.
+
+    python -m benchmarks.event_loop_blocking --lookups 200 --drivers 50 --delay-ms 20 --interval-ms 1
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from helper_functions import DriverDetailsClient
+
+
+class StubAuthServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+class StubAuthHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real service
+    delay = 0.02
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({"driver_id": self.path.rsplit("/", 1)[-1], "vehicle_type": "Car", "rating": 4.5}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_stub(delay, port):
+    StubAuthHandler.delay = delay
+    server = StubAuthServer(("127.0.0.1", 0), StubAuthHandler)
+    port.put(server.server_port)
+    server.serve_forever()
+
+
+async def legacy_lookup(base_url, driver_id):
+    response = requests.get(f"{base_url}{driver_id}")
+    response.raise_for_status()
+    return response.json()
+
+
+async def measure(name, lookup, lookups, drivers, interval):
+    lags = []
+    stop = asyncio.Event()
+
+    async def heartbeat():
+        while not stop.is_set():
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+    monitor = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    # Lookups arrive spread out in time, like first-seen driver pings
+    tasks = []
+    for i in range(lookups):
+        tasks.append(asyncio.create_task(lookup(str(i % drivers))))
+        await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    blocked = sum(lag for lag in lags if lag > 5)
+    print(f"{name:>7}: {elapsed * 1000:8.1f} ms total, max loop lag {max(lags, default=0):7.1f} ms, loop blocked >5ms for {blocked:8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--drivers", type=int, default=50)
+    parser.add_argument("--delay-ms", type=float, default=20)
+    parser.add_argument("--interval-ms", type=float, default=1)
+    options = parser.parse_args()
+
+    # The stub runs in its own process so that it does not compete for our GIL
+    port = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_stub, args=(options.delay_ms / 1000, port), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{port.get()}/driver/info/"
+
+    client = DriverDetailsClient(base_url, ttl=300, max_entries=10000, max_connections=20, timeout=5)
+    await client.start()  # Done once in the application lifespan
+    await client.get("warmup")  # First request pays httpx's one-time lazy initialisation
+    try:
+        await measure("legacy", lambda driver_id: legacy_lookup(base_url, driver_id), options.lookups, options.drivers, options.interval_ms / 1000)
+        await measure("pooled", client.get, options.lookups, options.drivers, options.interval_ms / 1000)
+        print(f"pooled client stats: {client.stats()}")
+    finally:
+        await client.close()
+        server.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Compare the legacy per-ping ingest path (EXISTS + GEOADD + HSET) with the
+single-script upsert used by `update_driver_location`.
+
+Run from the locationService directory against a scratch Redis:
+
+    python -m benchmarks.ingest_round_trips --redis-url redis://127.0.0.1:6379/15 --pings 20000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import redis.asyncio as redis
+
+from redis_client import upsert_location_args, upsert_driver_location_script
+
+
+BENCH_KEY = "bench:drivers:locations"
+
+
+class CountingRedis(redis.Redis):
+    """Redis client that counts every command sent to the server."""
+    round_trips = 0
+
+    async def execute_command(self, *args, **options):
+        self.round_trips += 1
+        return await super().execute_command(*args, **options)
+
+
+async def legacy_ping(redis_client, driver_id, latitude, longitude):
+    exists = await redis_client.exists(f"bench:driver:{driver_id}")
+    await redis_client.geoadd(BENCH_KEY, (longitude, latitude, f"bench:driver:{driver_id}"))
+    await redis_client.hset(f"bench:driver:{driver_id}", "timestamp", time.time())
+    return not exists
+
+
+async def script_ping(redis_client, driver_id, latitude, longitude):
+    # The same arguments as `update_driver_location`; only the keys are moved under bench:
+    return await upsert_driver_location_script(
+        keys=[BENCH_KEY, f"bench:driver:{driver_id}", "bench:drivers:last_seen"],
+        args=upsert_location_args(driver_id, latitude, longitude, time.time()),
+        client=redis_client,
+    )
+
+
+async def run(name, ping, redis_client, pings, drivers):
+    # Seed metadata so that every measured ping is a steady-state ping
+    for driver_id in range(drivers):
+        await redis_client.hset(f"bench:driver:{driver_id}", mapping={"vehicle_type": "Car", "status": "available"})
+    await ping(redis_client, 0, 12.97, 77.59)  # warm up (loads the script)
+
+    redis_client.round_trips = 0
+    latencies = []
+    for _ in range(pings):
+        driver_id = random.randrange(drivers)
+        latitude = 12.9 + random.random() * 0.2
+        longitude = 77.5 + random.random() * 0.2
+        started = time.perf_counter()
+        await ping(redis_client, driver_id, latitude, longitude)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:>7}: {redis_client.round_trips / pings:.2f} round trips/ping, "
+        f"p50 {percentiles[49]:.3f} ms, p99 {percentiles[98]:.3f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/15")
+    parser.add_argument("--pings", type=int, default=20000)
+    parser.add_argument("--drivers", type=int, default=2000)
+    options = parser.parse_args()
+
+    redis_client = CountingRedis.from_url(options.redis_url, decode_responses=True)
+    try:
+        await run("legacy", legacy_ping, redis_client, options.pings, options.drivers)
+        await run("script", script_ping, redis_client, options.pings, options.drivers)
+    finally:
+        keys = [key async for key in redis_client.scan_iter(match="bench:*")]
+        if keys:
+            await redis_client.delete(*keys)
+        await redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+"""
+Compare the cost of parsing driver location messages sent as JSON (decoded and
+validated with the `LocationUpdate` model, as `/ws/location` does) with the
+fixed-layout binary frames of the `timely.location.v1` subprotocol.
+
+Run from the locationService directory:
+
+    python -m benchmarks.location_frame_parsing --frames 200000
+"""
+import argparse
+import json
+import random
+import time
+
+from location_frames import decode_location_frame, encode_location_frame
+from schemas import LocationUpdate
+
+
+def make_frames(count):
+    json_frames, binary_frames = [], []
+    for i in range(count):
+        latitude, longitude = random.uniform(12.8, 13.1), random.uniform(77.4, 77.8)
+        timestamp, speed, heading = time.time(), random.uniform(0, 20), random.uniform(0, 360)
+        json_frames.append(json.dumps({"driver_id": str(i % 5000), "latitude": latitude, "longitude": longitude}))
+        binary_frames.append(encode_location_frame(latitude, longitude, timestamp, speed, heading))
+    return json_frames, binary_frames
+
+
+def measure(name, parse, frames):
+    started = time.perf_counter()
+    for frame in frames:
+        parse(frame)
+    elapsed = time.perf_counter() - started
+    size = sum(len(frame) for frame in frames) / len(frames)
+    print(f"{name:<24} {len(frames) / elapsed:>12,.0f} frames/s  {elapsed / len(frames) * 1e6:6.2f} us/frame  {size:5.1f} bytes/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=200000)
+    options = parser.parse_args()
+
+    json_frames, binary_frames = make_frames(options.frames)
+    measure("json + LocationUpdate", lambda frame: LocationUpdate(**json.loads(frame)), json_frames)
+    measure("json only", json.loads, json_frames)
+    measure("binary frame", decode_location_frame, binary_frames)
+
+
+if __name__ == "__main__":
+    main()
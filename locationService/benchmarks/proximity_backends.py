@@ -0,0 +1,90 @@
+"""
+Compare radius and k-nearest queries of the in-process grid index with Redis
+GEOSEARCH over the same synthetic fleet.
+
+Run from the locationService directory against a scratch Redis:
+
+    python -m benchmarks.proximity_backends --redis-url redis://127.0.0.1:6379/15 --drivers 100000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import redis.asyncio as redis
+
+from spatial_index import GridSpatialIndex
+
+
+BENCH_KEY = "bench:drivers:locations"
+# Roughly the extent of a large city
+MIN_LAT, MAX_LAT = 12.80, 13.20
+MIN_LON, MAX_LON = 77.40, 77.80
+
+
+def random_point():
+    return random.uniform(MIN_LAT, MAX_LAT), random.uniform(MIN_LON, MAX_LON)
+
+
+def report(name, latencies_us):
+    percentiles = statistics.quantiles(latencies_us, n=100)
+    print(f"{name:>22}: mean {statistics.fmean(latencies_us):9.1f} us, p50 {percentiles[49]:9.1f} us, p99 {percentiles[98]:9.1f} us")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/15")
+    parser.add_argument("--drivers", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--radius", type=float, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    options = parser.parse_args()
+
+    index = GridSpatialIndex()
+    redis_client = redis.from_url(options.redis_url, decode_responses=True)
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for driver_id in range(options.drivers):
+                latitude, longitude = random_point()
+                index.upsert(str(driver_id), latitude, longitude, "Car", "available", 4.5)
+                pipe.geoadd(BENCH_KEY, (longitude, latitude, f"driver:{driver_id}"))
+            await pipe.execute()
+
+        queries = [random_point() for _ in range(options.queries)]
+        grid_radius, grid_knn, redis_radius, redis_knn = [], [], [], []
+        for latitude, longitude in queries:
+            started = time.perf_counter()
+            index.within_radius(latitude, longitude, options.radius, "Car")
+            grid_radius.append((time.perf_counter() - started) * 1e6)
+
+            started = time.perf_counter()
+            index.nearest(latitude, longitude, options.k, options.radius * 5, "Car")
+            grid_knn.append((time.perf_counter() - started) * 1e6)
+
+            started = time.perf_counter()
+            await redis_client.geosearch(
+                BENCH_KEY, longitude=longitude, latitude=latitude, radius=options.radius,
+                unit="m", sort="ASC", withdist=True, withcoord=True,
+            )
+            redis_radius.append((time.perf_counter() - started) * 1e6)
+
+            started = time.perf_counter()
+            await redis_client.geosearch(
+                BENCH_KEY, longitude=longitude, latitude=latitude, radius=options.radius * 5,
+                unit="m", sort="ASC", count=options.k, withdist=True, withcoord=True,
+            )
+            redis_knn.append((time.perf_counter() - started) * 1e6)
+
+        print(f"{options.drivers} drivers, {options.queries} queries, radius {options.radius:.0f} m, k={options.k}")
+        report("grid radius", grid_radius)
+        report("grid k-nearest", grid_knn)
+        report("redis GEOSEARCH radius", redis_radius)
+        report("redis GEOSEARCH k", redis_knn)
+    finally:
+        await redis_client.delete(BENCH_KEY)
+        await redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+Load test for Redis connection churn: drives concurrent /proximity and
+/update-location-manual traffic against a running location service and reports
+how many new Redis connections the server accepted while doing so.
+
+    uvicorn main:app --port 8004 &
+    python -m benchmarks.redis_connection_churn --service-url http://127.0.0.1:8004 --requests 5000 --concurrency 100
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import jwt
+import redis.asyncio as redis
+
+from config import settings
+
+
+def driver_token(driver_id: str) -> str:
+    return jwt.encode(
+        {"user_id": driver_id, "user": "driver", "exp": datetime.now(timezone.utc) + timedelta(hours=1)},
+        settings.AUTH_UNIVERSAL_SECRET,
+        algorithm=settings.ALGORITHM,
+    )
+
+
+async def redis_connection_stats(redis_client):
+    stats = await redis_client.info("stats")
+    clients = await redis_client.info("clients")
+    return stats["total_connections_received"], clients["connected_clients"]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service-url", default="http://127.0.0.1:8004")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--drivers", type=int, default=500)
+    options = parser.parse_args()
+
+    tokens = {str(driver_id): driver_token(str(driver_id)) for driver_id in range(options.drivers)}
+    semaphore = asyncio.Semaphore(options.concurrency)
+    failures = 0
+
+    async def one_request(client, i):
+        nonlocal failures
+        latitude, longitude = 12.9 + random.random() * 0.1, 77.5 + random.random() * 0.1
+        async with semaphore:
+            if i % 2:
+                response = await client.post("/proximity", json={"latitude": latitude, "longitude": longitude, "radius": 2000})
+            else:
+                driver_id = random.choice(list(tokens))
+                response = await client.post(
+                    "/update-location-manual",
+                    json={"driver_id": driver_id, "latitude": latitude, "longitude": longitude},
+                    headers={"token": tokens[driver_id]},
+                )
+            if response.status_code >= 400:
+                failures += 1
+
+    redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    limits = httpx.Limits(max_connections=options.concurrency)
+    async with httpx.AsyncClient(base_url=options.service_url, limits=limits, timeout=30) as client:
+        connections_before, _ = await redis_connection_stats(redis_client)
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request(client, i) for i in range(options.requests)))
+        elapsed = time.perf_counter() - started
+        connections_after, connected_clients = await redis_connection_stats(redis_client)
+        pool_stats = (await client.get("/stats")).json().get("redis_pool")
+    await redis_client.aclose()
+
+    print(f"{options.requests} requests in {elapsed:.2f} s ({options.requests / elapsed:.0f} req/s), {failures} failed")
+    print(f"new Redis connections during the run: {connections_after - connections_before}")
+    print(f"connected Redis clients after the run: {connected_clients}")
+    print(f"service pool stats: {pool_stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
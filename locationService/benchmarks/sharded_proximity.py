@@ -0,0 +1,151 @@
+"""
+Check and time proximity search over geohash-sharded Redis nodes.
+
+Seeds drivers spread over a few cities, runs radius and k-nearest queries and
+compares every answer with a brute-force search over the seeded positions. Then
+moves drivers across shard boundaries and checks that each ends up on exactly one
+shard with its status carried over. Start a few scratch redis-server processes
+and run from the locationService directory:
+
+    redis-server --port 7001 --save '' & redis-server --port 7002 --save '' & redis-server --port 7003 --save '' &
+    python -m benchmarks.sharded_proximity --redis-url redis://127.0.0.1:7001 \\
+        --redis-url redis://127.0.0.1:7002 --redis-url redis://127.0.0.1:7003 --drivers 20000
+
+The nodes are flushed first, so never point this at real data.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import redis.asyncio as redis
+
+from redis_client import REDIS_KEY, LAST_SEEN_KEY, upsert_location_args, upsert_driver_location_script, set_driver_details_script, set_driver_status_script
+from router import get_drivers_within_radius_with_filtering, get_nearest_drivers, update_driver_location
+from sharding import RedisShards
+from spatial_index import haversine_m
+
+
+CITIES = [(12.97, 77.59), (19.07, 72.88), (28.61, 77.21), (13.08, 80.27)]
+
+
+async def seed(shards, drivers):
+    positions = {}
+    for driver_id in range(drivers):
+        city_latitude, city_longitude = random.choice(CITIES)
+        positions[str(driver_id)] = (city_latitude + random.uniform(-0.8, 0.8), city_longitude + random.uniform(-0.8, 0.8))
+
+    by_shard = {}
+    for driver_id, (latitude, longitude) in positions.items():
+        by_shard.setdefault(shards.index_for(latitude, longitude), []).append(driver_id)
+    for shard, driver_ids in by_shard.items():
+        async with shards.clients[shard].pipeline(transaction=False) as pipe:
+            for driver_id in driver_ids:
+                latitude, longitude = positions[driver_id]
+                await upsert_driver_location_script(
+                    keys=[REDIS_KEY, f"driver:{driver_id}", LAST_SEEN_KEY],
+                    args=upsert_location_args(driver_id, latitude, longitude, time.time()),
+                    client=pipe,
+                )
+                await set_driver_details_script(
+                    keys=[REDIS_KEY, f"driver:{driver_id}"],
+                    args=[f"driver:{driver_id}", "Car", 4.5],
+                    client=pipe,
+                )
+            await pipe.execute()
+    print("drivers per shard:", [len(by_shard.get(shard, [])) for shard in range(len(shards))])
+    return positions
+
+
+def brute_force(positions, latitude, longitude, radius):
+    driver_ids = list(positions)
+    distances = haversine_m(
+        latitude, longitude,
+        [positions[driver_id][0] for driver_id in driver_ids],
+        [positions[driver_id][1] for driver_id in driver_ids],
+    )
+    return sorted((distance, driver_id) for driver_id, distance in zip(driver_ids, distances.tolist()) if distance <= radius)
+
+
+def report(name, samples, fan_outs):
+    samples = sorted(samples)
+    print(
+        f"{name:<12} p50 {statistics.median(samples):7.2f} ms  p99 {samples[int(len(samples) * 0.99) - 1]:7.2f} ms"
+        f"  avg shards queried {statistics.mean(fan_outs):.2f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", action="append", required=True, help="Repeat once per shard")
+    parser.add_argument("--precision", type=int, default=3, help="Geohash prefix length mapped to a shard")
+    parser.add_argument("--drivers", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--radius", type=float, default=3000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--moves", type=int, default=200)
+    options = parser.parse_args()
+
+    clients = [redis.from_url(url, decode_responses=True) for url in options.redis_url]
+    shards = RedisShards(clients, options.precision)
+    try:
+        for client in clients:
+            await client.flushdb()
+        positions = await seed(shards, options.drivers)
+
+        radius_ms, radius_fan_outs, nearest_ms, nearest_fan_outs, mismatches = [], [], [], [], 0
+        for _ in range(options.queries):
+            city_latitude, city_longitude = random.choice(CITIES)
+            latitude, longitude = city_latitude + random.uniform(-0.8, 0.8), city_longitude + random.uniform(-0.8, 0.8)
+            expected = brute_force(positions, latitude, longitude, options.radius)
+
+            started = time.perf_counter()
+            found = await get_drivers_within_radius_with_filtering(latitude, longitude, options.radius, shards)
+            radius_ms.append((time.perf_counter() - started) * 1000)
+            radius_fan_outs.append(len(shards.indexes_for_radius(latitude, longitude, options.radius)))
+            # Redis and haversine distances differ slightly, so compare membership away from the edge
+            if {d for distance, d in expected if distance < options.radius * 0.999} - {driver["driver_id"] for driver in found}:
+                mismatches += 1
+
+            started = time.perf_counter()
+            nearest, _ = await get_nearest_drivers(latitude, longitude, options.k, 500, options.radius, shards)
+            nearest_ms.append((time.perf_counter() - started) * 1000)
+            nearest_fan_outs.append(len(shards.indexes_for_radius(latitude, longitude, options.radius)))
+            if [driver["driver_id"] for driver in nearest][:3] != [driver_id for _, driver_id in expected[:options.k]][:3]:
+                mismatches += 1
+
+        print(f"{len(shards)} shards, {options.drivers} drivers, {options.queries} queries, radius {options.radius:.0f} m, k={options.k}")
+        report("radius", radius_ms, radius_fan_outs)
+        report("k-nearest", nearest_ms, nearest_fan_outs)
+        print(f"queries differing from brute force: {mismatches}")
+
+        # Move drivers to another city, most likely another shard, and check they were handed over
+        moved = random.sample(list(positions), options.moves)
+        for driver_id in moved[: options.moves // 2]:
+            await set_driver_status_script(
+                keys=[REDIS_KEY, f"driver:{driver_id}"],
+                args=[f"driver:{driver_id}", "booked", ""],
+                client=shards.client_for(*positions[driver_id]),
+            )
+        for driver_id in moved:
+            city_latitude, city_longitude = random.choice(CITIES)
+            positions[driver_id] = (city_latitude + random.uniform(-0.8, 0.8), city_longitude + random.uniform(-0.8, 0.8))
+            await update_driver_location(driver_id, *positions[driver_id], shards)
+
+        misplaced = 0
+        for index, driver_id in enumerate(moved):
+            holders = [await client.hget(f"driver:{driver_id}", "status") for client in clients]
+            owner = shards.index_for(*positions[driver_id])
+            expected_status = "booked" if index < options.moves // 2 else "available"
+            if sum(status is not None for status in holders) != 1 or holders[owner] != expected_status:
+                misplaced += 1
+        print(f"moved {len(moved)} drivers, misplaced after hand-over: {misplaced}")
+    finally:
+        for client in clients:
+            await client.flushdb()
+            await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
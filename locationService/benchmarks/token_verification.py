@@ -0,0 +1,63 @@
+"""
+Compare verifying a JWT with `jwt.decode` on every request against reusing the
+claims from `VerifiedTokenCache`, for a pool of distinct tokens such as the
+active sessions hitting one worker.
+
+Run from the locationService directory:
+
+    python -m benchmarks.token_verification --tokens 1000 --requests 200000
+"""
+import argparse
+import random
+import statistics
+import time
+
+import jwt
+
+from token_cache import VerifiedTokenCache
+
+
+SECRET = "benchmark-secret"
+
+
+def report(name, latencies_us):
+    percentiles = statistics.quantiles(latencies_us, n=100)
+    print(f"{name:>18}: mean {statistics.fmean(latencies_us):7.2f} us, p50 {percentiles[49]:7.2f} us, p99 {percentiles[98]:7.2f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--algorithm", default="HS256")
+    options = parser.parse_args()
+
+    expires_at = time.time() + 3600
+    tokens = [
+        jwt.encode({"user_id": str(user_id), "user": "customer", "exp": expires_at}, SECRET, algorithm=options.algorithm)
+        for user_id in range(options.tokens)
+    ]
+    requests = [random.choice(tokens) for _ in range(options.requests)]
+
+    decode_latencies = []
+    for token in requests:
+        started = time.perf_counter()
+        jwt.decode(token, SECRET, algorithms=[options.algorithm])
+        decode_latencies.append((time.perf_counter() - started) * 1e6)
+
+    cache = VerifiedTokenCache(SECRET, [options.algorithm], options.cache_size)
+    cached_latencies = []
+    for token in requests:
+        started = time.perf_counter()
+        cache.decode(token)
+        cached_latencies.append((time.perf_counter() - started) * 1e6)
+
+    print(f"{options.tokens} tokens, {options.requests} requests, {options.algorithm}, cache size {options.cache_size}")
+    report("jwt.decode", decode_latencies)
+    report("VerifiedTokenCache", cached_latencies)
+    print(f"cache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from redis_client import trip_breadcrumbs_key, trip_track_key
+from sharding import RedisShards
+from spatial_index import haversine_m
+
+
+def encode_polyline(points: List[Tuple[float, float]], precision: int = 5) -> str:
+    """Encode (latitude, longitude) pairs with the Google encoded polyline algorithm."""
+    factor = 10 ** precision
+    encoded = []
+    previous_latitude = previous_longitude = 0
+    for latitude, longitude in points:
+        latitude, longitude = round(latitude * factor), round(longitude * factor)
+        for delta in (latitude - previous_latitude, longitude - previous_longitude):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        previous_latitude, previous_longitude = latitude, longitude
+    return "".join(encoded)
+
+
+async def get_trip_breadcrumbs(trip_id: str, shards: RedisShards) -> Optional[dict]:
+    """
+    Read the recorded route of a trip with one pipeline per shard, in parallel.
+    A trip crossing shard boundaries has part of its breadcrumbs on each shard;
+    points are merged by time and the distances add up, since a driver's new
+    shard continues from the last point kept on the old one. The latest raw
+    position is appended when the downsampling has not kept it yet, so the route
+    always ends where the driver is. Returns None if nothing was recorded for the trip.
+    """
+    async def read_shard(redis_client):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.xrange(trip_breadcrumbs_key(trip_id))
+            pipe.hmget(
+                trip_track_key(trip_id),
+                "distance", "longitude", "latitude", "tail_longitude", "tail_latitude", "tail_timestamp",
+            )
+            return await pipe.execute()
+
+    shard_routes = [
+        (entries, track) for entries, track in await asyncio.gather(*(read_shard(client) for client in shards.clients))
+        if entries or track[3] is not None
+    ]
+    if not any(entries for entries, _ in shard_routes):
+        return None
+
+    entries = sorted((entry for entries, _ in shard_routes for entry in entries), key=lambda entry: float(entry[1]["timestamp"]))
+    points = [(float(fields["latitude"]), float(fields["longitude"])) for _, fields in entries]
+    distance = sum(float(track[0] or 0) for _, track in shard_routes)
+
+    # The latest raw position is on the shard that saw the driver last
+    track = max((track for _, track in shard_routes), key=lambda track: float(track[5] or 0))
+    if track[1] is not None and track[3] is not None and (track[3], track[4]) != (track[1], track[2]):
+        tail = (float(track[4]), float(track[3]))
+        distance += float(haversine_m(float(track[2]), float(track[1]), tail[0], tail[1]))
+        points.append(tail)
+
+    return {
+        "trip_id": trip_id,
+        "polyline": encode_polyline(points),
+        "points": len(points),
+        "distance": round(distance, 1),
+    }
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict, List, Tuple
+
+from fastapi import Request
+from pydantic import ValidationError
+
+from config import settings
+from schemas import LocationUpdate
+from helper_functions import fill_missing_driver_details
+from redis_client import REDIS_KEY, LAST_SEEN_KEY, upsert_location_args, upsert_driver_location_script
+from sharding import RedisShards, is_geo_position
+from spatial_index import driver_index
+from movement_filter import movement_filter
+
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+class BulkRequestError(ValueError):
+    """The request body as a whole could not be read as a list of records."""
+
+
+def _validation_message(err: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc']) or 'record'}: {error['msg']}" for error in err.errors())
+
+
+async def iter_bulk_records(request: Request) -> AsyncIterator[Tuple[int, object]]:
+    """
+    Yield (index, record) pairs from a JSON array body, or from an NDJSON body as
+    it streams in. An NDJSON line that is not valid JSON is yielded as the
+    `ValueError` describing it, so that it is reported without aborting the batch.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in NDJSON_CONTENT_TYPES:
+        try:
+            records = json.loads(await request.body())
+        except ValueError as err:
+            raise BulkRequestError(f"Invalid JSON body: {err}")
+        if not isinstance(records, list):
+            raise BulkRequestError("Body must be a JSON array of location updates.")
+        for index, record in enumerate(records):
+            yield index, record
+        return
+
+    index = 0
+    remainder = b""
+    async for chunk in request.stream():
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield index, _parse_ndjson_line(line)
+                index += 1
+    if remainder.strip():
+        yield index, _parse_ndjson_line(remainder)
+
+
+def _parse_ndjson_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as err:
+        return ValueError(f"Invalid JSON: {err}")
+
+
+async def write_bulk_locations(records: AsyncIterator[Tuple[int, object]], shards: RedisShards) -> dict:
+    """
+    Validate location records and write them with one pipeline per shard for every
+    `BULK_UPDATE_BATCH_SIZE` records. Invalid records and records Redis refuses
+    are reported by index; the rest of the request is still written. Records
+    that the movement filter drops only refresh the driver's last-seen time.
+    """
+    accepted = suppressed = 0
+    errors: List[Dict] = []
+    new_drivers: Dict[int, set] = {}
+    batch: List[Tuple[int, LocationUpdate, float]] = []
+    seen: List[Tuple[int, LocationUpdate, float]] = []
+
+    async def write_shard(shard, shard_batch, shard_seen):
+        nonlocal accepted, suppressed
+        async with shards.clients[shard].pipeline(transaction=False) as pipe:
+            for _, update, timestamp in shard_batch:
+                await upsert_driver_location_script(
+                    keys=[REDIS_KEY, f"driver:{update.driver_id}", LAST_SEEN_KEY],
+                    args=upsert_location_args(update.driver_id, update.latitude, update.longitude, timestamp),
+                    client=pipe,
+                )
+            if shard_seen:
+                pipe.zadd(LAST_SEEN_KEY, {f"driver:{update.driver_id}": timestamp for _, update, timestamp in shard_seen})
+            try:
+                results = await pipe.execute(raise_on_error=False)
+            except Exception as err:
+                # The node could not be reached at all
+                results = [err] * (len(shard_batch) + bool(shard_seen))
+
+        for (index, update, timestamp), result in zip(shard_batch, results):
+            if isinstance(result, Exception):
+                errors.append({"index": index, "driver_id": update.driver_id, "error": str(result)})
+                movement_filter.reset(update.driver_id)
+                continue
+            accepted += 1
+            needs_details, vehicle_type, status, rating = result
+            if needs_details:
+                new_drivers.setdefault(shard, set()).add(update.driver_id)
+            if driver_index is not None:
+                driver_index.upsert(update.driver_id, update.latitude, update.longitude, vehicle_type, status, rating, timestamp)
+        if shard_seen and isinstance(results[-1], Exception):
+            errors.extend({"index": index, "driver_id": update.driver_id, "error": str(results[-1])} for index, update, _ in shard_seen)
+        elif shard_seen:
+            suppressed += len(shard_seen)
+            accepted += len(shard_seen)
+            if driver_index is not None:
+                for _, update, timestamp in shard_seen:
+                    driver_index.touch(update.driver_id, timestamp)
+
+    async def flush():
+        shard_batches: Dict[int, Tuple[list, list]] = {}
+        for records, position in ((batch, 0), (seen, 1)):
+            for record in records:
+                update = record[1]
+                shard = shards.index_for(update.latitude, update.longitude)
+                shard_batches.setdefault(shard, ([], []))[position].append(record)
+        await asyncio.gather(*(write_shard(shard, *shard_batch) for shard, shard_batch in shard_batches.items()))
+        batch.clear()
+        seen.clear()
+
+    async for index, record in records:
+        if isinstance(record, ValueError):
+            errors.append({"index": index, "error": str(record)})
+            continue
+        try:
+            update = LocationUpdate.model_validate(record)
+        except ValidationError as err:
+            errors.append({"index": index, "error": _validation_message(err)})
+            continue
+        if not is_geo_position(update.latitude, update.longitude):
+            errors.append({"index": index, "driver_id": update.driver_id, "error": "Coordinates out of range."})
+            continue
+
+        timestamp = time.time()
+        if movement_filter.accept(update.driver_id, update.latitude, update.longitude, timestamp):
+            batch.append((index, update, timestamp))
+        else:
+            seen.append((index, update, timestamp))
+        if len(batch) + len(seen) >= settings.BULK_UPDATE_BATCH_SIZE:
+            await flush()
+    if batch or seen:
+        await flush()
+
+    for shard, driver_ids in new_drivers.items():
+        try:
+            await fill_missing_driver_details(list(driver_ids), shards.clients[shard], shards)
+        except Exception as e:
+            # Details are fetched again on the drivers' next update
+            print("Error fetching driver details: ", str(e))
+
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "accepted": accepted,
+        "suppressed": suppressed,
+        "rejected": len(errors),
+        "errors": errors,
+    }
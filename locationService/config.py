@@ -3,10 +3,43 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     REDIS_URL: str
+    REDIS_SHARD_URLS: str = ""              # Comma-separated nodes to shard location state over (default: REDIS_URL only)
+    REDIS_SHARD_GEOHASH_PRECISION: int = 3  # Geohash prefix length mapped to a shard (3 = ~156 km cells, at most 6)
+    REDIS_MAX_CONNECTIONS: int = 50         # Size of the shared connection pool per worker
+    REDIS_POOL_TIMEOUT_S: float = 5.0       # How long a request waits for a free connection
+    REDIS_HEALTH_CHECK_INTERVAL_S: int = 30 # Idle connections are PINGed before reuse after this
     AUTH_SERVICE_URL: str
     AUTH_UNIVERSAL_SECRET: str
     REALTIME_TRACKING_SECRET: str
     ALGORITHM: str
+    INGEST_FLUSH_INTERVAL_MS: int = 100     # Max time a WebSocket update waits in the buffer
+    INGEST_MAX_BATCH_SIZE: int = 500        # Flush early once this many drivers are buffered
+    PROXIMITY_BACKEND: str = "redis"        # "redis" (GEOSEARCH) or "grid" (in-process NumPy index)
+    GRID_CELL_SIZE_DEG: float = 0.01        # Cell size of the grid backend (~1.1 km)
+    PROXIMITY_CACHE_TTL_S: float = 1.0      # Reuse /proximity results for queries from the same spot this long (0 disables)
+    PROXIMITY_CACHE_GEOHASH_PRECISION: int = 7 # Queries in the same geohash cell share results (7 = ~150 m cells)
+    PROXIMITY_CACHE_RADIUS_BUCKET_M: float = 500.0 # Radii are rounded up to a multiple of this
+    PROXIMITY_CACHE_MAX_RADIUS_M: float = 5000.0 # Larger searches bypass the cache
+    PROXIMITY_CACHE_SIZE: int = 5000
+    STALE_DRIVER_WINDOW_S: int = 300        # Drivers silent for longer are removed from search
+    STALE_DRIVER_SWEEP_INTERVAL_S: int = 30
+    STALE_DRIVER_SWEEP_BATCH_SIZE: int = 500
+    STALE_DRIVER_ACTION: str = "evict"      # "evict" from the geo indexes or mark "unavailable"
+    TRACKING_KEEPALIVE_S: float = 15.0      # Resend the last position to idle tracking sockets
+    AUTH_SERVICE_TIMEOUT_S: float = 2.0
+    AUTH_SERVICE_MAX_CONNECTIONS: int = 20
+    DRIVER_DETAILS_CACHE_TTL_S: int = 300   # How long a driver's vehicle type/rating is reused
+    DRIVER_DETAILS_CACHE_SIZE: int = 10000
+    MOVEMENT_FILTER_MIN_DISTANCE_M: float = 10.0 # Pings moving less are not written (0 writes every ping)
+    MOVEMENT_FILTER_MAX_INTERVAL_S: float = 60.0 # Write at least this often even when standing still
+    HEATMAP_MAX_CELLS: int = 20000          # Largest bounding box /heatmap answers, in ~1.2 x 0.6 km cells
+    BULK_UPDATE_BATCH_SIZE: int = 1000      # Records written per pipeline by /update-location-bulk
+    BREADCRUMB_MIN_DISTANCE_M: float = 15.0 # Closer points are dropped as jitter
+    BREADCRUMB_MAX_DISTANCE_M: float = 200.0 # Keep a point at least this often on straight roads
+    BREADCRUMB_MIN_TURN_DEG: float = 20.0   # In between, keep a point only when the heading changes this much
+    BREADCRUMB_MAX_POINTS: int = 5000       # Approximate cap on stored points per trip
+    BREADCRUMB_TTL_S: int = 604800          # Breadcrumbs expire a week after the last update
+    TOKEN_CACHE_SIZE: int = 10000           # Verified JWTs kept per secret (0 verifies every request)
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,14 @@
+from enum import Enum
+
+class VehicleType(Enum):
+    BIKE = "Bike"
+    MOTORBIKE = "Motorbike"
+    SCOOTER = "Scooter"
+    CAR = "Car"
+    MINI_TRUCK = "Mini Truck"
+    PICKUP_TRUCK = "Pickup Truck"
+    LORRY = "Lorry"
+    TRAILER = "Trailer"
+    VAN = "Van"
+    CONTAINER_TRUCK = "Container Truck"
+    REFRIGERATED_TRUCK = "Refrigerated Truck"
\ No newline at end of file
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Dict, List
+
+from enums import VehicleType
+from redis_client import HEATMAP_KEY, HEATMAP_GEOHASH_PRECISION
+from sharding import RedisShards, geohash_cells
+
+
+async def get_supply_heatmap(
+    south: float, west: float, north: float, east: float, shards: RedisShards, vehicle_type: str = None
+) -> List[Dict]:
+    """
+    Available driver counts per geohash cell inside a bounding box, read from the
+    incrementally maintained heatmap with one HMGET per shard. The cost depends on
+    the number of cells in the box, never on the number of drivers.
+    Only cells with at least one driver are returned.
+    """
+    vehicle_types = [vehicle_type] if vehicle_type else [vt.value for vt in VehicleType]
+
+    # A heatmap cell lies inside a single shard cell, so each one is read from one shard
+    shard_cells: Dict[int, List] = {}
+    for geohash, latitude, longitude in geohash_cells(south, west, north, east, HEATMAP_GEOHASH_PRECISION):
+        shard_cells.setdefault(shards.index_for(latitude, longitude), []).append((geohash, latitude, longitude))
+
+    async def read_shard(shard, cells):
+        fields = [f"{driver_vehicle_type}:{geohash}" for geohash, _, _ in cells for driver_vehicle_type in vehicle_types]
+        return await shards.clients[shard].hmget(HEATMAP_KEY, fields)
+
+    shard_counts = await asyncio.gather(*(read_shard(shard, cells) for shard, cells in shard_cells.items()))
+
+    heatmap = []
+    for cells, counts in zip(shard_cells.values(), shard_counts):
+        for index, (geohash, latitude, longitude) in enumerate(cells):
+            cell_counts = counts[index * len(vehicle_types):(index + 1) * len(vehicle_types)]
+            by_vehicle_type = {
+                driver_vehicle_type: int(count)
+                for driver_vehicle_type, count in zip(vehicle_types, cell_counts)
+                if count and int(count) > 0
+            }
+            if by_vehicle_type:
+                heatmap.append({
+                    "geohash": geohash,
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "counts": by_vehicle_type,
+                    "total": sum(by_vehicle_type.values()),
+                })
+    return heatmap
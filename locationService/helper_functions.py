@@ -1,12 +1,213 @@
-import requests
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+import redis.asyncio as redis
 
 from config import settings
+from metrics import timed_call
+from redis_client import REDIS_KEY, LAST_SEEN_KEY, breadcrumb_args, set_driver_details_script, take_driver_script, adopt_driver_script
+from sharding import RedisShards
+from spatial_index import driver_index
+
+
+def _retrieve_exception(task: asyncio.Task):
+    """Mark a shared lookup's exception as retrieved when every caller has gone."""
+    if not task.cancelled():
+        task.exception()
+
+
+class DriverDetailsClient:
+    """
+    Non-blocking client for the auth service's driver info endpoint.
+
+    Uses one pooled keep-alive `httpx.AsyncClient`, caches vehicle type and rating
+    per driver with a TTL and LRU eviction, and lets concurrent lookups of the
+    same driver share a single in-flight request.
+    """
+    def __init__(self, base_url: str, ttl: float, max_entries: int, max_connections: int, timeout: float):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.timeout = timeout
+        self.client: Optional[httpx.AsyncClient] = None
+        self.cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Future] = {}
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.errors = 0
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _cached(self, driver_id: str) -> Optional[dict]:
+        entry = self.cache.get(driver_id)
+        if entry is None:
+            return None
+        expires_at, details = entry
+        if expires_at < time.monotonic():
+            del self.cache[driver_id]
+            return None
+        self.cache.move_to_end(driver_id)
+        return details
+
+    def _store(self, driver_id: str, details: dict):
+        self.cache[driver_id] = (time.monotonic() + self.ttl, details)
+        self.cache.move_to_end(driver_id)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    async def _fetch(self, driver_id: str) -> dict:
+        await self.start()
+        with timed_call("auth_service", "driver_info"):
+            response = await self.client.get(f"{self.base_url}{driver_id}")
+            response.raise_for_status()
+        return response.json()
+
+    async def get(self, driver_id: str) -> dict:
+        """Vehicle type and rating of a driver, from cache or the auth service."""
+        details = self._cached(driver_id)
+        if details is not None:
+            self.hits += 1
+            return details
 
+        future = self.in_flight.get(driver_id)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
 
-async def get_driver_vehicle_type_rating(driver_id: str):
+        # The lookup runs in its own task, so a cancelled caller does not cancel it for the others
+        self.misses += 1
+        task = asyncio.create_task(self._lookup(driver_id))
+        task.add_done_callback(_retrieve_exception)
+        self.in_flight[driver_id] = task
+        return await asyncio.shield(task)
+
+    async def _lookup(self, driver_id: str) -> dict:
+        try:
+            details = await self._fetch(driver_id)
+        except Exception:
+            self.errors += 1
+            raise
+        else:
+            self._store(driver_id, details)
+            return details
+        finally:
+            self.in_flight.pop(driver_id, None)
+
+    async def prefetch(self, driver_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        Fetch the details of many drivers concurrently over the shared pool.
+        Drivers whose lookup failed are left out of the result.
+        """
+        driver_ids = list(dict.fromkeys(driver_ids))
+        responses = await asyncio.gather(*(self.get(driver_id) for driver_id in driver_ids), return_exceptions=True)
+        return {
+            driver_id: details
+            for driver_id, details in zip(driver_ids, responses)
+            if not isinstance(details, BaseException)
+        }
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.shared
+        return {
+            "cache_size": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_in_flight": self.shared,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.shared) / lookups, 4) if lookups else 0.0,
+        }
+
+
+driver_details_client = DriverDetailsClient(
+    settings.AUTH_SERVICE_URL,
+    ttl=settings.DRIVER_DETAILS_CACHE_TTL_S,
+    max_entries=settings.DRIVER_DETAILS_CACHE_SIZE,
+    max_connections=settings.AUTH_SERVICE_MAX_CONNECTIONS,
+    timeout=settings.AUTH_SERVICE_TIMEOUT_S,
+)
+
+
+async def take_over_drivers(driver_ids: List[str], redis_client: redis.Redis, shards: RedisShards) -> List[str]:
     """
-    Fetch driver details from the driver service.
+    Move drivers that just showed up on the shard of `redis_client` away from the
+    shard they were on, carrying over their metadata, status and active trip.
+    Every other shard is asked once, with one pipeline each. Returns the drivers
+    that were not found anywhere else or have no vehicle type yet.
     """
-    response = requests.get(f"{settings.AUTH_SERVICE_URL}{driver_id}")
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+    others = [client for client in shards.clients if client is not redis_client]
+    if not others:
+        return driver_ids
+
+    async def take(client):
+        async with client.pipeline(transaction=False) as pipe:
+            for driver_id in driver_ids:
+                await take_driver_script(
+                    keys=[REDIS_KEY, f"driver:{driver_id}", LAST_SEEN_KEY],
+                    args=[f"driver:{driver_id}"],
+                    client=pipe,
+                )
+            return await pipe.execute()
+
+    taken = {}
+    for replies in await asyncio.gather(*(take(client) for client in others)):
+        for driver_id, reply in zip(driver_ids, replies):
+            if reply:
+                taken[driver_id] = reply
+    if not taken:
+        return driver_ids
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for driver_id, (vehicle_type, rating, status, active_trip, *track) in taken.items():
+            await adopt_driver_script(
+                keys=[REDIS_KEY, f"driver:{driver_id}"],
+                args=[f"driver:{driver_id}", vehicle_type, rating, status or "available", active_trip, *track, *breadcrumb_args()],
+                client=pipe,
+            )
+            if driver_index is not None:
+                driver_index.update_details(driver_id, vehicle_type, status or "available", rating)
+        await pipe.execute()
+    return [driver_id for driver_id in driver_ids if not taken.get(driver_id, [""])[0]]
+
+
+async def fill_missing_driver_details(driver_ids: List[str], redis_client: redis.Redis, shards: RedisShards = None):
+    """
+    Store vehicle type and rating for drivers whose metadata is not in Redis yet,
+    and index them in the geo partition of their vehicle type.
+    Drivers that moved in from another shard keep the metadata they had there;
+    the rest are looked up concurrently and written with one pipeline.
+    """
+    if shards is not None:
+        driver_ids = await take_over_drivers(driver_ids, redis_client, shards)
+        if not driver_ids:
+            return
+    drivers_details = await driver_details_client.prefetch(driver_ids)
+    if not drivers_details:
+        return
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for driver_id, driver_details in drivers_details.items():
+            vehicle_type = driver_details.get("vehicle_type") or ""
+            rating = driver_details.get("rating")
+            rating = "" if rating is None else rating
+            await set_driver_details_script(
+                keys=[REDIS_KEY, f"driver:{driver_id}"],
+                args=[f"driver:{driver_id}", vehicle_type, rating],
+                client=pipe,
+            )
+            if driver_index is not None:
+                driver_index.update_details(driver_id, vehicle_type=vehicle_type, rating=rating)
+        await pipe.execute()
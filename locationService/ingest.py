@@ -0,0 +1,196 @@
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+import redis.asyncio as redis
+
+from config import settings
+from helper_functions import fill_missing_driver_details
+from redis_client import REDIS_KEY, LAST_SEEN_KEY, upsert_location_args, upsert_driver_location_script
+from sharding import RedisShards, is_geo_position
+from spatial_index import driver_index
+from movement_filter import movement_filter
+
+
+class LocationIngestBuffer:
+    """
+    Collects location updates from all driver WebSockets of this worker and writes
+    them to Redis in pipelined batches. Only the latest update per driver is kept,
+    and the buffer is flushed every `flush_interval_ms` or as soon as it holds
+    `max_batch_size` drivers, whichever comes first. Each flush sends one pipeline
+    per shard. Updates dropped by the movement filter only refresh the drivers'
+    last-seen time in the same pipeline.
+    """
+    def __init__(self, flush_interval_ms: int, max_batch_size: int):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.pending: Dict[str, Tuple[float, float, float]] = {}
+        self.pending_seen: Dict[str, Tuple[float, float, float]] = {}
+        self.shards: Optional[RedisShards] = None
+        self._batch_full = asyncio.Event()
+
+        # Metrics
+        self.received = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.rejected = 0
+        self.failed_updates = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def submit(self, driver_id: str, latitude: float, longitude: float):
+        """
+        Buffer a location update, replacing any unflushed update of the same driver.
+        Positions Redis cannot store are dropped and counted as rejected.
+        """
+        self.received += 1
+        if not is_geo_position(latitude, longitude):
+            self.rejected += 1
+            return
+        timestamp = time.time()
+        if not movement_filter.accept(driver_id, latitude, longitude, timestamp):
+            self.pending_seen[driver_id] = (latitude, longitude, timestamp)
+            return
+        if driver_id in self.pending:
+            self.coalesced += 1
+        self.pending[driver_id] = (latitude, longitude, timestamp)
+
+        depth = len(self.pending)
+        self.max_depth = max(self.max_depth, depth)
+        if depth >= self.max_batch_size:
+            self._batch_full.set()
+
+    async def _write_shard(self, redis_client: redis.Redis, batch: Dict, seen: Dict) -> list:
+        """
+        Write the updates that belong to one shard with one pipeline. Updates that
+        Redis refuses come back as exceptions in the results, in place of theirs.
+        """
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for driver_id, (latitude, longitude, timestamp) in batch.items():
+                await upsert_driver_location_script(
+                    keys=[REDIS_KEY, f"driver:{driver_id}", LAST_SEEN_KEY],
+                    args=upsert_location_args(driver_id, latitude, longitude, timestamp),
+                    client=pipe,
+                )
+            if seen:
+                pipe.zadd(LAST_SEEN_KEY, {f"driver:{driver_id}": timestamp for driver_id, (_, _, timestamp) in seen.items()})
+            return await pipe.execute(raise_on_error=False)
+
+    async def flush(self):
+        """Write all buffered updates with one pipeline per shard, shards in parallel."""
+        if not self.pending and not self.pending_seen:
+            return
+        batch, self.pending = self.pending, {}
+        seen, self.pending_seen = self.pending_seen, {}
+
+        shard_batches: Dict[int, Tuple[Dict, Dict]] = {}
+        for updates, position in ((batch, 0), (seen, 1)):
+            for driver_id, update in updates.items():
+                shard = self.shards.index_for(update[0], update[1])
+                shard_batches.setdefault(shard, ({}, {}))[position][driver_id] = update
+
+        started = time.perf_counter()
+        shard_results = await asyncio.gather(
+            *(
+                self._write_shard(self.shards.clients[shard], shard_batch, shard_seen)
+                for shard, (shard_batch, shard_seen) in shard_batches.items()
+            ),
+            return_exceptions=True,
+        )
+
+        failed = None
+        written = []
+        for (shard, (shard_batch, shard_seen)), results in zip(shard_batches.items(), shard_results):
+            if isinstance(results, BaseException):
+                # The node could not be reached: put the shard's updates back unless a newer update arrived in the meantime
+                for driver_id, update in shard_batch.items():
+                    self.pending.setdefault(driver_id, update)
+                for driver_id, update in shard_seen.items():
+                    self.pending_seen.setdefault(driver_id, update)
+                failed = results
+            else:
+                written.append((shard, shard_batch, shard_seen, results))
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+        for shard, shard_batch, shard_seen, results in written:
+            new_drivers = []
+            for (driver_id, (latitude, longitude, timestamp)), result in zip(shard_batch.items(), results):
+                if isinstance(result, Exception):
+                    # Dropped rather than retried, so one bad update cannot hold up its shard
+                    print(f"Error writing location of driver {driver_id}: ", str(result))
+                    self.failed_updates += 1
+                    movement_filter.reset(driver_id)
+                    continue
+                self.flushed += 1
+                needs_details, vehicle_type, status, rating = result
+                if needs_details:
+                    new_drivers.append(driver_id)
+                if driver_index is not None:
+                    driver_index.upsert(driver_id, latitude, longitude, vehicle_type, status, rating, timestamp)
+            if shard_seen and isinstance(results[-1], Exception):
+                print("Error refreshing last-seen times: ", str(results[-1]))
+                self.failed_updates += len(shard_seen)
+            elif driver_index is not None:
+                for driver_id, (_, _, timestamp) in shard_seen.items():
+                    driver_index.touch(driver_id, timestamp)
+
+            if new_drivers:
+                try:
+                    await fill_missing_driver_details(new_drivers, self.shards.clients[shard], self.shards)
+                except Exception as e:
+                    # Details are fetched again on the driver's next flush
+                    print("Error fetching driver details: ", str(e))
+
+        if failed is not None:
+            self.failed_flushes += 1
+            raise failed
+
+    async def run(self, shards: RedisShards):
+        """Flush loop, started from the application lifespan."""
+        self.shards = shards
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_full.clear()
+
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Error flushing location updates: ", str(e))
+
+    def stats(self) -> dict:
+        return {
+            "buffer_depth": len(self.pending),
+            "pending_last_seen": len(self.pending_seen),
+            "max_buffer_depth": self.max_depth,
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "failed_flushes": self.failed_flushes,
+            "rejected": self.rejected,
+            "failed_updates": self.failed_updates,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "max_batch_size": self.max_batch_size,
+        }
+
+
+location_ingest_buffer = LocationIngestBuffer(
+    settings.INGEST_FLUSH_INTERVAL_MS, settings.INGEST_MAX_BATCH_SIZE
+)
@@ -0,0 +1,38 @@
+import math
+import struct
+from typing import Tuple
+
+from sharding import is_geo_position
+
+
+# Optional WebSocket subprotocol for driver location updates. Each binary message is
+# one fixed-layout little-endian frame of 32 bytes:
+#   latitude f64 | longitude f64 | timestamp f64 (client clock, epoch seconds) |
+#   speed f32 (m/s) | heading f32 (degrees clockwise from north)
+# Speed and heading are NaN when the device does not know them. The driver is the
+# authenticated user of the socket, so the frame does not carry an id.
+BINARY_LOCATION_SUBPROTOCOL = "timely.location.v1"
+LOCATION_FRAME = struct.Struct("<dddff")
+
+
+def encode_location_frame(
+    latitude: float, longitude: float, timestamp: float,
+    speed: float = math.nan, heading: float = math.nan
+) -> bytes:
+    return LOCATION_FRAME.pack(latitude, longitude, timestamp, speed, heading)
+
+
+def decode_location_frame(frame: bytes) -> Tuple[float, float, float, float, float]:
+    """
+    Unpack one binary location frame into (latitude, longitude, timestamp, speed, heading).
+    Raises ValueError for frames of the wrong size, with coordinates Redis cannot
+    store or with a timestamp that is not a finite number.
+    """
+    if len(frame) != LOCATION_FRAME.size:
+        raise ValueError(f"Location frame must be {LOCATION_FRAME.size} bytes, got {len(frame)}.")
+    latitude, longitude, timestamp, speed, heading = LOCATION_FRAME.unpack(frame)
+    if not is_geo_position(latitude, longitude):
+        raise ValueError("Location frame coordinates out of range.")
+    if not math.isfinite(timestamp):
+        raise ValueError("Location frame timestamp is not a finite number.")
+    return latitude, longitude, timestamp, speed, heading
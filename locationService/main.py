@@ -1,15 +1,59 @@
 import re
 import warnings
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from metrics import MetricsMiddleware, metrics_endpoint
+from helper_functions import driver_details_client
+from ingest import location_ingest_buffer
+from redis_client import redis_pool
+from spatial_index import driver_index, load_index_from_redis
+from tracking import tracking_hub
+from sweeper import stale_driver_sweeper
+from proximity_cache import proximity_cache
 from router import router
 
 
 # Ignore Deprecation Warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Lifespan context manager for startup and shutdown."""
+    await driver_details_client.start()
+    shards = await redis_pool.open()
+    if driver_index is not None:
+        for redis_client in shards.clients:
+            await load_index_from_redis(driver_index, redis_client)
+        print(f"Loaded {len(driver_index)} drivers into the grid index.")
+    background_tasks = {
+        "Location ingest flush task": asyncio.create_task(location_ingest_buffer.run(shards)),
+        "Live tracking listener": asyncio.create_task(tracking_hub.run(shards)),
+        "Stale driver sweeper": asyncio.create_task(stale_driver_sweeper.run(shards)),
+    }
+    if driver_index is None and proximity_cache.ttl > 0:
+        background_tasks["Proximity cache invalidation listener"] = asyncio.create_task(proximity_cache.run(shards))
+
+    try:
+        yield  # Keep the app running within this context
+    finally:
+        for task in background_tasks.values():
+            task.cancel()
+        for name, task in background_tasks.items():
+            try:
+                await task
+            except asyncio.CancelledError:
+                print(f"{name} cancelled.")
+        # Write whatever is still buffered before the connection goes away
+        await location_ingest_buffer.flush()
+        await redis_pool.close()
+        await driver_details_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,5 +62,7 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
 )
+app.add_middleware(MetricsMiddleware)
 
-app.include_router(router)
\ No newline at end of file
+app.include_router(router)
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
@@ -0,0 +1,65 @@
+import math
+from typing import Dict, Tuple
+
+from config import settings
+from spatial_index import EARTH_RADIUS_M
+
+
+class MovementFilter:
+    """
+    Per-driver filter that suppresses location writes of drivers who barely moved.
+    An update is written when the driver moved at least `min_distance_m` from the
+    last written position, when `max_interval_s` passed since that write, or after
+    `reset` (status change). Suppressed updates only refresh the driver's last-seen
+    marker, so keep `max_interval_s` below the stale driver window.
+
+    State is per worker: a status change handled by another worker only resets the
+    filter there, so the stored position lags by at most `min_distance_m`.
+    """
+    def __init__(self, min_distance_m: float, max_interval_s: float):
+        self.min_distance = min_distance_m
+        self.max_interval = max_interval_s
+        self.last_written: Dict[str, Tuple[float, float, float]] = {}
+
+        # Metrics
+        self.accepted = 0
+        self.suppressed = 0
+
+    def accept(self, driver_id: str, latitude: float, longitude: float, timestamp: float) -> bool:
+        """Return whether the update has to be written, remembering it if so."""
+        last = self.last_written.get(driver_id)
+        if last is not None and timestamp - last[2] < self.max_interval:
+            # Equirectangular distance, accurate enough at the scale of the threshold
+            x = math.radians(longitude - last[1]) * math.cos(math.radians((latitude + last[0]) / 2))
+            y = math.radians(latitude - last[0])
+            if EARTH_RADIUS_M * math.hypot(x, y) < self.min_distance:
+                self.suppressed += 1
+                return False
+        self.last_written[driver_id] = (latitude, longitude, timestamp)
+        self.accepted += 1
+        return True
+
+    def reset(self, driver_id: str):
+        """Force the driver's next update to be written."""
+        self.last_written.pop(driver_id, None)
+
+    def prune(self, cutoff: float):
+        """Forget drivers whose last write is older than `cutoff`; their next update is written anyway."""
+        for driver_id in [driver_id for driver_id, last in self.last_written.items() if last[2] < cutoff]:
+            del self.last_written[driver_id]
+
+    def stats(self) -> dict:
+        total = self.accepted + self.suppressed
+        return {
+            "accepted": self.accepted,
+            "suppressed": self.suppressed,
+            "suppressed_ratio": round(self.suppressed / total, 4) if total else 0.0,
+            "tracked_drivers": len(self.last_written),
+            "min_distance_m": self.min_distance,
+            "max_interval_s": self.max_interval,
+        }
+
+
+movement_filter = MovementFilter(
+    settings.MOVEMENT_FILTER_MIN_DISTANCE_M, settings.MOVEMENT_FILTER_MAX_INTERVAL_S
+)
@@ -0,0 +1,247 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import redis.asyncio as redis
+
+from config import settings
+from redis_client import STATUS_CHANNEL
+from sharding import RedisShards, METRES_PER_DEGREE, geohash_encode, geohash_cell_size, geohash_cells
+from spatial_index import EARTH_RADIUS_M, haversine_m
+
+
+# Entries are indexed by the coarse geohash cells their search circle touches, so that a
+# status change only has to look at the entries of one cell (5 = ~4.9 x 4.9 km cells)
+INVALIDATION_GEOHASH_PRECISION = 5
+
+# Earth radius of Redis' GEO commands, so that cached distances match GEOSEARCH's
+REDIS_GEO_EARTH_RADIUS_M = 6372797.560856
+
+CacheKey = Tuple[str, float, Optional[str]]
+# (expires at, drivers, their latitudes, their longitudes, invalidation cells)
+CacheEntry = Tuple[float, List[Dict], np.ndarray, np.ndarray, List[str]]
+
+
+class ProximityCache:
+    """
+    Short-lived cache of proximity searches, for crowds of customers querying from
+    the same venue within seconds of each other.
+
+    Queries are keyed by the geohash cell they fall in, their radius rounded up to
+    a bucket and the vehicle type. On a miss, the available drivers within the
+    bucket radius of any point of the cell are searched once (concurrent misses of
+    the same key share that search), and each query is answered from the entry by
+    recomputing distances from its own position. A cached answer therefore only
+    differs from a direct search by what changed during the TTL.
+
+    Entries are also dropped as soon as a driver near them becomes or stops being
+    available: the status scripts publish the driver's geohash on the status
+    channel of its shard, which every worker listens to.
+    """
+    def __init__(self, ttl: float, precision: int, radius_bucket: float, max_radius: float, max_entries: int):
+        self.ttl = ttl
+        self.precision = precision
+        self.radius_bucket = radius_bucket
+        self.max_radius = max_radius
+        self.max_entries = max_entries
+        self.cell_height, self.cell_width = geohash_cell_size(precision)
+        self.cache: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self.by_cell: Dict[str, Set[CacheKey]] = {}
+        self.cell_versions: Dict[str, int] = {}
+        self.in_flight: Dict[CacheKey, asyncio.Future] = {}
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.bypassed = 0
+        self.invalidations = 0
+        self.invalidated_entries = 0
+
+    def key(self, latitude: float, longitude: float, radius: float, vehicle_type: Optional[str]) -> Optional[CacheKey]:
+        """Cache key of a query, or None if the query is not cached."""
+        if self.ttl <= 0 or radius > self.max_radius:
+            return None
+        bucket = math.ceil(radius / self.radius_bucket) * self.radius_bucket
+        return geohash_encode(latitude, longitude, self.precision), bucket, vehicle_type
+
+    def _cell_centre(self, latitude: float, longitude: float) -> Tuple[float, float]:
+        return (
+            -90.0 + (math.floor((latitude + 90.0) / self.cell_height) + 0.5) * self.cell_height,
+            -180.0 + (math.floor((longitude + 180.0) / self.cell_width) + 0.5) * self.cell_width,
+        )
+
+    def _search_radius(self, latitude: float, bucket: float) -> float:
+        """Bucket radius grown by the cell's half diagonal, so it covers queries from anywhere in the cell."""
+        half_height = self.cell_height / 2 * METRES_PER_DEGREE
+        half_width = self.cell_width / 2 * METRES_PER_DEGREE * math.cos(math.radians(latitude))
+        return bucket + math.hypot(half_height, half_width) + 1.0
+
+    def _cached(self, key: CacheKey) -> Optional[CacheEntry]:
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return None
+        self.cache.move_to_end(key)
+        return entry
+
+    def _store(self, key: CacheKey, entry: CacheEntry):
+        if key in self.cache:
+            self._drop(key)
+        self.cache[key] = entry
+        for cell in entry[4]:
+            self.by_cell.setdefault(cell, set()).add(key)
+        while len(self.cache) > self.max_entries:
+            self._drop(next(iter(self.cache)))
+
+    def _drop(self, key: CacheKey):
+        entry = self.cache.pop(key)
+        for cell in entry[4]:
+            keys = self.by_cell.get(cell)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_cell[cell]
+
+    def invalidate(self, geohash: str):
+        """Drop every entry whose search area may contain a driver at this geohash."""
+        cell = geohash[:INVALIDATION_GEOHASH_PRECISION]
+        self.invalidations += 1
+        self.cell_versions[cell] = self.cell_versions.get(cell, 0) + 1
+        for key in list(self.by_cell.get(cell, ())):
+            self._drop(key)
+            self.invalidated_entries += 1
+
+    async def _fill(
+        self, key: CacheKey, latitude: float, longitude: float,
+        search: Callable[[float, float, float], Awaitable[List[Dict]]],
+    ) -> CacheEntry:
+        latitude, longitude = self._cell_centre(latitude, longitude)
+        radius = self._search_radius(latitude, key[1])
+        lat_span = radius / METRES_PER_DEGREE
+        lon_span = radius / (METRES_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+        cells = [
+            cell for cell, _, _ in geohash_cells(
+                latitude - lat_span, longitude - lon_span, latitude + lat_span, longitude + lon_span,
+                INVALIDATION_GEOHASH_PRECISION,
+            )
+        ]
+        versions = [self.cell_versions.get(cell, 0) for cell in cells]
+
+        drivers = await search(latitude, longitude, radius)
+        entry = (
+            time.monotonic() + self.ttl,
+            drivers,
+            np.array([driver["latitude"] for driver in drivers], dtype=np.float64),
+            np.array([driver["longitude"] for driver in drivers], dtype=np.float64),
+            cells,
+        )
+        # A status change seen while searching may not be reflected in the result
+        if versions == [self.cell_versions.get(cell, 0) for cell in cells]:
+            self._store(key, entry)
+        return entry
+
+    @staticmethod
+    def _answer(entry: CacheEntry, latitude: float, longitude: float, radius: float, limit: Optional[int]) -> List[Dict]:
+        """The drivers of an entry within `radius` of the query, closest first."""
+        _, drivers, latitudes, longitudes, _ = entry
+        if not drivers:
+            return []
+        distances = haversine_m(latitude, longitude, latitudes, longitudes) * (REDIS_GEO_EARTH_RADIUS_M / EARTH_RADIUS_M)
+        inside = np.flatnonzero(distances <= radius)
+        order = inside[np.argsort(distances[inside], kind="stable")][:limit]
+        return [dict(drivers[slot], distance=round(float(distances[slot]), 4)) for slot in order]
+
+    async def get(
+        self, latitude: float, longitude: float, radius: float, vehicle_type: Optional[str], limit: Optional[int],
+        search: Callable[[float, float, float], Awaitable[List[Dict]]],
+    ) -> Optional[List[Dict]]:
+        """
+        Available drivers within `radius` of a position, answered from the cache.
+        `search(latitude, longitude, radius)` must return every available driver of
+        the vehicle type within that radius. Returns None for queries that are not
+        cached, which the caller then searches directly.
+        """
+        key = self.key(latitude, longitude, radius, vehicle_type)
+        if key is None:
+            self.bypassed += 1
+            return None
+
+        entry = self._cached(key)
+        if entry is not None:
+            self.hits += 1
+            return self._answer(entry, latitude, longitude, radius, limit)
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.shared += 1
+            entry = await asyncio.shield(future)
+            return self._answer(entry, latitude, longitude, radius, limit)
+
+        # The search runs in its own task, so a cancelled request does not cancel it for the crowd
+        self.misses += 1
+        task = asyncio.create_task(self._fill_shared(key, latitude, longitude, search))
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self.in_flight[key] = task
+        entry = await asyncio.shield(task)
+        return self._answer(entry, latitude, longitude, radius, limit)
+
+    async def _fill_shared(
+        self, key: CacheKey, latitude: float, longitude: float,
+        search: Callable[[float, float, float], Awaitable[List[Dict]]],
+    ) -> CacheEntry:
+        try:
+            return await self._fill(key, latitude, longitude, search)
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def _listen(self, pubsub: redis.client.PubSub):
+        await pubsub.subscribe(STATUS_CHANNEL)
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Error reading driver status changes: ", str(e))
+                await asyncio.sleep(1)
+                continue
+            if message and message["type"] == "message":
+                self.invalidate(message["data"])
+
+    async def run(self, shards: RedisShards):
+        """Invalidation listener, started from the application lifespan."""
+        pubsubs = [redis_client.pubsub(ignore_subscribe_messages=True) for redis_client in shards.clients]
+        try:
+            await asyncio.gather(*(self._listen(pubsub) for pubsub in pubsubs))
+        finally:
+            for pubsub in pubsubs:
+                await pubsub.aclose()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.shared
+        return {
+            "ttl_s": self.ttl,
+            "entries": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_in_flight": self.shared,
+            "bypassed": self.bypassed,
+            "invalidations": self.invalidations,
+            "invalidated_entries": self.invalidated_entries,
+            "hit_rate": round((self.hits + self.shared) / lookups, 4) if lookups else 0.0,
+        }
+
+
+proximity_cache = ProximityCache(
+    settings.PROXIMITY_CACHE_TTL_S,
+    precision=settings.PROXIMITY_CACHE_GEOHASH_PRECISION,
+    radius_bucket=settings.PROXIMITY_CACHE_RADIUS_BUCKET_M,
+    max_radius=settings.PROXIMITY_CACHE_MAX_RADIUS_M,
+    max_entries=settings.PROXIMITY_CACHE_SIZE,
+)
@@ -0,0 +1,106 @@
+"""
+Rebuild the per (vehicle_type, status) driver geo partitions and the supply
+heatmap from the existing `drivers:locations` geo set and `driver:<id>` hashes,
+and add drivers missing from the `drivers:last_seen` index with their last ping
+timestamp.
+
+Used to migrate a Redis that predates the partitioned indexes, or to repair
+them. New partitions are built under temporary keys and swapped in with RENAME.
+With REDIS_SHARD_URLS set, every shard is rebuilt on its own.
+
+    python rebuild_indexes.py [--batch-size 500]
+"""
+import argparse
+import asyncio
+
+import redis.asyncio as redis
+
+from redis_client import REDIS_KEY, LAST_SEEN_KEY, HEATMAP_KEY, HEATMAP_GEOHASH_PRECISION, shard_urls
+
+
+REBUILD_SUFFIX = ":rebuild"
+
+
+async def rebuild_partitions(redis_client: redis.Redis, batch_size: int = 500) -> dict:
+    """Derive the partitioned geo sets from the driver hashes. Returns member counts per partition."""
+    counts = {}
+    batch = []
+
+    async def index_batch(driver_keys):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for driver_key in driver_keys:
+                pipe.hmget(driver_key, "vehicle_type", "status", "timestamp")
+                pipe.geopos(REDIS_KEY, driver_key)
+                pipe.geohash(REDIS_KEY, driver_key)
+            replies = await pipe.execute()
+
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for driver_key, (vehicle_type, status, timestamp), position, geohash in zip(driver_keys, replies[::3], replies[1::3], replies[2::3]):
+                if timestamp:
+                    pipe.zadd(LAST_SEEN_KEY, {driver_key: float(timestamp)}, nx=True)
+                if not vehicle_type or not position or position[0] is None:
+                    pipe.hdel(driver_key, "heat_cell")
+                    continue
+                longitude, latitude = position[0]
+                partition = f"{REDIS_KEY}:{vehicle_type}:{status or 'available'}"
+                pipe.geoadd(partition + REBUILD_SUFFIX, (longitude, latitude, driver_key))
+                counts[partition] = counts.get(partition, 0) + 1
+                if (status or "available") == "available":
+                    cell = f"{vehicle_type}:{geohash[0][:HEATMAP_GEOHASH_PRECISION]}"
+                    pipe.hincrby(HEATMAP_KEY + REBUILD_SUFFIX, cell, 1)
+                    pipe.hset(driver_key, "heat_cell", cell)
+                else:
+                    pipe.hdel(driver_key, "heat_cell")
+            await pipe.execute()
+
+    # Only `driver:<id>` hashes, not keys like `driver:<id>:state` owned by other services
+    async for driver_key in redis_client.scan_iter(match="driver:*", count=batch_size, _type="hash"):
+        if driver_key.count(":") != 1:
+            continue
+        batch.append(driver_key)
+        if len(batch) >= batch_size:
+            await index_batch(batch)
+            batch = []
+    if batch:
+        await index_batch(batch)
+
+    # Swap the new partitions in and drop partitions that no longer have members
+    stale = [
+        key async for key in redis_client.scan_iter(match=f"{REDIS_KEY}:*", _type="zset")
+        if not key.endswith(REBUILD_SUFFIX) and key not in counts
+    ]
+    has_heatmap = await redis_client.exists(HEATMAP_KEY + REBUILD_SUFFIX)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for partition in counts:
+            pipe.rename(partition + REBUILD_SUFFIX, partition)
+        if stale:
+            pipe.delete(*stale)
+        if has_heatmap:
+            pipe.rename(HEATMAP_KEY + REBUILD_SUFFIX, HEATMAP_KEY)
+        else:
+            pipe.delete(HEATMAP_KEY)
+        await pipe.execute()
+
+    return counts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    options = parser.parse_args()
+
+    urls = shard_urls()
+    for shard, url in enumerate(urls):
+        redis_client = redis.from_url(url, decode_responses=True)
+        try:
+            counts = await rebuild_partitions(redis_client, options.batch_size)
+        finally:
+            await redis_client.close()
+
+        for partition, count in sorted(counts.items()):
+            print(f"{partition}: {count} drivers")
+        print(f"Rebuilt {len(counts)} partitions" + (f" on shard {shard}." if len(urls) > 1 else "."))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,24 +1,171 @@
+import asyncio
+import time
+from typing import List, Optional
+
 import redis.asyncio as redis
 
 from config import settings
+from metrics import timed_call
+from sharding import RedisShards
+from redis_scripts import HEATMAP_GEOHASH_PRECISION, UPSERT_DRIVER_LOCATION, SET_DRIVER_DETAILS, SET_DRIVER_STATUS, SWEEP_STALE_DRIVERS, NEAREST_DRIVERS, TAKE_DRIVER, ADOPT_DRIVER
+
+
+REDIS_KEY = "drivers:locations"
+LAST_SEEN_KEY = "drivers:last_seen"
+HEATMAP_KEY = f"{REDIS_KEY}:heatmap"  # Maintained by the scripts in redis_scripts.py
+STATUS_CHANNEL = f"{REDIS_KEY}:status_changes"  # Geohashes of drivers that became or stopped being available
+
+
+def partition_key(vehicle_type: str, status: str) -> str:
+    """Geo set holding the drivers of one vehicle type in one status."""
+    return f"{REDIS_KEY}:{vehicle_type}:{status}"
+
+
+def location_channel(driver_id: str) -> str:
+    """Pub/sub channel on which every accepted position of a driver is published."""
+    return f"driver:{driver_id}:location"
+
+
+def trip_breadcrumbs_key(trip_id: str) -> str:
+    """Stream of the downsampled positions recorded during a trip."""
+    return f"trip:{trip_id}:breadcrumbs"
 
 
-class RedisFactory:
+def trip_track_key(trip_id: str) -> str:
+    """Hash with the last kept breadcrumb, distance driven and latest raw position of a trip."""
+    return f"trip:{trip_id}:track"
+
+
+def breadcrumb_args() -> list:
+    """Breadcrumb settings, as passed to the scripts that record trip breadcrumbs."""
+    return [
+        settings.BREADCRUMB_MIN_DISTANCE_M, settings.BREADCRUMB_MAX_DISTANCE_M,
+        settings.BREADCRUMB_MIN_TURN_DEG, settings.BREADCRUMB_MAX_POINTS, settings.BREADCRUMB_TTL_S,
+    ]
+
+
+def upsert_location_args(driver_id: str, latitude: float, longitude: float, timestamp: float) -> list:
+    """ARGV of `upsert_driver_location_script` for one position update."""
+    return [longitude, latitude, f"driver:{driver_id}", timestamp, location_channel(driver_id), *breadcrumb_args()]
+
+
+def shard_urls() -> List[str]:
+    """Redis nodes holding location state: REDIS_SHARD_URLS, or just REDIS_URL."""
+    return [url.strip() for url in settings.REDIS_SHARD_URLS.split(",") if url.strip()] or [settings.REDIS_URL]
+
+
+class MonitoredConnectionPool(redis.BlockingConnectionPool):
     """
-    Factory class to manage Redis connections using async context manager.
+    Blocking connection pool that counts new connections and checkouts, so that
+    connection churn and pool saturation can be observed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections_created = 0
+        self.checkouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def make_connection(self):
+        self.connections_created += 1
+        return super().make_connection()
+
+    async def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        connection = await super().get_connection(command_name, *keys, **options)
+        waited_ms = (time.perf_counter() - started) * 1000
+        self.checkouts += 1
+        self.total_wait_ms += waited_ms
+        self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+        return connection
+
+    def stats(self) -> dict:
+        return {
+            "max_connections": self.max_connections,
+            "in_use": len(self._in_use_connections),
+            "idle": len(self._available_connections),
+            "connections_created": self.connections_created,
+            "checkouts": self.checkouts,
+            "avg_checkout_wait_ms": round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+            "max_checkout_wait_ms": round(self.max_wait_ms, 3),
+        }
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client recording the latency of every command and pipeline in /metrics."""
+    async def execute_command(self, *args, **options):
+        with timed_call("redis", str(args[0])):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> "InstrumentedPipeline":
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        with timed_call("redis", "pipeline"):
+            return await super().execute(raise_on_error)
+
+
+class RedisPoolManager:
+    """
+    Owns the application-lifetime Redis connection pools, opened and closed by the
+    lifespan hook. Every request, WebSocket and background task shares them.
+    With REDIS_SHARD_URLS set there is one pool per shard, and `shards` routes
+    location state between them; otherwise `shards` has the single REDIS_URL node.
     """
     def __init__(self):
-        self.redis_client = None
+        self.pools: List[MonitoredConnectionPool] = []
+        self.shards: Optional[RedisShards] = None
+
+    async def open(self) -> RedisShards:
+        clients = []
+        for url in shard_urls():
+            pool = MonitoredConnectionPool.from_url(
+                url,
+                decode_responses=True,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_POOL_TIMEOUT_S,
+                health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL_S,
+                socket_keepalive=True,
+            )
+            self.pools.append(pool)
+            clients.append(InstrumentedRedis(connection_pool=pool))
+        await asyncio.gather(*(client.ping() for client in clients))
+        self.shards = RedisShards(clients, settings.REDIS_SHARD_GEOHASH_PRECISION)
+        return self.shards
+
+    async def close(self):
+        if self.shards:
+            for client in self.shards.clients:
+                await client.aclose()
+        for pool in self.pools:
+            await pool.disconnect()
+        self.pools = []
+        self.shards = None
+
+    def stats(self) -> dict:
+        # A single node keeps the flat layout; shards are listed in node order
+        if len(self.pools) == 1:
+            return self.pools[0].stats()
+        return {"shards": [pool.stats() for pool in self.pools]}
+
+
+redis_pool = RedisPoolManager()
+
 
-    async def __aenter__(self):
-        self.redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-        return self.redis_client
+# Dependency function to inject the location shards using FastAPI
+async def get_redis_shards() -> RedisShards:
+    return redis_pool.shards
 
-    async def __aexit__(self, exc_type, exc_value, traceback):
-        if self.redis_client:
-            await self.redis_client.close()
 
-# Dependency function to inject Redis client using FastAPI
-async def get_redis() -> redis.Redis:
-    async with RedisFactory() as redis_client:
-        return redis_client
\ No newline at end of file
+# Scripts are registered once (only the SHA is computed, no connection is opened)
+# and executed against the client passed in at call time.
+_script_registry = redis.from_url(settings.REDIS_URL, decode_responses=True)
+upsert_driver_location_script = _script_registry.register_script(UPSERT_DRIVER_LOCATION)
+set_driver_details_script = _script_registry.register_script(SET_DRIVER_DETAILS)
+set_driver_status_script = _script_registry.register_script(SET_DRIVER_STATUS)
+sweep_stale_drivers_script = _script_registry.register_script(SWEEP_STALE_DRIVERS)
+nearest_drivers_script = _script_registry.register_script(NEAREST_DRIVERS)
+take_driver_script = _script_registry.register_script(TAKE_DRIVER)
+adopt_driver_script = _script_registry.register_script(ADOPT_DRIVER)
@@ -0,0 +1,321 @@
+# Lua scripts executed server-side so that multi-step Redis operations cost a
+# single round trip and are applied atomically.
+#
+# Besides the `drivers:locations` geo set holding every driver, each driver is
+# indexed in exactly one partition `drivers:locations:<vehicle_type>:<status>`.
+# The partition keys are derived from the driver hash inside the scripts, which
+# is why these scripts target standalone Redis nodes rather than a cluster. When
+# location state is sharded (see sharding.py), all keys of a driver live on one
+# node and TAKE_DRIVER/ADOPT_DRIVER move them when the driver changes shard.
+
+
+# Supply heatmap: `drivers:locations:heatmap` counts available drivers per
+# `<vehicle_type>:<geohash cell>` field. Every script that can change a driver's
+# position, status or vehicle type calls update_heatmap, which keeps the driver
+# counted in exactly one cell (remembered as `heat_cell` on the driver hash)
+# while it is available and indexed.
+HEATMAP_GEOHASH_PRECISION = 6  # ~1.2 x 0.6 km cells
+
+_UPDATE_HEATMAP = """
+local function update_heatmap(geo_key, driver_key, member)
+    local state = redis.call('HMGET', driver_key, 'vehicle_type', 'status', 'heat_cell')
+    local cell = false
+    if state[1] and state[1] ~= '' and state[2] == 'available' then
+        local geohash = redis.call('GEOHASH', geo_key, member)[1]
+        if geohash then
+            cell = state[1] .. ':' .. string.sub(geohash, 1, """ + str(HEATMAP_GEOHASH_PRECISION) + """)
+        end
+    end
+    if state[3] == cell then
+        return
+    end
+    local heatmap_key = geo_key .. ':heatmap'
+    if state[3] and redis.call('HINCRBY', heatmap_key, state[3], -1) <= 0 then
+        redis.call('HDEL', heatmap_key, state[3])
+    end
+    if cell then
+        redis.call('HINCRBY', heatmap_key, cell, 1)
+        redis.call('HSET', driver_key, 'heat_cell', cell)
+    else
+        redis.call('HDEL', driver_key, 'heat_cell')
+    end
+end
+"""
+
+
+# Trip breadcrumbs: while a driver has an active trip, each position is considered for
+# the trip's breadcrumb stream `trip:<id>:breadcrumbs`. A point is kept once it is max
+# distance away from the last kept point, or min distance away and turning by at least
+# min turn, so straight stretches and jitter while standing cost nothing. `trip:<id>:track`
+# holds the last kept point, the distance driven so far and the latest raw position.
+# `settings` = {min distance (m), max distance (m), min turn (deg), max points, TTL (s)}
+_RECORD_BREADCRUMB = """
+local function record_breadcrumb(trip_id, longitude, latitude, timestamp, settings)
+    local breadcrumbs_key = 'trip:' .. trip_id .. ':breadcrumbs'
+    local track_key = 'trip:' .. trip_id .. ':track'
+    local last = redis.call('HMGET', track_key, 'longitude', 'latitude', 'bearing')
+    local keep = not last[1]
+    local distance, bearing = 0, ''
+    if last[1] then
+        local lon1, lat1 = math.rad(tonumber(last[1])), math.rad(tonumber(last[2]))
+        local lon2, lat2 = math.rad(tonumber(longitude)), math.rad(tonumber(latitude))
+        local a = math.sin((lat2 - lat1) / 2) ^ 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ^ 2
+        distance = 12742000 * math.asin(math.sqrt(a))
+        bearing = math.deg(math.atan2(math.sin(lon2 - lon1) * math.cos(lat2),
+            math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(lon2 - lon1)))
+        if distance >= tonumber(settings[2]) then
+            keep = true
+        elseif distance >= tonumber(settings[1]) and last[3] and last[3] ~= '' then
+            local turn = math.abs(bearing - tonumber(last[3])) % 360
+            if turn > 180 then
+                turn = 360 - turn
+            end
+            keep = turn >= tonumber(settings[3])
+        end
+    end
+    if keep then
+        redis.call('XADD', breadcrumbs_key, 'MAXLEN', '~', settings[4], '*',
+            'longitude', longitude, 'latitude', latitude, 'timestamp', timestamp)
+        redis.call('HSET', track_key, 'longitude', longitude, 'latitude', latitude, 'bearing', tostring(bearing))
+        redis.call('HINCRBYFLOAT', track_key, 'distance', tostring(distance))
+    end
+    redis.call('HSET', track_key, 'tail_longitude', longitude, 'tail_latitude', latitude, 'tail_timestamp', timestamp)
+    redis.call('EXPIRE', breadcrumbs_key, settings[5])
+    redis.call('EXPIRE', track_key, settings[5])
+end
+"""
+
+
+# KEYS[1] = geo set of driver locations, KEYS[2] = driver hash, KEYS[3] = last-seen sorted set
+# ARGV[1] = longitude, ARGV[2] = latitude, ARGV[3] = geo member, ARGV[4] = timestamp,
+# ARGV[5] = channel on which the new position is published for live tracking,
+# ARGV[6..10] = breadcrumb min distance (m), max distance (m), min turn (deg), max points, TTL (s)
+# Returns [needs_details, vehicle_type, status, rating], where needs_details is 1 when
+# the driver's metadata (vehicle type/rating) still has to be fetched.
+# While the driver has an active trip, the position is recorded with record_breadcrumb.
+UPSERT_DRIVER_LOCATION = _UPDATE_HEATMAP + _RECORD_BREADCRUMB + """
+redis.call('GEOADD', KEYS[1], ARGV[1], ARGV[2], ARGV[3])
+redis.call('HSET', KEYS[2], 'timestamp', ARGV[4])
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[3])
+redis.call('PUBLISH', ARGV[5], '{"latitude":' .. ARGV[2] .. ',"longitude":' .. ARGV[1] .. ',"timestamp":' .. ARGV[4] .. '}')
+redis.call('HSETNX', KEYS[2], 'status', 'available')
+-- A driver the sweeper marked unavailable for being silent is available again, and back in search
+if redis.call('HDEL', KEYS[2], 'stale') == 1 and redis.call('HGET', KEYS[2], 'status') == 'unavailable' then
+    redis.call('HSET', KEYS[2], 'status', 'available')
+    local vehicle_type = redis.call('HGET', KEYS[2], 'vehicle_type')
+    if vehicle_type and vehicle_type ~= '' then
+        redis.call('ZREM', KEYS[1] .. ':' .. vehicle_type .. ':unavailable', ARGV[3])
+        redis.call('PUBLISH', KEYS[1] .. ':status_changes', redis.call('GEOHASH', KEYS[1], ARGV[3])[1])
+    end
+end
+local details = redis.call('HMGET', KEYS[2], 'vehicle_type', 'status', 'rating', 'active_trip')
+if details[4] then
+    record_breadcrumb(details[4], ARGV[1], ARGV[2], ARGV[4], {ARGV[6], ARGV[7], ARGV[8], ARGV[9], ARGV[10]})
+end
+update_heatmap(KEYS[1], KEYS[2], ARGV[3])
+if not details[1] then
+    return {1, '', details[2], ''}
+end
+if details[1] ~= '' then
+    redis.call('GEOADD', KEYS[1] .. ':' .. details[1] .. ':' .. details[2], ARGV[1], ARGV[2], ARGV[3])
+end
+return {0, details[1], details[2], details[3] or ''}
+"""
+
+
+# KEYS[1] = geo set of driver locations, KEYS[2] = driver hash
+# ARGV[1] = geo member, ARGV[2] = vehicle type, ARGV[3] = rating
+# When an available driver enters search or changes vehicle type, its geohash is
+# published on the status channel.
+SET_DRIVER_DETAILS = _UPDATE_HEATMAP + """
+local old = redis.call('HMGET', KEYS[2], 'vehicle_type', 'status')
+local status = old[2] or 'available'
+redis.call('HSET', KEYS[2], 'vehicle_type', ARGV[2], 'rating', ARGV[3], 'status', status)
+if old[1] and old[1] ~= '' and old[1] ~= ARGV[2] then
+    redis.call('ZREM', KEYS[1] .. ':' .. old[1] .. ':' .. status, ARGV[1])
+end
+local position = redis.call('GEOPOS', KEYS[1], ARGV[1])[1]
+if position and ARGV[2] ~= '' then
+    redis.call('GEOADD', KEYS[1] .. ':' .. ARGV[2] .. ':' .. status, position[1], position[2], ARGV[1])
+end
+if position and status == 'available' and (old[1] or '') ~= ARGV[2] then
+    redis.call('PUBLISH', KEYS[1] .. ':status_changes', redis.call('GEOHASH', KEYS[1], ARGV[1])[1])
+end
+update_heatmap(KEYS[1], KEYS[2], ARGV[1])
+return 1
+"""
+
+
+# KEYS[1] = geo set of driver locations, KEYS[2] = driver hash
+# ARGV[1] = geo member, ARGV[2] = new status, ARGV[3] = trip id ('' for none)
+# Moves the driver to the partition of its new status. Booking a driver with a trip id
+# starts recording breadcrumbs for that trip; any other status stops it. When the driver
+# becomes or stops being available, its geohash is published on the status channel.
+# Returns 0 if the driver is unknown.
+SET_DRIVER_STATUS = _UPDATE_HEATMAP + """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+local details = redis.call('HMGET', KEYS[2], 'vehicle_type', 'status')
+redis.call('HSET', KEYS[2], 'status', ARGV[2])
+redis.call('HDEL', KEYS[2], 'stale')
+if ARGV[2] ~= 'booked' then
+    redis.call('HDEL', KEYS[2], 'active_trip')
+elseif ARGV[3] ~= '' then
+    redis.call('HSET', KEYS[2], 'active_trip', ARGV[3])
+end
+if details[1] and details[1] ~= '' and details[2] ~= ARGV[2] then
+    if details[2] then
+        redis.call('ZREM', KEYS[1] .. ':' .. details[1] .. ':' .. details[2], ARGV[1])
+    end
+    local position = redis.call('GEOPOS', KEYS[1], ARGV[1])[1]
+    if position then
+        redis.call('GEOADD', KEYS[1] .. ':' .. details[1] .. ':' .. ARGV[2], position[1], position[2], ARGV[1])
+        if details[2] == 'available' or ARGV[2] == 'available' then
+            redis.call('PUBLISH', KEYS[1] .. ':status_changes', redis.call('GEOHASH', KEYS[1], ARGV[1])[1])
+        end
+    end
+end
+update_heatmap(KEYS[1], KEYS[2], ARGV[1])
+return 1
+"""
+
+
+# KEYS[1] = geo set of driver locations, KEYS[2] = last-seen sorted set
+# ARGV[1] = cutoff timestamp, ARGV[2] = batch size, ARGV[3] = 'evict' or 'unavailable'
+# Processes up to a batch of drivers not seen since the cutoff and returns their geo members.
+# 'evict' drops them from every geo index (their hash is kept), 'unavailable' marks
+# available drivers unavailable until their next ping. Like SET_DRIVER_STATUS, the
+# geohash of every available driver taken out of search is published on the status channel.
+SWEEP_STALE_DRIVERS = _UPDATE_HEATMAP + """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(stale) do
+    local details = redis.call('HMGET', member, 'vehicle_type', 'status')
+    local has_partition = details[1] and details[1] ~= '' and details[2]
+    if details[2] == 'available' then
+        local geohash = redis.call('GEOHASH', KEYS[1], member)[1]
+        if geohash then
+            redis.call('PUBLISH', KEYS[1] .. ':status_changes', geohash)
+        end
+    end
+    if ARGV[3] == 'evict' then
+        if has_partition then
+            redis.call('ZREM', KEYS[1] .. ':' .. details[1] .. ':' .. details[2], member)
+        end
+        redis.call('ZREM', KEYS[1], member)
+    elseif details[2] == 'available' then
+        redis.call('HSET', member, 'status', 'unavailable', 'stale', '1')
+        if has_partition then
+            redis.call('ZREM', KEYS[1] .. ':' .. details[1] .. ':available', member)
+            local position = redis.call('GEOPOS', KEYS[1], member)[1]
+            if position then
+                redis.call('GEOADD', KEYS[1] .. ':' .. details[1] .. ':unavailable', position[1], position[2], member)
+            end
+        end
+    end
+    update_heatmap(KEYS[1], member, member)
+    redis.call('ZREM', KEYS[2], member)
+end
+return stale
+"""
+
+
+# KEYS = geo partitions to search (available drivers of the requested vehicle types)
+# ARGV[1] = longitude, ARGV[2] = latitude, ARGV[3] = k, ARGV[4] = initial radius (m),
+# ARGV[5] = max radius (m), ARGV[6] = radius growth factor per step
+# Grows the radius until k drivers are found or the max radius is searched. Returns
+# [radius searched, [[member, distance, longitude, latitude, partition index, rating], ...]]
+# ordered by distance.
+NEAREST_DRIVERS = """
+local k = tonumber(ARGV[3])
+local radius = tonumber(ARGV[4])
+local max_radius = tonumber(ARGV[5])
+local found
+while true do
+    if radius > max_radius then
+        radius = max_radius
+    end
+    found = {}
+    for i, key in ipairs(KEYS) do
+        local hits = redis.call('GEOSEARCH', key, 'FROMLONLAT', ARGV[1], ARGV[2], 'BYRADIUS', radius, 'm',
+            'ASC', 'COUNT', k, 'WITHDIST', 'WITHCOORD')
+        for _, hit in ipairs(hits) do
+            table.insert(found, {hit[1], hit[2], hit[3][1], hit[3][2], i})
+        end
+    end
+    if #found >= k or radius >= max_radius then
+        break
+    end
+    radius = radius * tonumber(ARGV[6])
+end
+table.sort(found, function(a, b) return tonumber(a[2]) < tonumber(b[2]) end)
+local nearest = {}
+for i = 1, math.min(k, #found) do
+    local hit = found[i]
+    table.insert(nearest, {hit[1], hit[2], hit[3], hit[4], hit[5], redis.call('HGET', hit[1], 'rating') or ''})
+end
+return {tostring(radius), nearest}
+"""
+
+
+# KEYS[1] = geo set of driver locations, KEYS[2] = driver hash, KEYS[3] = last-seen sorted set
+# ARGV[1] = geo member
+# Removes a driver that moved to another shard from this one. Returns
+# [vehicle_type, rating, status, active_trip, track longitude, track latitude, track bearing]
+# ('' where unset) for the new shard to adopt, or an empty list if the driver is not here.
+TAKE_DRIVER = _UPDATE_HEATMAP + """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return {}
+end
+local details = redis.call('HMGET', KEYS[2], 'vehicle_type', 'rating', 'status', 'active_trip')
+if details[1] and details[1] ~= '' and details[3] then
+    redis.call('ZREM', KEYS[1] .. ':' .. details[1] .. ':' .. details[3], ARGV[1])
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+update_heatmap(KEYS[1], KEYS[2], ARGV[1])
+local track = {}
+if details[4] then
+    track = redis.call('HMGET', 'trip:' .. details[4] .. ':track', 'longitude', 'latitude', 'bearing')
+end
+redis.call('DEL', KEYS[2])
+return {details[1] or '', details[2] or '', details[3] or '', details[4] or '',
+    track[1] or '', track[2] or '', track[3] or ''}
+"""
+
+
+# KEYS[1] = geo set of driver locations, KEYS[2] = driver hash
+# ARGV[1] = geo member, ARGV[2] = vehicle type, ARGV[3] = rating, ARGV[4] = status,
+# ARGV[5] = active trip, ARGV[6..8] = last kept breadcrumb longitude, latitude, bearing,
+# ARGV[9..13] = breadcrumb settings, as for UPSERT_DRIVER_LOCATION
+# Applies what TAKE_DRIVER returned to the driver on its new shard, so that status,
+# metadata and the active trip carry over and breadcrumbs continue from the last kept point.
+# The position that brought the driver here was upserted before the trip was known, so
+# it is recorded as a breadcrumb now.
+ADOPT_DRIVER = _UPDATE_HEATMAP + _RECORD_BREADCRUMB + """
+local current = redis.call('HMGET', KEYS[2], 'vehicle_type', 'status')
+if current[1] and current[1] ~= '' and current[2] then
+    redis.call('ZREM', KEYS[1] .. ':' .. current[1] .. ':' .. current[2], ARGV[1])
+end
+redis.call('HSET', KEYS[2], 'status', ARGV[4])
+if ARGV[2] ~= '' then
+    redis.call('HSET', KEYS[2], 'vehicle_type', ARGV[2], 'rating', ARGV[3])
+    local position = redis.call('GEOPOS', KEYS[1], ARGV[1])[1]
+    if position then
+        redis.call('GEOADD', KEYS[1] .. ':' .. ARGV[2] .. ':' .. ARGV[4], position[1], position[2], ARGV[1])
+    end
+end
+if ARGV[5] ~= '' then
+    redis.call('HSET', KEYS[2], 'active_trip', ARGV[5])
+    if ARGV[6] ~= '' then
+        redis.call('HSET', 'trip:' .. ARGV[5] .. ':track', 'longitude', ARGV[6], 'latitude', ARGV[7], 'bearing', ARGV[8])
+    end
+    local position = redis.call('GEOPOS', KEYS[1], ARGV[1])[1]
+    local timestamp = redis.call('HGET', KEYS[2], 'timestamp')
+    if position and timestamp then
+        record_breadcrumb(ARGV[5], position[1], position[2], timestamp, {ARGV[9], ARGV[10], ARGV[11], ARGV[12], ARGV[13]})
+    end
+end
+update_heatmap(KEYS[1], KEYS[2], ARGV[1])
+return 1
+"""
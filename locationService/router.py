@@ -1,116 +1,236 @@
 import redis.asyncio as redis
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from typing import List, Dict
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request
+from typing import List, Dict, Optional, Tuple
 import time
+import math
 import asyncio
 
-from schemas import LocationUpdate, ProximityQuery
-from redis_client import get_redis
-from helper_functions import get_driver_vehicle_type_rating
-from dependencies import validate_auth_token, validate_tracking_token_ws, validate_auth_token_ws
+from schemas import LocationUpdate, ProximityQuery, NearestQuery
+from enums import VehicleType
+from sharding import RedisShards, geohash_cell_count, is_geo_position
+from redis_client import REDIS_KEY, LAST_SEEN_KEY, HEATMAP_GEOHASH_PRECISION, get_redis_shards, redis_pool, partition_key, upsert_location_args, upsert_driver_location_script, set_driver_status_script, nearest_drivers_script
+from helper_functions import fill_missing_driver_details, driver_details_client
+from ingest import location_ingest_buffer
+from breadcrumbs import get_trip_breadcrumbs
+from heatmap import get_supply_heatmap
+from location_frames import BINARY_LOCATION_SUBPROTOCOL, decode_location_frame
+from spatial_index import driver_index
+from tracking import tracking_hub
+from sweeper import stale_driver_sweeper
+from movement_filter import movement_filter
+from proximity_cache import proximity_cache
+from bulk_updates import BulkRequestError, iter_bulk_records, write_bulk_locations
+from config import settings
+from dependencies import validate_auth_token, validate_tracking_token_ws, validate_auth_token_ws, auth_tokens, tracking_tokens
 
 
 router = APIRouter()
-REDIS_KEY = "drivers:locations"
 
 
 async def update_driver_location(
-    driver_id: str, latitude: float, longitude: float, redis_client: redis.Redis
+    driver_id: str, latitude: float, longitude: float, shards: RedisShards
 ):
     """
-    Add/Update a driver's location and metadata in Redis.
+    Add/Update a driver's location and metadata in Redis, on the shard of the new position.
+
+    Position, timestamp and default status are written by a single server-side
+    script, so a regular ping costs one round trip. Only while the driver's
+    vehicle type is unknown do we go back to the auth service and Redis.
+    Pings that barely moved only refresh the driver's last-seen time.
     """
-    exists = await redis_client.exists(f"driver:{driver_id}")
+    redis_client = shards.client_for(latitude, longitude)
+    timestamp = time.time()
+    if not movement_filter.accept(driver_id, latitude, longitude, timestamp):
+        await redis_client.zadd(LAST_SEEN_KEY, {f"driver:{driver_id}": timestamp})
+        if driver_index is not None:
+            driver_index.touch(driver_id, timestamp)
+        return
+
+    needs_details, vehicle_type, status, rating = await upsert_driver_location_script(
+        keys=[REDIS_KEY, f"driver:{driver_id}", LAST_SEEN_KEY],
+        args=upsert_location_args(driver_id, latitude, longitude, timestamp),
+        client=redis_client,
+    )
+    if driver_index is not None:
+        driver_index.upsert(driver_id, latitude, longitude, vehicle_type, status, rating)
 
-    # Update location and timestamp
-    await redis_client.geoadd(REDIS_KEY, (longitude, latitude, f"driver:{driver_id}"))
-    await redis_client.hset(f"driver:{driver_id}", "timestamp", time.time())
-
-    # If the driver does not exist, fetch vehicle type and rating
-    if not exists:
-        driver_details = await get_driver_vehicle_type_rating(driver_id)
-        await redis_client.hset(
-            f"driver:{driver_id}",
-            mapping={
-                "vehicle_type": driver_details.get("vehicle_type", ""),
-                "rating": driver_details.get("rating", ""),
-                "status": "available"
-            }
-        )
+    # If the driver is seen for the first time (on this shard), fetch vehicle type and rating
+    if needs_details:
+        await fill_missing_driver_details([driver_id], redis_client, shards)
 
 
 async def get_drivers_within_radius_with_filtering(
-    latitude: float, longitude: float, radius: float, redis_client: redis.Redis, vehicle_type: str = None
+    latitude: float, longitude: float, radius: float, shards: RedisShards,
+    vehicle_type: str = None, limit: int = None
 ) -> List[Dict]:
     """
-    Query Redis to find drivers within a certain radius with filtering.
+    Find available drivers within a certain radius. Only the shards whose area
+    intersects the search circle are queried, in parallel, and their results are
+    merged by ascending distance and cut to `limit`.
     """
-    # current_time = time.time()
-
-    # Fetch nearby drivers using Redis GEO search
-    nearby_drivers = await redis_client.geosearch(
-        REDIS_KEY,
-        longitude=longitude,
-        latitude=latitude,
-        radius=radius,
-        unit="m",
-        withdist=True,
-        withcoord=True
-    )
-    # print(nearby_drivers)
+    searches = await asyncio.gather(*(
+        search_shard_within_radius(latitude, longitude, radius, redis_client, vehicle_type, limit)
+        for redis_client in shards.clients_for_radius(latitude, longitude, radius)
+    ))
+    if len(searches) == 1:
+        return searches[0]
+    return sorted((driver for drivers in searches for driver in drivers), key=lambda driver: driver["distance"])[:limit]
+
+
+async def search_shard_within_radius(
+    latitude: float, longitude: float, radius: float, redis_client: redis.Redis,
+    vehicle_type: str = None, limit: int = None
+) -> List[Dict]:
+    """
+    Query one Redis node to find available drivers within a certain radius.
+    Only the geo partitions of available drivers (of the requested vehicle type)
+    are searched. Results are ordered by ascending distance and cut to `limit`.
+    """
+    vehicle_types = [vehicle_type] if vehicle_type else [vt.value for vt in VehicleType]
+
+    # Fetch nearby drivers using Redis GEO search, closest first
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for driver_vehicle_type in vehicle_types:
+            pipe.geosearch(
+                partition_key(driver_vehicle_type, "available"),
+                longitude=longitude,
+                latitude=latitude,
+                radius=radius,
+                unit="m",
+                sort="ASC",
+                count=limit,
+                withdist=True,
+                withcoord=True
+            )
+        searches = await pipe.execute()
+
+    nearby_drivers = sorted(
+        (
+            (driver_key, distance, coords, driver_vehicle_type)
+            for driver_vehicle_type, hits in zip(vehicle_types, searches)
+            for (driver_key, distance, coords) in hits
+        ),
+        key=lambda hit: hit[1],
+    )[:limit]
+    if not nearby_drivers:
+        return []
+
+    # Fetch the ratings of the selected drivers in one pipelined round trip
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for (driver_key, distance, coords, driver_vehicle_type) in nearby_drivers:
+            pipe.hget(driver_key, "rating")
+        ratings = await pipe.execute()
 
     results = []
-    for (driver_key, distance, coords) in nearby_drivers:
-        driver_id = driver_key.split(":")[1]
-        driver_data = await redis_client.hgetall(f"driver:{driver_id}")
-        # print(driver_data)
-        # print(current_time)
-
-        # Validate and filter driver data
-        # Print each condition result beforehand
-        # print(f"Driver data exists: {bool(driver_data)}")
-        # print(f'Driver status is available: {driver_data.get("status") == "available"}')
-        # print(f'Vehicle type matches: {vehicle_type is None or driver_data.get("vehicle_type") == vehicle_type}')
-        # print(f'Timestamp is recent: {current_time - float(driver_data.get("timestamp", 0)) < 120}')
-
-        if (
-            driver_data and
-            driver_data.get("status") == "available" and  # Driver must be available
-            (vehicle_type is None or driver_data.get("vehicle_type") == vehicle_type) 
-            # and current_time - float(driver_data.get("timestamp", 0)) < 300  # Must be recent
-        ):
-            latitude, longitude = coords
-            results.append({
-                "driver_id": driver_id,
-                "distance": distance,
-                "latitude": latitude,
-                "longitude": longitude,
-                "vehicle_type": driver_data.get(b"vehicle_type", b""),
-                "rating": driver_data.get(b"rating", b""),
-                "status": driver_data.get(b"status", b"")
-            })
-    # print(results)
+    for (driver_key, distance, coords, driver_vehicle_type), rating in zip(nearby_drivers, ratings):
+        longitude, latitude = coords
+        results.append({
+            "driver_id": driver_key.split(":")[1],
+            "distance": distance,
+            "latitude": latitude,
+            "longitude": longitude,
+            "vehicle_type": driver_vehicle_type,
+            "rating": rating,
+            "status": "available"
+        })
 
     return results
 
 
+async def get_nearest_drivers(
+    latitude: float, longitude: float, k: int, initial_radius: float, max_radius: float,
+    shards: RedisShards, vehicle_type: str = None
+) -> Tuple[List[Dict], float]:
+    """
+    Find the `k` closest available drivers, doubling the search radius from
+    `initial_radius` until enough are found or `max_radius` is reached.
+    The whole search runs server-side in a single call per shard; each shard
+    returns its own `k` closest, so the merged top `k` is exact.
+    """
+    vehicle_types = [vehicle_type] if vehicle_type else [vt.value for vt in VehicleType]
+    searches = await asyncio.gather(*(
+        nearest_drivers_script(
+            keys=[partition_key(driver_vehicle_type, "available") for driver_vehicle_type in vehicle_types],
+            args=[longitude, latitude, k, initial_radius, max_radius, 2],
+            client=redis_client,
+        )
+        for redis_client in shards.clients_for_radius(latitude, longitude, max_radius)
+    ))
+    radius = max(float(shard_radius) for shard_radius, _ in searches)
+    nearest = sorted((hit for _, hits in searches for hit in hits), key=lambda hit: float(hit[1]))[:k]
+
+    drivers = []
+    for driver_key, distance, driver_longitude, driver_latitude, partition, rating in nearest:
+        drivers.append({
+            "driver_id": driver_key.split(":")[1],
+            "distance": float(distance),
+            "latitude": float(driver_latitude),
+            "longitude": float(driver_longitude),
+            "vehicle_type": vehicle_types[partition - 1],
+            "rating": rating,
+            "status": "available"
+        })
+    return drivers, radius
+
+
+async def receive_binary_locations(websocket: WebSocket, driver_id: str):
+    """
+    Receive fixed-layout binary location frames from one driver's socket.
+    Frames older than the last accepted one (by the client's clock) are dropped,
+    since a reconnecting device may flush buffered positions out of order.
+    """
+    last_timestamp = -math.inf
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            frame = message.get("bytes")
+            if frame is None:
+                print(f"Text message on the binary location socket of driver {driver_id}")
+                await websocket.close(code=1003)
+                return
+            try:
+                latitude, longitude, timestamp, _speed, _heading = decode_location_frame(frame)
+            except ValueError as err:
+                print(f"Invalid location frame from driver {driver_id}: {err}")
+                await websocket.close(code=1007)
+                return
+            if timestamp < last_timestamp:
+                continue
+            last_timestamp = timestamp
+            location_ingest_buffer.submit(driver_id, latitude, longitude)
+    except WebSocketDisconnect:
+        print(f"WebSocket disconnected for driver: {driver_id}")
+
+
 @router.websocket("/ws/location")
-async def websocket_endpoint(websocket: WebSocket, redis_client: redis.Redis = Depends(get_redis), user_details: dict = Depends(validate_auth_token_ws)):
+async def websocket_endpoint(websocket: WebSocket, user_details: dict = Depends(validate_auth_token_ws)):
     """
     WebSocket endpoint to receive location updates from multiple drivers.
+    Updates are buffered and written to Redis in batches by the ingest buffer.
+    Clients negotiating the `timely.location.v1` subprotocol send compact binary
+    frames instead of JSON (see location_frames.py).
     """
     if user_details.get("user") != "driver":
         raise HTTPException(status_code=403, detail="Unauthorized driver.")
+    if BINARY_LOCATION_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        await websocket.accept(subprotocol=BINARY_LOCATION_SUBPROTOCOL)
+        await receive_binary_locations(websocket, user_details.get("user_id"))
+        return
     await websocket.accept()
     try:
         while True:
             data = await websocket.receive_json()
             location_update = LocationUpdate(**data)
-            await update_driver_location(
+            if not is_geo_position(location_update.latitude, location_update.longitude):
+                print(f"Invalid location update from driver {location_update.driver_id}: coordinates out of range.")
+                await websocket.close(code=1007)
+                return
+            location_ingest_buffer.submit(
                 location_update.driver_id,
                 location_update.latitude,
                 location_update.longitude,
-                redis_client,
             )
     except WebSocketDisconnect:
         print(f"WebSocket disconnected for driver: {user_details.get('user_id')}")
@@ -121,27 +241,47 @@ async def websocket_endpoint(websocket: WebSocket, redis_client: redis.Redis = D
 
 
 @router.post("/update-location-manual")
-async def update_location(location_update: LocationUpdate, redis_client: redis.Redis = Depends(get_redis), user_details: dict = Depends(validate_auth_token)):
+async def update_location(location_update: LocationUpdate, shards: RedisShards = Depends(get_redis_shards), user_details: dict = Depends(validate_auth_token)):
     """
     Endpoint to receive location update on manual click.
     """
     if user_details.get("user") != "driver":
         raise HTTPException(status_code=403, detail="Unauthorized driver.")
+    if not is_geo_position(location_update.latitude, location_update.longitude):
+        raise HTTPException(status_code=422, detail="Coordinates out of range.")
     try:
         await update_driver_location(
             location_update.driver_id,
             location_update.latitude,
             location_update.longitude,
-            redis_client,
+            shards,
         )
     except Exception as err:
         raise HTTPException(status_code=500, detail=str(err))
 
 
+@router.post("/update-location-bulk")
+async def update_locations_bulk(request: Request, shards: RedisShards = Depends(get_redis_shards), user_details: dict = Depends(validate_auth_token)):
+    """
+    Endpoint for telematics gateways reporting many vehicles at once. The body is
+    a JSON array of location updates, or NDJSON (one update per line) with an
+    `application/x-ndjson` content type. Invalid records are reported by index
+    without aborting the rest of the batch.
+    """
+    if user_details.get("user") != "internal":
+        raise HTTPException(status_code=403, detail="Unauthorized service.")
+    try:
+        return await write_bulk_locations(iter_bulk_records(request), shards)
+    except BulkRequestError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+
+
 @router.post("/driver/status")
-async def update_driver_status(status: str, redis_client: redis.Redis = Depends(get_redis), user_details: dict = Depends(validate_auth_token)):
+async def update_driver_status(status: str, trip_id: Optional[str] = None, shards: RedisShards = Depends(get_redis_shards), user_details: dict = Depends(validate_auth_token)):
     """
     Update the status of a driver (available/booked/unavailable).
+    Booking a driver with a `trip_id` records the trip's breadcrumbs until the
+    driver's status changes again.
     """
     if user_details.get("user") != "internal":
         raise HTTPException(status_code=403, detail="Unauthorized driver.")
@@ -149,32 +289,109 @@ async def update_driver_status(status: str, redis_client: redis.Redis = Depends(
     if status not in ["available", "booked", "unavailable"]:
         raise HTTPException(status_code=400, detail="Invalid status.")
 
-    exists = await redis_client.exists(f"driver:{driver_id}")
-    if not exists:
+    # Update the status and move the driver to the matching geo partition atomically,
+    # on whichever shard currently holds the driver
+    updated = await asyncio.gather(*(
+        set_driver_status_script(
+            keys=[REDIS_KEY, f"driver:{driver_id}"],
+            args=[f"driver:{driver_id}", status, trip_id or ""],
+            client=redis_client,
+        )
+        for redis_client in shards.clients
+    ))
+    if not any(updated):
         raise HTTPException(status_code=404, detail="Driver not found.")
-
-    await redis_client.hset(f"driver:{driver_id}", "status", status)
+    movement_filter.reset(driver_id)
+    if driver_index is not None:
+        driver_index.update_details(driver_id, status=status)
     return {"message": f"Driver {driver_id} status updated to {status}."}
 
 
+@router.get("/trip/{trip_id}/breadcrumbs")
+async def get_trip_route(trip_id: str, shards: RedisShards = Depends(get_redis_shards), user_details: dict = Depends(validate_auth_token)):
+    """
+    Return the route driven during a trip as an encoded polyline, with the total
+    distance in metres.
+    """
+    route = await get_trip_breadcrumbs(trip_id, shards)
+    if route is None:
+        raise HTTPException(status_code=404, detail="No breadcrumbs recorded for this trip.")
+    return route
+
+
 @router.post("/proximity")
-async def get_nearby_drivers(query: ProximityQuery, redis_client: redis.Redis = Depends(get_redis)):
+async def get_nearby_drivers(query: ProximityQuery, shards: RedisShards = Depends(get_redis_shards)):
     """
     API endpoint to get all closest drivers within a certain radius.
     """
     # if user_details.get("user") != "customer":
     #     raise HTTPException(status_code=403, detail="Unauthorized customer.")
     # print(query.__dict__)
-    drivers = await get_drivers_within_radius_with_filtering(
-        query.latitude, query.longitude, query.radius, redis_client, query.vehicle_type
-    )
+    if driver_index is not None:
+        drivers = driver_index.within_radius(
+            query.latitude, query.longitude, query.radius, query.vehicle_type, limit=query.limit
+        )
+    else:
+        # Crowds querying from the same spot share one search for a short TTL
+        drivers = await proximity_cache.get(
+            query.latitude, query.longitude, query.radius, query.vehicle_type, query.limit,
+            lambda latitude, longitude, radius: get_drivers_within_radius_with_filtering(
+                latitude, longitude, radius, shards, query.vehicle_type
+            ),
+        )
+        if drivers is None:
+            drivers = await get_drivers_within_radius_with_filtering(
+                query.latitude, query.longitude, query.radius, shards, query.vehicle_type, query.limit
+            )
     return {"drivers": drivers}
 
 
+@router.post("/nearest")
+async def get_nearest_available_drivers(query: NearestQuery, shards: RedisShards = Depends(get_redis_shards)):
+    """
+    API endpoint to get the k closest available drivers, growing the search
+    radius as needed up to `max_radius`. Drivers are ordered by distance.
+    """
+    if query.initial_radius > query.max_radius:
+        raise HTTPException(status_code=400, detail="initial_radius must not exceed max_radius.")
+    if driver_index is not None:
+        drivers, radius = driver_index.nearest(
+            query.latitude, query.longitude, query.k, query.max_radius, query.vehicle_type,
+            initial_radius=query.initial_radius,
+        )
+    else:
+        drivers, radius = await get_nearest_drivers(
+            query.latitude, query.longitude, query.k, query.initial_radius, query.max_radius,
+            shards, query.vehicle_type
+        )
+    return {"drivers": drivers, "radius": radius}
+
+
+@router.get("/heatmap")
+async def get_heatmap(
+    min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float,
+    vehicle_type: Optional[str] = None, shards: RedisShards = Depends(get_redis_shards)
+):
+    """
+    API endpoint returning the number of available drivers per geohash cell
+    (by vehicle type) inside a bounding box.
+    """
+    if min_latitude > max_latitude or min_longitude > max_longitude:
+        raise HTTPException(status_code=400, detail="Invalid bounding box.")
+    if geohash_cell_count(min_latitude, min_longitude, max_latitude, max_longitude, HEATMAP_GEOHASH_PRECISION) > settings.HEATMAP_MAX_CELLS:
+        raise HTTPException(status_code=400, detail="Bounding box too large.")
+    cells = await get_supply_heatmap(min_latitude, min_longitude, max_latitude, max_longitude, shards, vehicle_type)
+    return {
+        "precision": HEATMAP_GEOHASH_PRECISION,
+        "cells": cells,
+        "total": sum(cell["total"] for cell in cells),
+    }
+
+
 @router.websocket("/ws/driver-location")
 async def websocket_driver_location(
     websocket: WebSocket,
-    redis_client: redis.Redis = Depends(get_redis),
+    shards: RedisShards = Depends(get_redis_shards),
 ):
     """WebSocket route to provide driver location tracking."""
     # Accept the WebSocket connection first
@@ -192,38 +409,76 @@ async def websocket_driver_location(
 
     driver_id = tracking_details["driver_id"]
 
-    # Fetch driver data from Redis
-    driver_data = await redis_client.hgetall(f"driver:{driver_id}")
-    if not driver_data:
+    # Fetch driver data from whichever shard holds the driver
+    shard_data = await asyncio.gather(*(redis_client.hgetall(f"driver:{driver_id}") for redis_client in shards.clients))
+    found = [(redis_client, data) for redis_client, data in zip(shards.clients, shard_data) if data]
+    if not found:
         raise HTTPException(status_code=404, detail="Driver not found.")
+    redis_client, driver_data = found[0]
     driver_info = {
         "driver_id": driver_id,
-        "vehicle_type": driver_data.get(b"vehicle_type", b"").decode("utf-8"),
-        "rating": driver_data.get(b"rating", b"").decode("utf-8"),
-        "status": driver_data.get(b"status", b"").decode("utf-8"),
+        "vehicle_type": driver_data.get("vehicle_type", ""),
+        "rating": driver_data.get("rating", ""),
+        "status": driver_data.get("status", ""),
     }
-    
-    try:
-        while True:
-            # Fetch driver location from Redis GeoSet
-            location = await redis_client.geopos(REDIS_KEY, f"driver:{driver_id}")
-            if not location or location[0] is None:
-                raise HTTPException(status_code=404, detail="Driver location not found.")
 
-            longitude, latitude = location[0]
+    # Subscribe before reading the current position so that no update is missed
+    positions = await tracking_hub.watch(driver_id)
+    try:
+        # Send the last known position right away
+        location = await redis_client.geopos(REDIS_KEY, f"driver:{driver_id}")
+        if location and location[0] is not None:
+            driver_info["longitude"], driver_info["latitude"] = location[0]
+            await websocket.send_json(driver_info)
 
-            # Update driver location to send to the client
-            driver_info["latitude"] = latitude
-            driver_info["longitude"] = longitude
+        while True:
+            # Wait for the driver's next published position; resend the last one
+            # now and then so that closed sockets are noticed even if the driver is idle
+            try:
+                position = await asyncio.wait_for(positions.get(), timeout=settings.TRACKING_KEEPALIVE_S)
+                driver_info["latitude"] = position["latitude"]
+                driver_info["longitude"] = position["longitude"]
+            except asyncio.TimeoutError:
+                if "latitude" not in driver_info:
+                    continue
 
             # Send data to the WebSocket client
             await websocket.send_json(driver_info)
 
-            # Wait 5 seconds before sending the next update
-            await asyncio.sleep(5)
-
     except WebSocketDisconnect:
         print(f"WebSocket connection closed for driver {driver_id}")
     except Exception as e:
         print(f"Error: {e}")
-        await websocket.close()
\ No newline at end of file
+        await websocket.close()
+    finally:
+        await tracking_hub.unwatch(driver_id, positions)
+
+
+@router.get("/stats")
+async def get_stats():
+    """
+    Internal counters of this worker, used to tune the location pipeline.
+    """
+    return {
+        "ingest": location_ingest_buffer.stats(),
+        "driver_details": driver_details_client.stats(),
+        "redis_pool": redis_pool.stats(),
+        "tracking": tracking_hub.stats(),
+        "stale_drivers": stale_driver_sweeper.stats(),
+        "movement_filter": movement_filter.stats(),
+        "proximity_cache": proximity_cache.stats(),
+        "auth_tokens": auth_tokens.stats(),
+        "tracking_tokens": tracking_tokens.stats(),
+    }
+
+
+@router.get("/health")
+async def health(shards: RedisShards = Depends(get_redis_shards)):
+    """
+    Liveness of this worker and its Redis connection pools.
+    """
+    try:
+        await asyncio.gather(*(redis_client.ping() for redis_client in shards.clients))
+    except Exception as err:
+        raise HTTPException(status_code=503, detail=f"Redis unavailable: {err}")
+    return {"status": "ok", "redis_pool": redis_pool.stats()}
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 
@@ -12,4 +12,14 @@ class ProximityQuery(BaseModel):
     latitude: float
     longitude: float
     radius: float
-    vehicle_type: Optional[str] = None
\ No newline at end of file
+    vehicle_type: Optional[str] = None
+    limit: Optional[int] = Field(None, gt=0)  # Only return the closest `limit` drivers
+
+
+class NearestQuery(BaseModel):
+    latitude: float
+    longitude: float
+    vehicle_type: Optional[str] = None
+    k: int = Field(10, gt=0)                         # Number of drivers wanted
+    initial_radius: float = Field(500, gt=0)         # First search radius in metres
+    max_radius: float = Field(10000, gt=0)           # Give up growing the radius beyond this
@@ -0,0 +1,126 @@
+import math
+import zlib
+from typing import Iterator, List, Tuple
+
+import redis.asyncio as redis
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+METRES_PER_DEGREE = 111320.0
+
+# Redis GEO rejects positions outside the Web Mercator range
+GEO_MAX_LATITUDE = 85.05112878
+
+# Searches touching more geohash cells than this simply go to every shard
+MAX_COVERING_CELLS = 256
+
+
+def is_geo_position(latitude: float, longitude: float) -> bool:
+    """Whether Redis can store a position in a GEO set."""
+    return -GEO_MAX_LATITUDE <= latitude <= GEO_MAX_LATITUDE and -180.0 <= longitude <= 180.0
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int) -> str:
+    """Standard base32 geohash of a position."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(geohash)
+
+
+def geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """(height, width) in degrees of a geohash cell of the given length."""
+    lon_bits = math.ceil(5 * precision / 2)
+    lat_bits = 5 * precision - lon_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def geohash_cells(south: float, west: float, north: float, east: float, precision: int) -> Iterator[Tuple[str, float, float]]:
+    """Yield (geohash, centre latitude, centre longitude) of every cell intersecting a bounding box."""
+    cell_height, cell_width = geohash_cell_size(precision)
+    for row in range(math.floor((south + 90.0) / cell_height), math.floor((min(north, 90.0 - 1e-9) + 90.0) / cell_height) + 1):
+        latitude = -90.0 + (row + 0.5) * cell_height
+        for col in range(math.floor((west + 180.0) / cell_width), math.floor((min(east, 180.0 - 1e-9) + 180.0) / cell_width) + 1):
+            longitude = -180.0 + (col + 0.5) * cell_width
+            yield geohash_encode(latitude, longitude, precision), latitude, longitude
+
+
+def geohash_cell_count(south: float, west: float, north: float, east: float, precision: int) -> int:
+    """Number of cells `geohash_cells` would yield for a bounding box."""
+    cell_height, cell_width = geohash_cell_size(precision)
+    rows = math.floor((min(north, 90.0 - 1e-9) + 90.0) / cell_height) - math.floor((south + 90.0) / cell_height) + 1
+    cols = math.floor((min(east, 180.0 - 1e-9) + 180.0) / cell_width) - math.floor((west + 180.0) / cell_width) + 1
+    return max(rows, 0) * max(cols, 0)
+
+
+class RedisShards:
+    """
+    Routes location state to one of several Redis nodes. The area of a geohash
+    prefix of `precision` characters (~156 km cells for 3, ~39 km for 4) always
+    lives on the same node, so everything about a driver (hash, geo indexes,
+    last-seen entry, trip breadcrumbs) sits on the node of its current position.
+    Proximity searches only go to the nodes owning a cell the search circle touches.
+
+    Changing the node list or the precision remaps the cells; run
+    rebuild_indexes.py and let drivers re-register with their next ping.
+    """
+    def __init__(self, clients: List[redis.Redis], precision: int):
+        self.clients = clients
+        self.precision = precision
+        self.cell_height, self.cell_width = geohash_cell_size(precision)
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def _index_for_cell(self, geohash: str) -> int:
+        return zlib.crc32(geohash.encode()) % len(self.clients)
+
+    def index_for(self, latitude: float, longitude: float) -> int:
+        """Shard owning a position."""
+        if len(self.clients) == 1:
+            return 0
+        return self._index_for_cell(geohash_encode(latitude, longitude, self.precision))
+
+    def client_for(self, latitude: float, longitude: float) -> redis.Redis:
+        return self.clients[self.index_for(latitude, longitude)]
+
+    def indexes_for_radius(self, latitude: float, longitude: float, radius: float) -> List[int]:
+        """Shards owning any geohash cell that intersects the bounding box of the search circle."""
+        if len(self.clients) == 1:
+            return [0]
+        lat_delta = radius / METRES_PER_DEGREE
+        lon_delta = radius / (METRES_PER_DEGREE * max(math.cos(math.radians(min(abs(latitude) + lat_delta, 89.0))), 1e-6))
+        south, north = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+        rows = range(math.floor((south + 90.0) / self.cell_height), math.floor((north + 90.0) / self.cell_height) + 1)
+        cols = range(
+            math.floor((longitude - lon_delta + 180.0) / self.cell_width),
+            math.floor((longitude + lon_delta + 180.0) / self.cell_width) + 1,
+        )
+        if len(rows) * len(cols) > MAX_COVERING_CELLS:
+            return list(range(len(self.clients)))
+
+        indexes = set()
+        for row in rows:
+            cell_latitude = min(-90.0 + (row + 0.5) * self.cell_height, 90.0)
+            for col in cols:
+                cell_longitude = (col + 0.5) * self.cell_width % 360.0 - 180.0
+                indexes.add(self._index_for_cell(geohash_encode(cell_latitude, cell_longitude, self.precision)))
+                if len(indexes) == len(self.clients):
+                    return sorted(indexes)
+        return sorted(indexes)
+
+    def clients_for_radius(self, latitude: float, longitude: float, radius: float) -> List[redis.Redis]:
+        return [self.clients[index] for index in self.indexes_for_radius(latitude, longitude, radius)]
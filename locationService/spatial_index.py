@@ -0,0 +1,250 @@
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import redis.asyncio as redis
+
+from config import settings
+from redis_client import REDIS_KEY
+
+
+EARTH_RADIUS_M = 6371008.8
+METRES_PER_DEGREE = 111195.0
+
+
+def haversine_m(latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Vectorized great-circle distance in metres from one point to many."""
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - math.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class GridSpatialIndex:
+    """
+    In-process uniform lat/lon grid of driver positions.
+
+    Coordinates, vehicle type, status and rating live in NumPy arrays indexed by a
+    per-driver slot, and every grid cell keeps the slots of the drivers inside it.
+    A query only touches the cells overlapping the search circle and filters the
+    candidates with a single vectorized haversine pass.
+    """
+    def __init__(self, cell_size_deg: float = 0.01, capacity: int = 1024):
+        self.cell_size = cell_size_deg
+        self.latitudes = np.zeros(capacity)
+        self.longitudes = np.zeros(capacity)
+        self.ratings = np.full(capacity, np.nan)
+        self.timestamps = np.zeros(capacity)
+        self.vehicle_types = np.full(capacity, -1, dtype=np.int16)
+        self.statuses = np.full(capacity, -1, dtype=np.int8)
+
+        self.slots: Dict[str, int] = {}
+        self.driver_ids: List[Optional[str]] = [None] * capacity
+        self.slot_cells: List[Optional[Tuple[int, int]]] = [None] * capacity
+        self.free_slots: List[int] = list(range(capacity - 1, -1, -1))
+        self.cells: Dict[Tuple[int, int], set] = {}
+
+        # Small integer codes so that filtering stays vectorized
+        self.vehicle_type_codes: Dict[str, int] = {}
+        self.vehicle_type_names: List[str] = []
+        self.status_codes: Dict[str, int] = {}
+        self.status_names: List[str] = []
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return (math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size))
+
+    def _grow(self):
+        capacity = len(self.driver_ids)
+        self.latitudes = np.concatenate([self.latitudes, np.zeros(capacity)])
+        self.longitudes = np.concatenate([self.longitudes, np.zeros(capacity)])
+        self.ratings = np.concatenate([self.ratings, np.full(capacity, np.nan)])
+        self.timestamps = np.concatenate([self.timestamps, np.zeros(capacity)])
+        self.vehicle_types = np.concatenate([self.vehicle_types, np.full(capacity, -1, dtype=np.int16)])
+        self.statuses = np.concatenate([self.statuses, np.full(capacity, -1, dtype=np.int8)])
+        self.driver_ids.extend([None] * capacity)
+        self.slot_cells.extend([None] * capacity)
+        self.free_slots.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    @staticmethod
+    def _code(value: str, codes: Dict[str, int], names: List[str]) -> int:
+        if value not in codes:
+            codes[value] = len(names)
+            names.append(value)
+        return codes[value]
+
+    def upsert(
+        self, driver_id: str, latitude: float, longitude: float,
+        vehicle_type: str = None, status: str = None, rating=None, timestamp: float = None
+    ):
+        """Add or move a driver. Metadata left as None keeps its previous value."""
+        slot = self.slots.get(driver_id)
+        if slot is None:
+            if not self.free_slots:
+                self._grow()
+            slot = self.free_slots.pop()
+            self.slots[driver_id] = slot
+            self.driver_ids[slot] = driver_id
+
+        cell = self._cell(latitude, longitude)
+        if self.slot_cells[slot] != cell:
+            if self.slot_cells[slot] is not None:
+                self.cells[self.slot_cells[slot]].discard(slot)
+            self.cells.setdefault(cell, set()).add(slot)
+            self.slot_cells[slot] = cell
+
+        self.latitudes[slot] = latitude
+        self.longitudes[slot] = longitude
+        self.timestamps[slot] = time.time() if timestamp is None else timestamp
+        self.update_details(driver_id, vehicle_type, status, rating)
+
+    def touch(self, driver_id: str, timestamp: float = None):
+        """Mark an indexed driver as seen without moving it."""
+        slot = self.slots.get(driver_id)
+        if slot is not None:
+            self.timestamps[slot] = time.time() if timestamp is None else timestamp
+
+    def update_details(self, driver_id: str, vehicle_type: str = None, status: str = None, rating=None):
+        """Update the metadata of an indexed driver. Values left as None are kept."""
+        slot = self.slots.get(driver_id)
+        if slot is None:
+            return
+        if vehicle_type:
+            self.vehicle_types[slot] = self._code(vehicle_type, self.vehicle_type_codes, self.vehicle_type_names)
+        if status:
+            self.statuses[slot] = self._code(status, self.status_codes, self.status_names)
+        if rating not in (None, ""):
+            self.ratings[slot] = float(rating)
+
+    def remove(self, driver_id: str):
+        slot = self.slots.pop(driver_id, None)
+        if slot is None:
+            return
+        self.cells[self.slot_cells[slot]].discard(slot)
+        self.slot_cells[slot] = None
+        self.driver_ids[slot] = None
+        self.vehicle_types[slot] = -1
+        self.statuses[slot] = -1
+        self.ratings[slot] = np.nan
+        self.free_slots.append(slot)
+
+    def stale_drivers(self, cutoff: float) -> List[str]:
+        """Drivers whose last position is older than `cutoff`."""
+        slots = np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots))
+        return [self.driver_ids[slot] for slot in slots[self.timestamps[slots] < cutoff].tolist()]
+
+    def _candidates(self, latitude: float, longitude: float, lat_cells: int, lon_cells: int) -> np.ndarray:
+        row, col = self._cell(latitude, longitude)
+        slots = []
+        for r in range(row - lat_cells, row + lat_cells + 1):
+            for c in range(col - lon_cells, col + lon_cells + 1):
+                members = self.cells.get((r, c))
+                if members:
+                    slots.extend(members)
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+
+    def _cell_span(self, latitude: float, radius: float) -> Tuple[int, int]:
+        """Number of cells to each side needed to cover `radius` metres around `latitude`."""
+        lat_degrees = radius / METRES_PER_DEGREE
+        lon_degrees = lat_degrees / max(math.cos(math.radians(min(abs(latitude) + lat_degrees, 89.0))), 1e-6)
+        return math.ceil(lat_degrees / self.cell_size), math.ceil(lon_degrees / self.cell_size)
+
+    def _filter(self, slots: np.ndarray, vehicle_type: Optional[str], status: Optional[str]) -> np.ndarray:
+        mask = np.ones(len(slots), dtype=bool)
+        if vehicle_type is not None:
+            mask &= self.vehicle_types[slots] == self.vehicle_type_codes.get(vehicle_type, -2)
+        if status is not None:
+            mask &= self.statuses[slots] == self.status_codes.get(status, -2)
+        return slots[mask]
+
+    def _results(self, slots: np.ndarray, distances: np.ndarray) -> List[Dict]:
+        vehicle_type_names = self.vehicle_type_names + [None]  # code -1 maps to None
+        status_names = self.status_names + [None]
+        ratings = self.ratings[slots]
+        return [
+            {
+                "driver_id": self.driver_ids[slot],
+                "distance": distance,
+                "latitude": latitude,
+                "longitude": longitude,
+                "vehicle_type": vehicle_type_names[vehicle_type],
+                "rating": rating,
+                "status": status_names[status],
+            }
+            for slot, distance, latitude, longitude, vehicle_type, rating, status in zip(
+                slots.tolist(),
+                distances.tolist(),
+                self.latitudes[slots].tolist(),
+                self.longitudes[slots].tolist(),
+                self.vehicle_types[slots].tolist(),
+                np.where(np.isnan(ratings), None, ratings).tolist(),
+                self.statuses[slots].tolist(),
+            )
+        ]
+
+    def within_radius(
+        self, latitude: float, longitude: float, radius: float,
+        vehicle_type: str = None, status: Optional[str] = "available", limit: int = None
+    ) -> List[Dict]:
+        """Drivers within `radius` metres, closest first."""
+        slots = self._filter(self._candidates(latitude, longitude, *self._cell_span(latitude, radius)), vehicle_type, status)
+        distances = haversine_m(latitude, longitude, self.latitudes[slots], self.longitudes[slots])
+        inside = distances <= radius
+        slots, distances = slots[inside], distances[inside]
+
+        if limit is not None and limit < len(slots):
+            nearest = np.argpartition(distances, limit)[:limit]
+            slots, distances = slots[nearest], distances[nearest]
+        order = np.argsort(distances)
+        return self._results(slots[order], distances[order])
+
+    def nearest(
+        self, latitude: float, longitude: float, k: int, max_radius: float,
+        vehicle_type: str = None, status: Optional[str] = "available", initial_radius: float = None
+    ) -> Tuple[List[Dict], float]:
+        """
+        The `k` closest drivers within `max_radius` metres, found by doubling the search
+        radius (starting at one cell). Returns the drivers and the radius searched last.
+        """
+        if initial_radius is None:
+            initial_radius = self.cell_size * METRES_PER_DEGREE * max(math.cos(math.radians(min(abs(latitude), 89.0))), 1e-6)
+        radius = initial_radius
+        while True:
+            radius = min(radius, max_radius)
+            found = self.within_radius(latitude, longitude, radius, vehicle_type, status, limit=k)
+            if len(found) >= k or radius >= max_radius:
+                return found, radius
+            radius *= 2
+
+
+async def load_index_from_redis(index: GridSpatialIndex, redis_client: redis.Redis, batch_size: int = 500):
+    """Warm the in-process index from the driver geo set and hashes already in Redis."""
+    async def load_batch(driver_keys):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for driver_key in driver_keys:
+                pipe.hmget(driver_key, "vehicle_type", "status", "rating")
+            details = await pipe.execute()
+        positions = await redis_client.geopos(REDIS_KEY, *driver_keys)
+        for driver_key, (vehicle_type, status, rating), position in zip(driver_keys, details, positions):
+            if position is None:
+                continue
+            longitude, latitude = position
+            index.upsert(driver_key.split(":")[1], latitude, longitude, vehicle_type, status, rating)
+
+    batch = []
+    async for driver_key, _ in redis_client.zscan_iter(REDIS_KEY, count=batch_size):
+        batch.append(driver_key)
+        if len(batch) >= batch_size:
+            await load_batch(batch)
+            batch = []
+    if batch:
+        await load_batch(batch)
+
+
+# Only maintained when the grid backend is selected
+driver_index = GridSpatialIndex(settings.GRID_CELL_SIZE_DEG) if settings.PROXIMITY_BACKEND == "grid" else None
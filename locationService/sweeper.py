@@ -0,0 +1,107 @@
+import asyncio
+import time
+from collections import deque
+from typing import Tuple
+
+import redis.asyncio as redis
+
+from config import settings
+from redis_client import REDIS_KEY, LAST_SEEN_KEY, sweep_stale_drivers_script
+from sharding import RedisShards
+from spatial_index import driver_index
+from movement_filter import movement_filter
+
+
+class StaleDriverSweeper:
+    """
+    Background task that removes drivers who stopped sending locations (e.g. closed
+    the app) from proximity search. Every `interval` seconds, drivers whose last
+    ping in `drivers:last_seen` is older than `window` are evicted from the geo
+    indexes or marked unavailable, `batch_size` drivers per Redis call. Shards
+    are swept in parallel.
+    """
+    def __init__(self, window: int, interval: int, batch_size: int, action: str):
+        if action not in ("evict", "unavailable"):
+            raise ValueError(f"Invalid stale driver action: {action}")
+        self.window = window
+        self.interval = interval
+        self.batch_size = batch_size
+        self.action = action
+
+        # Metrics
+        self.sweeps = 0
+        self.swept = 0
+        self.last_sweep_ms = 0.0
+        self.index_sizes = deque(maxlen=120)  # (timestamp, drivers:locations size, last-seen size)
+
+    async def _sweep_shard(self, redis_client: redis.Redis, cutoff: float) -> Tuple[int, int, int]:
+        """Sweep one Redis node. Returns the number swept and the node's index sizes."""
+        swept = 0
+        while True:
+            members = await sweep_stale_drivers_script(
+                keys=[REDIS_KEY, LAST_SEEN_KEY],
+                args=[cutoff, self.batch_size, self.action],
+                client=redis_client,
+            )
+            swept += len(members)
+            if len(members) < self.batch_size:
+                break
+            await asyncio.sleep(0)  # Let requests through between batches
+
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zcard(REDIS_KEY)
+            pipe.zcard(LAST_SEEN_KEY)
+            index_size, last_seen_size = await pipe.execute()
+        return swept, index_size, last_seen_size
+
+    async def sweep(self, shards: RedisShards) -> int:
+        """Process every driver that went stale on any shard, in bounded batches."""
+        started = time.perf_counter()
+        cutoff = time.time() - self.window
+        results = await asyncio.gather(*(self._sweep_shard(redis_client, cutoff) for redis_client in shards.clients))
+        swept, index_size, last_seen_size = (sum(values) for values in zip(*results))
+
+        movement_filter.prune(time.time() - movement_filter.max_interval)
+
+        # The in-process index only sees pings handled by this worker, so it is swept on its own
+        if driver_index is not None:
+            for driver_id in driver_index.stale_drivers(cutoff):
+                if self.action == "evict":
+                    driver_index.remove(driver_id)
+                else:
+                    driver_index.update_details(driver_id, status="unavailable")
+
+        self.sweeps += 1
+        self.swept += swept
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        self.index_sizes.append((round(time.time()), index_size, last_seen_size))
+        return swept
+
+    async def run(self, shards: RedisShards):
+        """Sweep loop, started from the application lifespan."""
+        while True:
+            try:
+                await self.sweep(shards)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Error sweeping stale drivers: ", str(e))
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "action": self.action,
+            "window_s": self.window,
+            "sweeps": self.sweeps,
+            "evicted" if self.action == "evict" else "marked_unavailable": self.swept,
+            "last_sweep_ms": round(self.last_sweep_ms, 3),
+            "index_size_history": list(self.index_sizes),
+        }
+
+
+stale_driver_sweeper = StaleDriverSweeper(
+    settings.STALE_DRIVER_WINDOW_S,
+    settings.STALE_DRIVER_SWEEP_INTERVAL_S,
+    settings.STALE_DRIVER_SWEEP_BATCH_SIZE,
+    settings.STALE_DRIVER_ACTION,
+)
@@ -0,0 +1,101 @@
+import asyncio
+import json
+from typing import Dict, List, Set
+
+import redis.asyncio as redis
+
+from redis_client import location_channel
+from sharding import RedisShards
+
+
+class TrackingHub:
+    """
+    Fans out live driver positions to the customers tracking them on this worker.
+
+    The worker holds one Redis subscription per tracked driver, however many
+    customers watch that driver, and positions are pushed as soon as ingest
+    publishes them. Each watcher queue only keeps the latest position, so a slow
+    customer socket never builds up a backlog. With sharded location state the
+    driver's channel is subscribed on every shard, since positions are published
+    on whichever shard holds the driver.
+    """
+    def __init__(self):
+        self.watchers: Dict[str, Set[asyncio.Queue]] = {}
+        self.pubsubs: List[redis.client.PubSub] = []
+        self._subscribed = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+        # Metrics
+        self.messages = 0
+        self.deliveries = 0
+
+    async def watch(self, driver_id: str) -> asyncio.Queue:
+        """Register a watcher for a driver, subscribing to its channel if it is the first one."""
+        queue = asyncio.Queue(maxsize=1)
+        async with self._lock:
+            if driver_id not in self.watchers:
+                self.watchers[driver_id] = set()
+                for pubsub in self.pubsubs:
+                    await pubsub.subscribe(location_channel(driver_id))
+                self._subscribed.set()
+            self.watchers[driver_id].add(queue)
+        return queue
+
+    async def unwatch(self, driver_id: str, queue: asyncio.Queue):
+        """Remove a watcher, unsubscribing from the driver's channel after the last one."""
+        async with self._lock:
+            queues = self.watchers.get(driver_id)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self.watchers[driver_id]
+                for pubsub in self.pubsubs:
+                    await pubsub.unsubscribe(location_channel(driver_id))
+
+    def _fan_out(self, driver_id: str, position: dict):
+        self.messages += 1
+        for queue in self.watchers.get(driver_id, ()):
+            if queue.full():
+                queue.get_nowait()  # Drop the stale position
+            queue.put_nowait(position)
+            self.deliveries += 1
+
+    async def _listen(self, pubsub: redis.client.PubSub):
+        while True:
+            if not pubsub.subscribed:
+                # Nothing to read until the first driver is watched
+                self._subscribed.clear()
+                await self._subscribed.wait()
+                continue
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Error reading driver locations: ", str(e))
+                await asyncio.sleep(1)
+                continue
+            if message and message["type"] == "message":
+                driver_id = message["channel"].split(":")[1]
+                self._fan_out(driver_id, json.loads(message["data"]))
+
+    async def run(self, shards: RedisShards):
+        """Listener loop, started from the application lifespan."""
+        self.pubsubs = [redis_client.pubsub(ignore_subscribe_messages=True) for redis_client in shards.clients]
+        try:
+            await asyncio.gather(*(self._listen(pubsub) for pubsub in self.pubsubs))
+        finally:
+            for pubsub in self.pubsubs:
+                await pubsub.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "tracked_drivers": len(self.watchers),
+            "watchers": sum(len(queues) for queues in self.watchers.values()),
+            "messages": self.messages,
+            "deliveries": self.deliveries,
+        }
+
+
+tracking_hub = TrackingHub()
@@ -7,6 +7,7 @@ class Settings(BaseSettings):
     ALGORITHM: str
     AWS_ACCESS_KEY: str
     AWS_SECRET_ACCESS_KEY: str
+    TOKEN_CACHE_SIZE: int = 10000   # Verified JWTs kept until they expire (0 verifies every request)
     
     class Config:
         env_file = ".env"
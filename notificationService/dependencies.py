@@ -2,14 +2,17 @@ import jwt
 from fastapi import HTTPException, status, Header
 
 from config import settings
+from token_cache import VerifiedTokenCache
+
+
+# Signatures are verified once per token, then reused until the token expires
+auth_tokens = VerifiedTokenCache(settings.AUTH_UNIVERSAL_SECRET, [settings.ALGORITHM], settings.TOKEN_CACHE_SIZE)
 
 
 def validate_token(token: str = Header(...)):
     try:
         # Step 1: Decode the token
-        user_details = jwt.decode(
-            token, settings.AUTH_UNIVERSAL_SECRET, algorithms=[settings.ALGORITHM]
-        )
+        user_details = auth_tokens.decode(token)
 
         # Step 2: Extract user ID from the decoded token, if None forbid it
         user_id = user_details.get("user_id")
@@ -10,6 +10,7 @@ from sqs import SQSManager
 from sse import SSEManager
 from config import settings
 from dependencies import validate_token
+from metrics import MetricsMiddleware, metrics_endpoint
 
 # Ignore Deprecation Warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -47,6 +48,9 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
 )
+app.add_middleware(MetricsMiddleware)
+
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 
 @app.get("/notification-stream")
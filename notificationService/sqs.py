@@ -3,6 +3,7 @@ import asyncio
 import json
 
 from config import settings
+from metrics import timed_call
 
 class SQSManager:
     def __init__(self):
@@ -15,11 +16,12 @@ class SQSManager:
         print(f"Waiting for messages from {self.queue_url}. To exit press CTRL+C...")
         while True:
             try:
-                response = self.sqs.receive_message(
-                    QueueUrl=self.queue_url,
-                    MaxNumberOfMessages=1,
-                    WaitTimeSeconds=10
-                )
+                with timed_call("sqs", "receive_message"):
+                    response = self.sqs.receive_message(
+                        QueueUrl=self.queue_url,
+                        MaxNumberOfMessages=1,
+                        WaitTimeSeconds=10
+                    )
 
                 messages = response.get('Messages', [])
                 for message in messages:
@@ -35,10 +37,11 @@ class SQSManager:
                     await broadcast_function(user_id, user_type, message_body, status, params)
 
                     # Delete the message from SQS after processing
-                    self.sqs.delete_message(
-                        QueueUrl=self.queue_url,
-                        ReceiptHandle=message['ReceiptHandle']
-                    )
+                    with timed_call("sqs", "delete_message"):
+                        self.sqs.delete_message(
+                            QueueUrl=self.queue_url,
+                            ReceiptHandle=message['ReceiptHandle']
+                        )
 
                 await asyncio.sleep(1)
             except Exception as e:
@@ -12,6 +12,7 @@ class Settings(BaseSettings):
     AWS_SECRET_ACCESS_KEY: str
     AUTH_SERVICE_URL: str   # localhost:8000/
     LOCATION_SERVICE_URL: str   # localhost:8004/
+    TOKEN_CACHE_SIZE: int = 10000   # Verified JWTs kept until they expire (0 verifies every request)
     
     class Config:
         env_file = ".env"
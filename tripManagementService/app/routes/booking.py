@@ -6,6 +6,7 @@ from app.schemas.booking import BookingCreate, ActiveTripResponse, CompletedTrip
 from app.models.booking import Booking
 from app.database import DBFactory
 from app.utils.dependencies import validate_token, generate_tracking_token
+from app.utils.metrics import timed_call
 from app.config import settings
 
 
@@ -30,11 +31,12 @@ async def create_new_booking(booking: BookingCreate):
                 settings.AUTH_UNIVERSAL_SECRET,
                 algorithm=settings.ALGORITHM,
             )
-            requests.post(
-                f"{settings.LOCATION_SERVICE_URL}driver/status",
-                params={"status": "booked"},
-                headers={"token": access_token}
-            )
+            with timed_call("location_service", "driver_status"):
+                requests.post(
+                    f"{settings.LOCATION_SERVICE_URL}driver/status",
+                    params={"status": "booked", "trip_id": new_booking.id},
+                    headers={"token": access_token}
+                )
             return new_booking
         
     except Exception as err:
@@ -123,11 +125,12 @@ async def cancel_trip(booking_id: str, user_details: dict = Depends(validate_tok
                 settings.AUTH_UNIVERSAL_SECRET,
                 algorithm=settings.ALGORITHM,
             )
-            requests.post(
-                f"{settings.LOCATION_SERVICE_URL}driver/status",
-                params={"status": "available"},
-                headers={"token": access_token}
-            )
+            with timed_call("location_service", "driver_status"):
+                requests.post(
+                    f"{settings.LOCATION_SERVICE_URL}driver/status",
+                    params={"status": "available"},
+                    headers={"token": access_token}
+                )
             return {"status": "Trip Cancelled", "booking_id": updated_booking.id}
 
     except Exception as err:
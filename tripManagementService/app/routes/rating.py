@@ -6,6 +6,7 @@ from app.models.booking import Booking
 from app.database import DBFactory
 from app.config import settings
 from app.utils.dependencies import validate_token
+from app.utils.metrics import timed_call
 
 router = APIRouter()
 
@@ -30,10 +31,11 @@ def submit_rating(rating_data: RatingCreate, user_details: dict = Depends(valida
             # Create and store the rating
             new_rating = Rating.create_rating(db, rating_data)
             # Update driver rating in auth service
-            requests.post(
-                f"{settings.AUTH_SERVICE_URL}driver/update-rating",
-                params={"driver_id": rating_data.driver_id, "rating": rating_data.rating},
-            )
+            with timed_call("auth_service", "update_rating"):
+                requests.post(
+                    f"{settings.AUTH_SERVICE_URL}driver/update-rating",
+                    params={"driver_id": rating_data.driver_id, "rating": rating_data.rating},
+                )
 
             return new_rating
     
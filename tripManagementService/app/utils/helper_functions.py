@@ -4,6 +4,7 @@ import boto3
 import json
 from sqlalchemy import text
 from app.config import settings
+from app.utils.metrics import timed_call
 
 
 sqs = boto3.client('sqs', region_name='ap-south-1', aws_access_key_id=settings.AWS_ACCESS_KEY, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
@@ -25,8 +26,9 @@ def convert_point_to_ll(point):
 
 
 def publish_to_sqs(message: dict):
-    response = sqs.send_message(
-        QueueUrl=notification_queue_url,
-        MessageBody=json.dumps(message)
-    )
+    with timed_call("sqs", "send_message"):
+        response = sqs.send_message(
+            QueueUrl=notification_queue_url,
+            MessageBody=json.dumps(message)
+        )
     return response
\ No newline at end of file
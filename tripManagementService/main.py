@@ -6,6 +6,7 @@ import asyncio
 
 from sqs import consume_sqs_messages
 from app.config import settings
+from app.utils.metrics import MetricsMiddleware, metrics_endpoint
 from app.routes.booking import router as booking_router
 from app.routes.payment import router as payment_router
 from app.routes.rating import router as rating_router
@@ -23,11 +24,13 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
 )
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(booking_router, prefix="/bookings", tags=["Bookings"])
 app.include_router(rating_router, prefix="/ratings", tags=["Ratings"])
 app.include_router(payment_router, prefix="/payments", tags=["Payments"])
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 
 @app.on_event("startup")
@@ -2,6 +2,7 @@ import boto3
 import asyncio
 from app.routes.booking import create_new_booking
 from app.config import settings
+from app.utils.metrics import timed_call
 
 
 # Initialize SQS client
@@ -16,11 +17,12 @@ async def consume_sqs_messages():
     """
     while True:
         try:
-            response = sqs.receive_message(
-                QueueUrl=QUEUE_URL,
-                MaxNumberOfMessages=10,  # Fetch up to 10 messages at once
-                WaitTimeSeconds=10
-            )
+            with timed_call("sqs", "receive_message"):
+                response = sqs.receive_message(
+                    QueueUrl=QUEUE_URL,
+                    MaxNumberOfMessages=10,  # Fetch up to 10 messages at once
+                    WaitTimeSeconds=10
+                )
 
             if "Messages" in response:
                 tasks = [create_new_booking(msg) for msg in response["Messages"]]
@@ -28,7 +30,8 @@ async def consume_sqs_messages():
 
                 # Delete processed messages from the queue
                 for msg in response["Messages"]:
-                    sqs.delete_message(QueueUrl=QUEUE_URL, ReceiptHandle=msg["ReceiptHandle"])
+                    with timed_call("sqs", "delete_message"):
+                        sqs.delete_message(QueueUrl=QUEUE_URL, ReceiptHandle=msg["ReceiptHandle"])
             await asyncio.sleep(1)
         except Exception as e:
             print("Error consuming messages from SQS: ", str(e))